@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+"""
+Coroutines of ``drivers`` (python 3 only).
+"""
+
+from .drivers import asyncpg_codecs
+
+
+async def register_asyncpg(connection):
+    """
+    Set the binary codecs of the geometric types on an asyncpg
+    connection, one after the other: asyncpg does not allow concurrent
+    operations on a connection.
+    """
+    for typename, kwargs in asyncpg_codecs():
+        await connection.set_type_codec(typename, **kwargs)
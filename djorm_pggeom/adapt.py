@@ -1,50 +1,95 @@
 # -*- coding: utf-8 -*-
 
-from psycopg2.extensions import adapt, AsIs
+
+_SPECIAL_NUMBERS = {'inf': 'Infinity', '-inf': '-Infinity', 'nan': 'NaN'}
+
+""" PYTHON->TEXT ENCODING (postgresql input format) """
+
+def text_number(value):
+    text = repr(float(value))
+    return _SPECIAL_NUMBERS.get(text, text)
+
+def _text_points(coords):
+    numbers = iter([text_number(x) for x in coords])
+    return ",".join(["(%s,%s)" % pair for pair in zip(numbers, numbers)])
+
+def text_point(point):
+    return "(%s,%s)" % (text_number(point.x), text_number(point.y))
+
+def text_circle(c):
+    return "<%s,%s>" % (text_point(c.point), text_number(c.r))
+
+def text_lseg(l):
+    return "[(%s,%s),(%s,%s)]" % (
+        text_number(l.start_point.x),
+        text_number(l.start_point.y),
+        text_number(l.end_point.x),
+        text_number(l.end_point.y)
+    )
+
+def text_box(box):
+    return "(%s,%s),(%s,%s)" % (
+        text_number(box.start_point.x),
+        text_number(box.start_point.y),
+        text_number(box.end_point.x),
+        text_number(box.end_point.y)
+    )
+
+def text_path(path):
+    if path.closed:
+        return "(%s)" % _text_points(path.coords)
+    return "[%s]" % _text_points(path.coords)
+
+def text_polygon(path):
+    return "(%s)" % _text_points(path.coords)
+
+
+TEXT_MAPPER = {
+    'Point': text_point,
+    'Circle': text_circle,
+    'Box': text_box,
+    'Path': text_path,
+    'Polygon': text_polygon,
+    'Lseg': text_lseg,
+}
+
+def to_text(value):
+    """
+    Return the postgresql input text of a geometric value, or None if
+    value is not a geometric object.
+    """
+    encoder = TEXT_MAPPER.get(type(value).__name__)
+    if encoder is None:
+        return None
+    return encoder(value)
 
 
 """ PYTHON->SQL ADAPTATION """
 
+# psycopg2 is imported by the adapters (called by psycopg2 only), so the
+# geometric objects can be used without it
+
+def as_is(sql):
+    from psycopg2.extensions import AsIs
+    return AsIs(sql)
+
 def adapt_point(point):
-    return AsIs(u"point '(%s, %s)'" % (adapt(point.x), adapt(point.y)))
+    return as_is("'%s'::point" % text_point(point))
 
 def adapt_circle(c):
-    return AsIs(u"circle '<(%s,%s),%s>'" % \
-        (adapt(c.point.x), adapt(c.point.y), adapt(c.r)))
+    return as_is("'%s'::circle" % text_circle(c))
 
 def adapt_lseg(l):
-    return AsIs(u"'[(%s,%s), (%s,%s)]'::lseg" % (\
-        adapt(l.start_point.x),
-        adapt(l.start_point.y),
-        adapt(l.end_point.x),
-        adapt(l.end_point.y)
-    ))
+    return as_is("'%s'::lseg" % text_lseg(l))
 
 def adapt_box(box):
-    return AsIs("'(%s,%s),(%s,%s)'::box" % (
-        adapt(box.start_point.x),
-        adapt(box.start_point.y),
-        adapt(box.end_point.x),
-        adapt(box.end_point.y)
-    ))
+    return as_is("'%s'::box" % text_box(box))
 
 def adapt_path(path):
-    container = "'[%s]'::path"
-    if path.closed:
-        container = "'(%s)'::path"
-
-    points = ["(%s,%s)" % (x, y) \
-        for x, y in path]
-    return AsIs(container % (",".join(points)))
-
+    return as_is("'%s'::path" % text_path(path))
 
 def adapt_polygon(path):
-    container = "'(%s)'::polygon"
-
-    points = ["(%s,%s)" % (x, y) \
-        for x, y in path]
-
-    return AsIs(container % (",".join(points)))
+    return as_is("'%s'::polygon" % text_polygon(path))
 
 
 ADAPT_MAPPER = {
@@ -56,3 +101,52 @@ ADAPT_MAPPER = {
     'Lseg': adapt_lseg,
 }
 
+
+""" PYTHON->SQL ARRAY ADAPTATION """
+
+# pg_type.typdelim: box values contain commas
+ARRAY_DELIMITERS = {'Box': ';'}
+
+def array_type_name(values):
+    """
+    Return the type name shared by the not null elements of a sequence
+    of geometric values, or None if it is not such a sequence.
+    """
+    names = set([x.__class__.__name__ for x in values if x is not None])
+    if len(names) == 1:
+        name = names.pop()
+        if name in ADAPT_MAPPER:
+            return name
+    return None
+
+def text_array(values, type_name):
+    delimiter = ARRAY_DELIMITERS.get(type_name, ",")
+    return "{%s}" % delimiter.join([
+        "NULL" if x is None else '"%s"' % to_text(x) for x in values])
+
+class GeometricArray(object):
+    """
+    Geometric values of one type (or None) sent as one array parameter
+    (``'{...}'::point[]``); other lists and tuples are adapted by
+    psycopg2 as usual::
+
+        cursor.execute("SELECT id FROM zones WHERE area @> ANY(%s)",
+                       [GeometricArray(points)])
+
+    ``type_name`` is required for empty sequences.
+    """
+
+    def __init__(self, values, type_name=None):
+        self.values = list(values)
+        self.type_name = type_name or array_type_name(self.values)
+        if self.type_name not in ADAPT_MAPPER:
+            raise TypeError("GeometricArray requires geometric values of one type")
+
+    def __conform__(self, protocol):
+        from psycopg2.extensions import ISQLQuote
+        if protocol is ISQLQuote:
+            return self
+
+    def getquoted(self):
+        return ("'%s'::%s[]" % (text_array(self.values, self.type_name),
+                                self.type_name.lower())).encode("ascii")
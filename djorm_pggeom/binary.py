@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""
+Codecs for the binary wire format of the postgresql geometric types
+(``point_send``, ``point_recv``...).
+
+Every type is sent as big endian float8 values; paths are prefixed with
+a closed flag (int8) and the number of points (int32) and polygons with
+the number of points. Path and polygon coordinates are loaded in one
+step into the ``array('d')`` of the object.
+"""
+
+import struct
+import sys
+from array import array
+
+from .objects import Point, Circle, Lseg, Box, Path, Polygon
+
+_SWAP = sys.byteorder == "little"
+
+_POINT = struct.Struct(">dd")
+_CIRCLE = struct.Struct(">ddd")
+_QUAD = struct.Struct(">dddd")
+_PATH_HEADER = struct.Struct(">bi")
+_POLYGON_HEADER = struct.Struct(">i")
+
+try:
+    _view = buffer
+except NameError:
+    # python 3
+    def _view(data, offset):
+        return memoryview(data)[offset:]
+
+_frombytes = getattr(array, "frombytes", None) or array.fromstring
+_tobytes = getattr(array, "tobytes", None) or array.tostring
+
+
+def _error(typename, data):
+    return ValueError("bad %s binary representation: %r" % (typename, bytes(data)))
+
+
+def _read_coords(data, offset, npoints, typename):
+    if npoints < 1 or len(data) - offset != npoints * 16:
+        raise _error(typename, data)
+
+    coords = array('d')
+    _frombytes(coords, _view(data, offset))
+    if _SWAP:
+        coords.byteswap()
+    return coords
+
+
+def _write_coords(coords):
+    if _SWAP:
+        coords = array('d', coords)
+        coords.byteswap()
+    return _tobytes(coords)
+
+
+""" BINARY->PYTHON """
+
+def recv_point(data):
+    try:
+        return Point(*_POINT.unpack(data))
+    except struct.error:
+        raise _error("point", data)
+
+def recv_circle(data):
+    try:
+        x, y, r = _CIRCLE.unpack(data)
+    except struct.error:
+        raise _error("circle", data)
+    return Circle([x, y], r)
+
+def recv_lseg(data):
+    try:
+        x1, y1, x2, y2 = _QUAD.unpack(data)
+    except struct.error:
+        raise _error("lseg", data)
+    return Lseg([x1, y1], [x2, y2])
+
+def recv_box(data):
+    # high point first
+    try:
+        return Box.from_tuple(_QUAD.unpack(data))
+    except struct.error:
+        raise _error("box", data)
+
+def recv_path(data):
+    try:
+        closed, npoints = _PATH_HEADER.unpack_from(data)
+    except struct.error:
+        raise _error("path", data)
+
+    coords = _read_coords(data, _PATH_HEADER.size, npoints, "path")
+    return Path.from_coords(coords, closed=bool(closed), copy=False)
+
+def recv_polygon(data):
+    try:
+        npoints, = _POLYGON_HEADER.unpack_from(data)
+    except struct.error:
+        raise _error("polygon", data)
+
+    coords = _read_coords(data, _POLYGON_HEADER.size, npoints, "polygon")
+    return Polygon.from_coords(coords, copy=False)
+
+
+RECV_MAPPER = {
+    'Point': recv_point,
+    'Circle': recv_circle,
+    'Box': recv_box,
+    'Path': recv_path,
+    'Polygon': recv_polygon,
+    'Lseg': recv_lseg,
+}
+
+
+""" PYTHON->BINARY """
+
+def send_point(point):
+    return _POINT.pack(point.x, point.y)
+
+def send_circle(c):
+    return _CIRCLE.pack(c.point.x, c.point.y, c.r)
+
+def send_lseg(l):
+    return _QUAD.pack(l.start_point.x, l.start_point.y,
+                      l.end_point.x, l.end_point.y)
+
+def send_box(box):
+    (x1, y1), (x2, y2) = box
+    return _QUAD.pack(max(x1, x2), max(y1, y2), min(x1, x2), min(y1, y2))
+
+def send_path(path):
+    return _PATH_HEADER.pack(path.closed, len(path.coords) // 2) + \
+        _write_coords(path.coords)
+
+def send_polygon(path):
+    return _POLYGON_HEADER.pack(len(path.coords) // 2) + _write_coords(path.coords)
+
+
+SEND_MAPPER = {
+    'Point': send_point,
+    'Circle': send_circle,
+    'Box': send_box,
+    'Path': send_path,
+    'Polygon': send_polygon,
+    'Lseg': send_lseg,
+}
+
+def to_binary(value):
+    """
+    Return the binary representation of a geometric value, or None if
+    value is not a geometric object.
+    """
+    encoder = SEND_MAPPER.get(value.__class__.__name__)
+    if encoder is None:
+        return None
+    return encoder(value)
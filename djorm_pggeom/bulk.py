@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+Bulk loading of models with geometric fields using
+``COPY ... FROM STDIN`` instead of INSERT statements, and export with
+``COPY ... TO STDOUT``, in text or binary format.
+"""
+
+import datetime
+import struct
+
+from django.db import connections, router, transaction
+from django.db.models import AutoField
+
+from .adapt import to_text
+from .binary import RECV_MAPPER, SEND_MAPPER
+from .fields import GeometricField, BoundingBoxField, bounding_box
+
+COPY_NULL = "\\N"
+COPY_ESCAPES = (("\\", "\\\\"), ("\t", "\\t"), ("\n", "\\n"), ("\r", "\\r"))
+
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+
+_INT16 = struct.Struct(">h")
+_INT32 = struct.Struct(">i")
+
+
+def copy_text(value):
+    """
+    Encode one python value using the COPY text format.
+    """
+    if value is None:
+        return COPY_NULL
+
+    text = to_text(value)
+    if text is not None:
+        return text
+
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, unicode):
+        value = value.encode("utf-8")
+    elif not isinstance(value, str):
+        value = str(value)
+
+    for char, escaped in COPY_ESCAPES:
+        value = value.replace(char, escaped)
+    return value
+
+
+class CopyReader(object):
+    """
+    File like object consumed by ``cursor.copy_expert``. Rows are encoded
+    ``chunk_size`` at a time, so memory usage does not depend on the
+    number of rows.
+    """
+
+    def __init__(self, rows, encoder=copy_text, chunk_size=1000):
+        self.rows = iter(rows)
+        self.encoder = encoder
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.count = 0
+
+    def _fill(self):
+        lines = []
+        for row in self.rows:
+            lines.append("\t".join([self.encoder(x) for x in row]))
+            if len(lines) >= self.chunk_size:
+                break
+
+        self.count += len(lines)
+        if lines:
+            lines.append("")
+        return "\n".join(lines)
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            data = self._fill()
+            if not data:
+                break
+            self.buffer += data
+
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+""" BINARY FORMAT """
+
+def _text_send(value):
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return value.encode("utf-8")
+
+def _text_recv(data):
+    return bytes(data).decode("utf-8")
+
+def _struct_codec(fmt):
+    packer = struct.Struct(fmt)
+    return packer.pack, lambda data: packer.unpack(data)[0]
+
+# column type -> (send, recv) of the non geometric types supported by
+# the binary format
+BINARY_CODECS = {
+    'smallint': _struct_codec(">h"),
+    'integer': _struct_codec(">i"),
+    'serial': _struct_codec(">i"),
+    'bigint': _struct_codec(">q"),
+    'bigserial': _struct_codec(">q"),
+    'real': _struct_codec(">f"),
+    'double precision': _struct_codec(">d"),
+    'boolean': _struct_codec(">?"),
+    'text': (_text_send, _text_recv),
+    'varchar': (_text_send, _text_recv),
+}
+
+def get_binary_codec(field, connection):
+    """
+    Return the ``(send, recv)`` functions of the binary format of a
+    field column.
+    """
+    if isinstance(field, GeometricField):
+        return SEND_MAPPER[field.dbtype_name], RECV_MAPPER[field.dbtype_name]
+
+    db_type = field.db_type(connection=connection).split("(")[0]
+    try:
+        return BINARY_CODECS[db_type]
+    except KeyError:
+        raise ValueError("binary COPY does not support %s columns (%s)" % (
+            db_type, field.name))
+
+
+class BinaryCopyReader(CopyReader):
+    """
+    ``CopyReader`` of the binary COPY format. ``encoders`` are the send
+    functions of every column.
+    """
+
+    def __init__(self, rows, encoders, chunk_size=1000):
+        super(BinaryCopyReader, self).__init__(rows, None, chunk_size)
+        self.encoders = encoders
+        self.buffer = b""
+        self.state = "header"
+
+    def _fill(self):
+        if self.state == "done":
+            return b""
+
+        data = []
+        if self.state == "header":
+            data.append(COPY_BINARY_HEADER)
+            self.state = "rows"
+
+        count = _INT16.pack(len(self.encoders))
+        null = _INT32.pack(-1)
+        rows = 0
+        for row in self.rows:
+            data.append(count)
+            for encoder, value in zip(self.encoders, row):
+                if value is None:
+                    data.append(null)
+                else:
+                    value = encoder(value)
+                    data.append(_INT32.pack(len(value)))
+                    data.append(value)
+
+            rows += 1
+            if rows >= self.chunk_size:
+                break
+        else:
+            data.append(COPY_BINARY_TRAILER)
+            self.state = "done"
+
+        self.count += rows
+        return b"".join(data)
+
+
+def get_copy_fields(model, fields=None):
+    """
+    Return the fields loaded by ``copy_insert``: the given field names or
+    every concrete local field except automatic primary keys and the
+    companion box columns, which are computed.
+    """
+    if fields is not None:
+        return [model._meta.get_field(name) for name in fields]
+    return [f for f in model._meta.local_fields \
+        if not isinstance(f, (AutoField, BoundingBoxField))]
+
+
+def get_companion_fields(model, fields):
+    """
+    Return ``(field, index of the source in fields)`` of the companion
+    box columns of ``fields`` not given.
+    """
+    names = [f.name for f in fields]
+    return [(f, names.index(f.source)) for f in model._meta.local_fields \
+        if isinstance(f, BoundingBoxField) and f.source in names and f not in fields]
+
+
+def copy_insert(model, objs, fields=None, using=None, chunk_size=1000, binary=False):
+    """
+    Insert ``objs`` into the table of ``model`` with one COPY statement.
+
+    ``objs`` may be model instances or tuples of values ordered as
+    ``fields`` (by default every concrete field except auto primary keys).
+    The companion box columns of the geometric fields are computed.
+    It is consumed lazily, so it can be a generator of any length.
+    With ``binary`` the binary format is used, which only supports the
+    column types of ``BINARY_CODECS`` besides the geometric ones.
+    Returns the number of inserted rows.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    fields = get_copy_fields(model, fields)
+    companions = get_companion_fields(model, fields)
+    columns = fields + [f for f, index in companions]
+
+    # geometric values are encoded by the binary codecs as objects
+    raw = [binary and isinstance(f, GeometricField) for f in columns]
+
+    def _rows():
+        for obj in objs:
+            if isinstance(obj, model):
+                values = [f.pre_save(obj, True) for f in fields]
+            else:
+                values = list(obj)
+            values.extend([bounding_box(values[index], fields[index].dbtype_name) \
+                for f, index in companions])
+
+            yield [value if is_raw else f.get_db_prep_save(value, connection=connection) \
+                for f, value, is_raw in zip(columns, values, raw)]
+
+    qn = connection.ops.quote_name
+    sql = "COPY %s (%s) FROM STDIN" % (qn(model._meta.db_table),
+        ", ".join([qn(f.column) for f in columns]))
+
+    if binary:
+        encoders = [get_binary_codec(f, connection)[0] for f in columns]
+        reader = BinaryCopyReader(_rows(), encoders, chunk_size=chunk_size)
+        sql += " (FORMAT binary)"
+    else:
+        reader = CopyReader(_rows(), chunk_size=chunk_size)
+
+    cursor = connection.cursor()
+    try:
+        cursor.copy_expert(sql, reader)
+    finally:
+        cursor.close()
+
+    # django < 1.6 does not run in autocommit mode
+    if not hasattr(connection, "get_autocommit"):
+        transaction.commit_unless_managed(using=using)
+    return reader.count
+
+
+class BinaryCopyWriter(object):
+    """
+    File like object fed by ``cursor.copy_expert`` with binary COPY
+    data. Rows are decoded as soon as they are complete.
+    """
+
+    def __init__(self, decoders):
+        self.decoders = decoders
+        self.rows = []
+        self.buffer = b""
+        self.header = True
+
+    def _read_header(self, data):
+        if len(data) < len(COPY_BINARY_HEADER):
+            return None
+        if data[:11] != COPY_BINARY_HEADER[:11]:
+            raise ValueError("bad binary COPY header")
+
+        extension, = _INT32.unpack_from(data, 15)
+        if len(data) < 19 + extension:
+            return None
+        return 19 + extension
+
+    def _read_row(self, data, offset):
+        size = len(data)
+        count, = _INT16.unpack_from(data, offset)
+        offset += 2
+        if count == -1:
+            return (), size
+
+        row = []
+        for decoder in self.decoders:
+            if size - offset < 4:
+                return None
+            length, = _INT32.unpack_from(data, offset)
+            offset += 4
+
+            if length == -1:
+                row.append(None)
+                continue
+            elif size - offset < length:
+                return None
+
+            row.append(decoder(data[offset:offset + length]))
+            offset += length
+        return tuple(row), offset
+
+    def write(self, data):
+        data = self.buffer + data
+        offset = 0
+
+        if self.header:
+            offset = self._read_header(data)
+            if offset is None:
+                self.buffer = data
+                return
+            self.header = False
+
+        while len(data) - offset >= 2:
+            result = self._read_row(data, offset)
+            if result is None:
+                break
+
+            row, offset = result
+            if row:
+                self.rows.append(row)
+        self.buffer = data[offset:]
+
+
+def copy_values_list(queryset, *fields):
+    """
+    Same as ``queryset.values_list(*fields)`` but fetched with one
+    binary ``COPY (SELECT ...) TO STDOUT``. Fields must be local fields
+    (or ``pk``) of geometric or ``BINARY_CODECS`` types.
+    """
+    connection = connections[queryset.db]
+    opts = queryset.model._meta
+    decoders = [get_binary_codec(opts.pk if name == "pk" else opts.get_field(name),
+                                 connection)[1] for name in fields]
+
+    sql, params = queryset.values_list(*fields).query\
+        .get_compiler(queryset.db).as_sql()
+
+    writer = BinaryCopyWriter(decoders)
+    cursor = connection.cursor()
+    try:
+        sql = "COPY (%s) TO STDOUT (FORMAT binary)" % cursor.mogrify(sql, params)
+        cursor.copy_expert(sql, writer)
+    finally:
+        cursor.close()
+    return writer.rows
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar (numpy backed) containers of geometric values with vectorized
+versions of the postgresql geometric operators, for testing thousands
+of already fetched values at once.
+
+Predicates follow the postgresql implementation (``geo_ops.c``),
+including the fuzzy comparisons with ``EPSILON`` where postgresql uses
+them, so results match the ones computed by the server. Null values are
+stored as NaN and never match a predicate.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .objects import Point, Box, Circle
+from .registry import ensure_registered
+
+# postgresql geo_decls.h
+EPSILON = 1.0E-06
+
+# columns of the coordinates array for each kind. Boxes are stored
+# normalized, as postgresql does: (high.x, high.y, low.x, low.y)
+WIDTHS = {Point: 2, Box: 4, Circle: 3}
+
+
+def _fple(a, b):
+    return a - b <= EPSILON
+
+def _fpge(a, b):
+    return b - a <= EPSILON
+
+
+def _ignore_nan(method):
+    """
+    Null values (NaN) never match, without numpy warnings.
+    """
+    def _method(*args, **kwargs):
+        with np.errstate(invalid="ignore"):
+            return method(*args, **kwargs)
+    _method.__name__ = method.__name__
+    _method.__doc__ = method.__doc__
+    return _method
+
+
+def _coords(obj):
+    if isinstance(obj, Point):
+        return (obj.x, obj.y)
+    elif isinstance(obj, Box):
+        (x1, y1), (x2, y2) = obj
+        return (max(x1, x2), max(y1, y2), min(x1, x2), min(y1, y2))
+    elif isinstance(obj, Circle):
+        return (obj.point.x, obj.point.y, obj.r)
+    raise TypeError("unsupported geometric type: %r" % obj)
+
+
+class GeometryArray(object):
+    """
+    Array of points, boxes or circles.
+
+    ``data`` is a float ``(n, 2)`` (points), ``(n, 4)`` (boxes) or
+    ``(n, 3)`` (circles) numpy array.
+    """
+
+    def __init__(self, kind, data):
+        if np is None:
+            raise ImportError("GeometryArray requires numpy")
+        if kind not in WIDTHS:
+            raise TypeError("unsupported geometric type: %r" % kind)
+
+        self.kind = kind
+        self.data = np.asarray(data, dtype=np.float64).reshape(-1, WIDTHS[kind])
+
+    @classmethod
+    def from_objects(cls, objects, kind=None):
+        """
+        Build the array from geometric objects (None values allowed).
+        """
+        objects = list(objects)
+        if kind is None:
+            kinds = set(x.__class__ for x in objects if x is not None)
+            if len(kinds) != 1:
+                raise TypeError("can not infer an unique geometric type")
+            kind = kinds.pop()
+
+        nan = (float("nan"),) * WIDTHS.get(kind, 0)
+        return cls(kind, [nan if x is None else _coords(x) for x in objects])
+
+    @classmethod
+    def from_queryset(cls, queryset, field):
+        """
+        Build the array from the values of a geometric field.
+        """
+        from django.db import connections
+        ensure_registered(connections[queryset.db])
+
+        kind = queryset.model._meta.get_field(field)._dbtype
+        return cls.from_objects(queryset.values_list(field, flat=True), kind)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        row = self.data[index]
+        if np.isnan(row).any():
+            return None
+        elif self.kind is Point:
+            return Point(float(row[0]), float(row[1]))
+        elif self.kind is Box:
+            return Box([float(row[2]), float(row[3])], [float(row[0]), float(row[1])])
+        return Circle([float(row[0]), float(row[1])], float(row[2]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "<GeometryArray {0} length={1}>".format(
+            self.kind.type_name(), len(self))
+
+    def take(self, mask):
+        """
+        Return a new array with the rows selected by a boolean mask
+        or an index array (usually the result of a predicate).
+        """
+        return GeometryArray(self.kind, self.data[mask])
+
+    def to_objects(self):
+        return list(self)
+
+    def _other(self, other):
+        if isinstance(other, GeometryArray):
+            return other.kind, other.data.T
+        return other.__class__, np.array(_coords(other), dtype=np.float64)
+
+    def _unsupported(self, operator, kind):
+        return TypeError("operator %s not supported for %s and %s" % (
+            operator, self.kind.type_name(), kind.type_name()))
+
+    # predicates
+
+    @_ignore_nan
+    def contained_on(self, other):
+        """
+        Vectorized ``<@``.
+        """
+        kind, o = self._other(other)
+        d = self.data.T
+
+        if self.kind is Point and kind is Box:
+            return (d[0] <= o[0]) & (d[0] >= o[2]) & (d[1] <= o[1]) & (d[1] >= o[3])
+        elif self.kind is Point and kind is Circle:
+            return np.hypot(d[0] - o[0], d[1] - o[1]) <= o[2]
+        elif self.kind is Box and kind is Box:
+            return _fpge(o[0], d[0]) & _fple(o[2], d[2]) & \
+                _fpge(o[1], d[1]) & _fple(o[3], d[3])
+        elif self.kind is Circle and kind is Circle:
+            return _fple(np.hypot(d[0] - o[0], d[1] - o[1]) + d[2], o[2])
+        raise self._unsupported("<@", kind)
+
+    @_ignore_nan
+    def contains(self, other):
+        """
+        Vectorized ``@>``.
+        """
+        kind, o = self._other(other)
+        d = self.data.T
+
+        if self.kind is Box and kind is Point:
+            return (o[0] <= d[0]) & (o[0] >= d[2]) & (o[1] <= d[1]) & (o[1] >= d[3])
+        elif self.kind is Circle and kind is Point:
+            return np.hypot(o[0] - d[0], o[1] - d[1]) <= d[2]
+        elif self.kind is Box and kind is Box:
+            return _fpge(d[0], o[0]) & _fple(d[2], o[2]) & \
+                _fpge(d[1], o[1]) & _fple(d[3], o[3])
+        elif self.kind is Circle and kind is Circle:
+            return _fple(np.hypot(d[0] - o[0], d[1] - o[1]) + o[2], d[2])
+        raise self._unsupported("@>", kind)
+
+    @_ignore_nan
+    def overlaps(self, other):
+        """
+        Vectorized ``&&``.
+        """
+        kind, o = self._other(other)
+        d = self.data.T
+
+        if self.kind is Box and kind is Box:
+            return _fple(d[2], o[0]) & _fple(o[2], d[0]) & \
+                _fple(d[3], o[1]) & _fple(o[3], d[1])
+        elif self.kind is Circle and kind is Circle:
+            return _fple(np.hypot(d[0] - o[0], d[1] - o[1]), d[2] + o[2])
+        raise self._unsupported("&&", kind)
+
+    # measures
+
+    @_ignore_nan
+    def distance(self, other):
+        """
+        Vectorized ``<->`` (box to box distance is measured between
+        centers, as postgresql does).
+        """
+        kind, o = self._other(other)
+        d = self.data.T
+        kinds = (self.kind, kind)
+
+        if kinds == (Point, Point):
+            return np.hypot(d[0] - o[0], d[1] - o[1])
+        elif kinds in ((Point, Box), (Box, Point)):
+            p, b = (d, o) if self.kind is Point else (o, d)
+            dx = np.maximum(np.maximum(b[2] - p[0], p[0] - b[0]), 0)
+            dy = np.maximum(np.maximum(b[3] - p[1], p[1] - b[1]), 0)
+            return np.hypot(dx, dy)
+        elif kinds in ((Point, Circle), (Circle, Point)):
+            p, c = (d, o) if self.kind is Point else (o, d)
+            return np.maximum(np.hypot(p[0] - c[0], p[1] - c[1]) - c[2], 0)
+        elif kinds == (Box, Box):
+            return np.hypot((d[0] + d[2] - o[0] - o[2]) / 2.0,
+                            (d[1] + d[3] - o[1] - o[3]) / 2.0)
+        elif kinds == (Circle, Circle):
+            return np.maximum(np.hypot(d[0] - o[0], d[1] - o[1]) - d[2] - o[2], 0)
+        raise self._unsupported("<->", kind)
+
+    def area(self):
+        if self.kind is Box:
+            return (self.data[:, 0] - self.data[:, 2]) * (self.data[:, 1] - self.data[:, 3])
+        elif self.kind is Circle:
+            return np.pi * self.data[:, 2] ** 2
+        raise TypeError("area is not defined for %s" % self.kind.type_name())
+
+    def center(self):
+        """
+        Return the centers as a point ``GeometryArray`` (``@@``).
+        """
+        if self.kind is Box:
+            return GeometryArray(Point, np.column_stack((
+                (self.data[:, 0] + self.data[:, 2]) / 2.0,
+                (self.data[:, 1] + self.data[:, 3]) / 2.0)))
+        return GeometryArray(Point, self.data[:, :2].copy())
+
+    def bounding_box(self):
+        """
+        Return the bounding boxes as a box ``GeometryArray``. Unlike
+        ``box(circle)`` in postgresql, the box of a circle is the
+        circumscribed one.
+        """
+        if self.kind is Box:
+            return GeometryArray(Box, self.data.copy())
+        elif self.kind is Point:
+            return GeometryArray(Box, np.column_stack((self.data, self.data)))
+
+        x, y, r = self.data.T
+        return GeometryArray(Box, np.column_stack((x + r, y + r, x - r, y - r)))
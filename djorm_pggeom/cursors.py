@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import uuid
+
+
+def server_side_chunks(connection, sql, params, chunk_size=2000):
+    """
+    Execute ``sql`` using a named (server side) cursor and yield the
+    results in lists of at most ``chunk_size`` rows.
+    """
+    connection.cursor().close()
+
+    # named cursors can only live outside a transaction if they are
+    # declared WITH HOLD (django >= 1.6 runs in autocommit mode).
+    withhold = getattr(connection, "get_autocommit", lambda: False)()
+    cursor = connection.connection.cursor(name="pggeom_%s" % uuid.uuid4().hex,
+                                          withhold=withhold)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
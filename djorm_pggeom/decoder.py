@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+Single pass decoders for the text representation of the postgresql
+geometric types.
+
+All geometric output functions of postgresql emit a list of float8
+values separated by commas and wrapped with brackets, so decoding is
+reduced to removing the brackets and splitting by commas (both done in
+C by the string methods) and converting every token with ``float``, which
+also handles the exponent (``1e+20``) and the special ``Infinity`` and
+``NaN`` forms. The brackets and commas left after removing the numbers
+are checked against the structure of each type (``((,),(,))`` for a
+polygon of two points).
+"""
+
+import re
+
+_BRACKETS = b"()[]<>"
+_UNICODE_BRACKETS = dict((x, None) for x in bytearray(_BRACKETS))
+
+# characters of the numbers (and of Infinity and NaN) and whitespace
+_NUMBER_CHARS = b"0123456789.+-eEiInNfFtTyYaA \t\r\n"
+_UNICODE_NUMBER_CHARS = dict((x, None) for x in bytearray(_NUMBER_CHARS))
+
+
+def _tokenize(value):
+    """
+    Return the structure of a value (its brackets and commas, in order)
+    and its number tokens.
+    """
+    try:
+        return value.translate(None, _NUMBER_CHARS), \
+            value.translate(None, _BRACKETS).split(",")
+    except TypeError:
+        # unicode (or python3 str) values
+        return value.translate(_UNICODE_NUMBER_CHARS), \
+            value.translate(_UNICODE_BRACKETS).split(",")
+
+
+# quoted or plain array elements, by array delimiter
+_ARRAY_ELEMENTS = {
+    ",": re.compile(r'"((?:[^"\\]|\\.)*)"|([^,"]+)'),
+    ";": re.compile(r'"((?:[^"\\]|\\.)*)"|([^;"]+)'),
+}
+_ARRAY_ESCAPE = re.compile(r'\\(.)')
+
+
+def _error(typename, value):
+    return ValueError("bad %s representation: %r" % (typename, value))
+
+
+def decode_numbers(value):
+    """
+    Return a flat list of floats from any geometric text representation.
+    """
+    try:
+        return [float(x) for x in _tokenize(value)[1]]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("geometric", value)
+
+
+def decode_point(value):
+    """
+    Decode ``(x,y)``.
+    """
+    try:
+        structure, (x, y) = _tokenize(value)
+        if structure != "(,)":
+            raise ValueError
+        return [float(x), float(y)]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("point", value)
+
+
+def decode_circle(value):
+    """
+    Decode ``<(x,y),r>``.
+    """
+    try:
+        structure, (x, y, r) = _tokenize(value)
+        if structure != "<(,),>":
+            raise ValueError
+        return [float(x), float(y), float(r)]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("circle", value)
+
+
+def decode_lseg(value):
+    """
+    Decode ``[(x1,y1),(x2,y2)]``.
+    """
+    try:
+        structure, (x1, y1, x2, y2) = _tokenize(value)
+        if structure != "[(,),(,)]":
+            raise ValueError
+        return [float(x1), float(y1), float(x2), float(y2)]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("lseg", value)
+
+
+def decode_box(value):
+    """
+    Decode ``(x1,y1),(x2,y2)`` (or ``((x1,y1),(x2,y2))``).
+    """
+    try:
+        structure, (x1, y1, x2, y2) = _tokenize(value)
+        if structure not in ("(,),(,)", "((,),(,))"):
+            raise ValueError
+        return [float(x1), float(y1), float(x2), float(y2)]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("box", value)
+
+
+def decode_path(value):
+    """
+    Decode ``[(x1,y1),...]`` (open) or ``((x1,y1),...)`` (closed) and
+    return a ``(closed, coords)`` tuple, being coords a flat list.
+    """
+    try:
+        structure, tokens = _tokenize(value)
+        coords = [float(x) for x in tokens]
+        closed = structure[0] == "("
+    except (ValueError, TypeError, AttributeError, IndexError):
+        raise _error("path", value)
+
+    ends = "()" if closed else "[]"
+    if structure != ends[0] + ",".join(["(,)"] * (len(coords) // 2)) + ends[1]:
+        raise _error("path", value)
+    return closed, coords
+
+
+def decode_polygon(value):
+    """
+    Decode ``((x1,y1),...)`` and return a flat list of coordinates.
+    """
+    try:
+        structure, tokens = _tokenize(value)
+        coords = [float(x) for x in tokens]
+    except (ValueError, TypeError, AttributeError):
+        raise _error("polygon", value)
+
+    if structure != "(" + ",".join(["(,)"] * (len(coords) // 2)) + ")":
+        raise _error("polygon", value)
+    return coords
+
+
+def decode_array(value, delimiter=","):
+    """
+    Split the text of a one dimensional array (``{"(1,2)","(3,4)"}``,
+    or ``{(1,1),(0,0);(2,2),(1,1)}`` for box arrays) and return the
+    text of every element, or None for NULL elements.
+    """
+    try:
+        if value[0] == "[":
+            # explicit bounds: [0:1]={...}
+            value = value[value.index("=") + 1:]
+        if value[0] != "{" or value[-1] != "}" or "{" in value[1:-1]:
+            raise ValueError
+        matches = _ARRAY_ELEMENTS[delimiter].findall(value[1:-1])
+    except (ValueError, TypeError, IndexError, KeyError):
+        raise _error("array", value)
+
+    elements = []
+    for quoted, plain in matches:
+        if plain:
+            elements.append(None if plain == "NULL" else plain)
+        elif "\\" in quoted:
+            elements.append(_ARRAY_ESCAPE.sub(r"\1", quoted))
+        else:
+            elements.append(quoted)
+    return elements
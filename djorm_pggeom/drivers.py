@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Geometric type codecs for drivers other than psycopg2. They are
+registered per connection (or per pool) instead of globally and do not
+need the django connection hook of ``models``:
+
+* psycopg 3: ``register_psycopg(conn)`` adds loaders and dumpers to a
+  connection, a cursor or the global ``psycopg.adapters``.
+* asyncpg: ``await register_asyncpg(conn)``, also usable as the
+  ``init`` callback of ``asyncpg.create_pool``.
+
+Values are exchanged in the binary format when the driver allows it, so
+results are decoded with the ``binary`` codecs, without text parsing.
+
+These drivers run on python 3 only, while the django integration of the
+package (fields, managers and lookups) requires python 2 and django 1.5:
+from async code the geometric objects are loaded and sent by the driver
+and predicates are written in raw SQL with ``predicate_sql``, without
+models or querysets.
+"""
+
+import sys
+
+try:
+    from psycopg import postgres
+    from psycopg.adapt import Loader, Dumper
+    from psycopg.pq import Format
+except ImportError:
+    postgres = Loader = Dumper = Format = None
+
+from .adapt import TEXT_MAPPER
+from .binary import RECV_MAPPER, SEND_MAPPER
+from .lookups import GEOMETRIC_OPERATORS
+from .objects import CAST_MAPPER, Point, Circle, Lseg, Box, Path, Polygon
+
+GEOMETRIC_CLASSES = (Point, Circle, Lseg, Box, Path, Polygon)
+
+
+def predicate_sql(column, lookup, placeholder="%s"):
+    """
+    Render the ``GeoExpression`` predicate ``lookup`` for raw queries:
+    ``predicate_sql("pos", "contained_on", "$1")`` -> ``pos <@ $1``.
+    """
+    return "%s %s %s" % (column, GEOMETRIC_OPERATORS[lookup], placeholder)
+
+
+""" PSYCOPG 3 """
+
+def psycopg_codecs(cls):
+    """
+    Return the ``(text_load, binary_load, text_dump, binary_dump)``
+    methods of the psycopg 3 loaders and dumpers of a geometric class.
+    """
+    name = cls.type_name()
+    cast, recv = CAST_MAPPER[name], RECV_MAPPER[name]
+    text, send = TEXT_MAPPER[name], SEND_MAPPER[name]
+
+    def text_load(self, data):
+        return cast(bytes(data).decode("ascii"), None)
+
+    def binary_load(self, data):
+        return recv(data)
+
+    def text_dump(self, obj):
+        return text(obj).encode("ascii")
+
+    def binary_dump(self, obj):
+        return send(obj)
+
+    return text_load, binary_load, text_dump, binary_dump
+
+
+def psycopg_adapters(cls):
+    """
+    Return the text and binary loader and dumper classes of a
+    geometric class.
+    """
+    name = cls.type_name()
+    oid = postgres.types[cls.db_type(None)].oid
+    text_load, binary_load, text_dump, binary_dump = psycopg_codecs(cls)
+
+    return (
+        type(str("%sLoader" % name), (Loader,), {"load": text_load}),
+        type(str("%sBinaryLoader" % name), (Loader,),
+             {"format": Format.BINARY, "load": binary_load}),
+        type(str("%sDumper" % name), (Dumper,), {"oid": oid, "dump": text_dump}),
+        type(str("%sBinaryDumper" % name), (Dumper,),
+             {"oid": oid, "format": Format.BINARY, "dump": binary_dump}),
+    )
+
+
+def register_psycopg(context=None):
+    """
+    Register the geometric codecs on a psycopg 3 connection or cursor,
+    or globally (``psycopg.adapters``) when ``context`` is None.
+    Parameters are sent in binary format.
+    """
+    if postgres is None:
+        raise ImportError("register_psycopg requires psycopg >= 3")
+
+    if context is None:
+        import psycopg
+        context = psycopg
+
+    adapters = context.adapters
+    for cls in GEOMETRIC_CLASSES:
+        loader, binary_loader, dumper, binary_dumper = psycopg_adapters(cls)
+        adapters.register_loader(cls.db_type(None), loader)
+        adapters.register_loader(cls.db_type(None), binary_loader)
+        # the last dumper registered for a class is used for %s
+        adapters.register_dumper(cls, dumper)
+        adapters.register_dumper(cls, binary_dumper)
+
+
+""" ASYNCPG """
+
+def asyncpg_codecs():
+    """
+    Return the ``set_type_codec`` arguments (type name and keyword
+    arguments) of every geometric type.
+    """
+    return [(cls.db_type(None), {
+        "schema": "pg_catalog", "format": "binary",
+        "encoder": SEND_MAPPER[cls.type_name()],
+        "decoder": RECV_MAPPER[cls.type_name()],
+    }) for cls in GEOMETRIC_CLASSES]
+
+
+if sys.version_info >= (3, 5):
+    # ``async def register_asyncpg(connection)``, a syntax error on python 2
+    from ._asyncpg import register_asyncpg
@@ -1,11 +1,136 @@
 # -*- coding: utf-8 -*-
 
+from django.db.models.expressions import ExpressionNode
+from django.db.models.fields import FieldDoesNotExist
 from djorm_expressions.base import SqlExpression
 from . import functions
+from .adapt import to_text, array_type_name, text_array
+from .lookups import bbox_prefilter, within_distance_sql
+
+
+def resolve_field(model, path):
+    """
+    Return the model field of a ``__`` separated ``path``, or None.
+    """
+    parts = path.split("__")
+    try:
+        for name in parts[:-1]:
+            model = model._meta.get_field(name).rel.to
+        return model._meta.get_field(parts[-1])
+    except (FieldDoesNotExist, AttributeError):
+        return None
+
+
+def companion_column(field):
+    """
+    Return the column of the companion box (``bbox_field``) of a
+    geometric field, or None.
+    """
+    if not getattr(field, "bbox_field", None):
+        return None
+    return field.model._meta.get_field(field.bbox_field).column
+
+
+def column_sql(qn, node_field, column):
+    """
+    Render ``column`` of the table of a resolved ``(table, column,
+    alias)`` node field.
+    """
+    table, _column, alias = node_field
+    return "%s.%s" % (qn(table) if table == alias else alias, qn(column))
 
 class SimpleExpression(SqlExpression):
     sql_template = "%(operator)s %(field)s"
 
+class TypedExpression(SqlExpression):
+    """
+    Expression that sends geometric values as typed text parameters
+    (``field && %s::box``), so the statement text is the same for any
+    coordinates.
+
+    Lists and tuples of geometric values are sent as one array and
+    compared with ``ANY`` (``field <@ ANY(%s::polygon[])``).
+
+    Fields with a companion box column (``bbox_field``) are prefiltered
+    with it: ``(field_bbox && %s::box AND field <@ %s::polygon)``.
+    """
+    sql_template = "%(field)s %(operator)s %%s%(cast)s"
+    any_sql_template = "%(field)s %(operator)s ANY(%%s%(cast)s)"
+    bbox_column = None
+
+    def __init__(self, field_or_func, operator, value=None, **kwargs):
+        self.geometric_value = value
+        type_name = None
+        if isinstance(value, (list, tuple)):
+            type_name = array_type_name(value)
+
+        if type_name is not None:
+            self.sql_template = self.any_sql_template
+            kwargs.setdefault("cast", "::%s[]" % type_name.lower())
+            value = text_array(value, type_name)
+        else:
+            text = to_text(value)
+            if text is None:
+                kwargs.setdefault("cast", "")
+            else:
+                kwargs.setdefault("cast", "::%s" % value.__class__.__name__.lower())
+                value = text
+
+        super(TypedExpression, self).__init__(field_or_func, operator, value, **kwargs)
+
+    def as_sql(self, qn, queryset):
+        # the field is resolved to (table, column, alias) on first use
+        if self.sql_function is None and isinstance(self.field, basestring):
+            self.bbox_column = companion_column(resolve_field(queryset.model, self.field))
+
+        sql, args = super(TypedExpression, self).as_sql(qn, queryset)
+        if self.bbox_column is None or self.negated:
+            return sql, args
+
+        prefilter = bbox_prefilter(column_sql(qn, self.field, self.bbox_column),
+                                   self.operator, self.geometric_value)
+        if prefilter is None:
+            return sql, args
+        return "(%s AND %s)" % (prefilter[0], sql), prefilter[1] + args
+
+class WithinDistanceExpression(SqlExpression):
+    """
+    ``distance from point to field <= radius``, rendered for the type
+    of the field so that its spatial index (or companion box column)
+    can be used: see ``lookups.within_distance_sql``.
+    """
+    sql_template = "%(field)s"
+    dbtype = None
+    bbox_column = None
+
+    def __init__(self, field, point, radius):
+        super(WithinDistanceExpression, self).__init__(field, None)
+        self.point = point
+        self.radius = radius
+
+    def as_sql(self, qn, queryset):
+        if isinstance(self.field, basestring):
+            field = resolve_field(queryset.model, self.field)
+            self.dbtype = getattr(field, "dbtype_name", "").lower()
+            self.bbox_column = companion_column(field)
+
+        # the base class only renders the column
+        negated, self.negated = self.negated, False
+        try:
+            column, args = super(WithinDistanceExpression, self).as_sql(qn, queryset)
+        finally:
+            self.negated = negated
+
+        bbox_column = None
+        if self.bbox_column is not None:
+            bbox_column = column_sql(qn, self.field, self.bbox_column)
+
+        sql, params = within_distance_sql(column, self.dbtype, self.point,
+                                          self.radius, bbox_column)
+        if self.negated:
+            sql = self.sql_negated_template % sql
+        return sql, args + params
+
 class GeoExpression(object):
     """
     Expression generator for postgresql geometric querys:
@@ -17,56 +142,77 @@ class GeoExpression(object):
         self.field = field
 
     def overlaps(self, value):
-        return SqlExpression(self.field, "&&", value)
+        return TypedExpression(self.field, "&&", value)
 
     def is_strictly_left_of(self, value):
-        return SqlExpression(self.field, "<<", value)
+        return TypedExpression(self.field, "<<", value)
 
     def is_strictly_right_of(self, value):
-        return SqlExpression(self.field, ">>", value)
+        return TypedExpression(self.field, ">>", value)
 
     def does_not_extend_above(self, value):
-        return SqlExpression(self.field, "&<|", value)
+        return TypedExpression(self.field, "&<|", value)
 
     def does_not_extend_below(self, value):
-        return SqlExpression(self.field, "|&>", value)
+        return TypedExpression(self.field, "|&>", value)
 
     def does_not_extend_right(self, value):
-        return SqlExpression(self.field, "&<", value)
+        return TypedExpression(self.field, "&<", value)
 
     def does_not_extend_left(self, value):
-        return SqlExpression(self.field, "&>", value)
+        return TypedExpression(self.field, "&>", value)
 
     def intersects_with(self, value):
-        return SqlExpression(self.field, "?#", value)
+        return TypedExpression(self.field, "?#", value)
 
     def not_intersects_with(self, value):
-        # TODO: actualy not works
-        return ~self.intersects(value)
+        return ~self.intersects_with(value)
 
     def contains(self, value):
-        return SqlExpression(self.field, "@>", value)
+        return TypedExpression(self.field, "@>", value)
 
     def contained_on(self, value):
-        return SqlExpression(self.field, "<@", value)
+        return TypedExpression(self.field, "<@", value)
 
     def is_horizontal(self):
         return SimpleExpression(self.field, "?-")
 
     def is_horizontal_aligned(self, value):
-        return SqlExpression(self.field, "?-", value)
+        return TypedExpression(self.field, "?-", value)
 
     def is_vertical(self):
         return SimpleExpression(self.field, "?|")
 
-    def is_vertical_aligned(self):
-        return SqlExpression(self.field, "?|", value)
+    def is_vertical_aligned(self, value):
+        return TypedExpression(self.field, "?|", value)
 
     def is_perpendicular_to(self, value):
-        return SqlExpression(self.field, "?-|", value)
+        return TypedExpression(self.field, "?-|", value)
 
     def is_parallel_to(self, value):
-        return SqlExpression(self.field, "?||", value)
+        return TypedExpression(self.field, "?||", value)
 
     def same_as(self, value):
-        return SqlExpression(self.field, "~=", value)
+        return TypedExpression(self.field, "~=", value)
+
+    def within_distance(self, point, radius):
+        return WithinDistanceExpression(self.field, point, radius)
+
+
+class BoundingBoxExpression(ExpressionNode):
+    """
+    Bounding box of a django expression (``F("path")``) of the geometric
+    type ``dbtype``, computed by the database: used by
+    ``GeoQuerySet.update`` for the companion box columns.
+    """
+
+    def __init__(self, expression, dbtype):
+        super(BoundingBoxExpression, self).__init__([expression])
+        self.dbtype = dbtype
+
+    def evaluate(self, evaluator, qn, connection):
+        sql, params = evaluator.evaluate_node(self, qn, connection)
+        function = functions.BoundingBox(None, dbtype=self.dbtype)
+        template = function.sql_template
+        return template % {"function": function.sql_function, "field": sql}, \
+            list(params) * template.count("%(field)s")
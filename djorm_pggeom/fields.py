@@ -1,13 +1,77 @@
 # -*- coding: utf-8 -*-
 
-from django.db import models
+from django.db import models, connection, connections, router
+from django.db.models import signals
+from django.db.models.fields import FieldDoesNotExist
+from django.db.backends.util import truncate_name
 from django.utils.encoding import force_unicode
 
+from .adapt import to_text
+from .lookups import GEOMETRIC_LOOKUPS
+from .registry import ensure_registered
+from . import objects
+
+# index methods and the geometric types with an operator class for them
+INDEX_METHODS = {
+    'gist': ('point', 'box', 'polygon', 'circle'),
+    'spgist': ('point', 'box'),
+}
+
+
+def bounding_box(value, type_name=None):
+    """
+    Return the bounding ``Box`` of a geometric value (or of its text,
+    parsed as ``type_name``), or None for None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, basestring) and type_name is not None:
+        value = objects.CAST_MAPPER[type_name](value, None)
+    if not hasattr(value, "bounding_box"):
+        raise TypeError("can not compute the bounding box of %r" % (value,))
+    return value.bounding_box()
+
+
+def check_companion_update_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    ``pre_save`` receiver of the models with companion box columns: a
+    save limited to some fields (``update_fields``, or the fields loaded
+    by ``only()`` and ``defer()``) must include the companion of every
+    geometric field saved, or the box would not match the value.
+    """
+    if not update_fields:
+        return
+
+    for field in sender._meta.fields:
+        if isinstance(field, BoundingBoxField) and field.source in update_fields \
+                and field.name not in update_fields:
+            raise ValueError("%s.%s can not be saved without its bounding box: add %r "
+                "to update_fields (or to only())" % (field.model.__name__, field.source, field.name))
+
+
 class GeometricField(models.Field):
     __metaclass__ = models.SubfieldBase
 
     def __init__(self, dbtype, *args, **kwargs):
+        if isinstance(dbtype, basestring):
+            dbtype = getattr(objects, dbtype)
+
         self._dbtype = dbtype
+        self.dbtype_name = dbtype.type_name()
+        self.spatial_index = kwargs.pop('spatial_index', False)
+        self.index_method = kwargs.pop('index_method', None)
+        self.bbox_field = kwargs.pop('bbox_field', False)
+
+        if self.index_method is not None and not self.spatial_index:
+            raise ValueError("index_method requires spatial_index=True")
+        self.index_method = self.index_method or 'gist'
+
+        if self.spatial_index:
+            # the geometric types have the same name in every database
+            dbtype_sql = dbtype.db_type(None)
+            if dbtype_sql not in INDEX_METHODS.get(self.index_method, ()):
+                raise ValueError("%s columns can not be indexed using %r" % (
+                    dbtype_sql, self.index_method))
 
         kwargs.setdefault('blank', True)
         kwargs.setdefault('null', True)
@@ -15,18 +79,129 @@ class GeometricField(models.Field):
 
         super(GeometricField, self).__init__(*args, **kwargs)
 
+    def contribute_to_class(self, cls, name):
+        super(GeometricField, self).contribute_to_class(cls, name)
+
+        # the companion box column (``bbox_field=True`` or its name) is
+        # added to concrete models only, abstract ones pass the option
+        # to their subclasses
+        if self.bbox_field and not cls._meta.abstract:
+            if not isinstance(self.bbox_field, basestring):
+                self.bbox_field = "%s_bbox" % name
+            try:
+                cls._meta.get_field(self.bbox_field)
+            except FieldDoesNotExist:
+                cls.add_to_class(self.bbox_field, BoundingBoxField(source=name))
+
+            # for every sender: the instances loaded by only() and defer()
+            # are saved with a subclass of the model
+            signals.pre_save.connect(check_companion_update_fields,
+                                     dispatch_uid="djorm_pggeom_companion_update_fields")
+
     def db_type(self, connection):
         return self._dbtype.db_type(connection)
 
     def get_db_prep_value(self, value, connection, prepared=False):
+        ensure_registered(connection)
         value = value if prepared else self.get_prep_value(value)
-        return value
+        text = to_text(value)
+        return value if text is None else text
+
+    def get_prep_lookup(self, lookup_type, value):
+        if lookup_type in GEOMETRIC_LOOKUPS:
+            return value
+        return super(GeometricField, self).get_prep_lookup(lookup_type, value)
+
+    def get_db_prep_lookup(self, lookup_type, value, connection, prepared=False):
+        if lookup_type not in GEOMETRIC_LOOKUPS:
+            return super(GeometricField, self).get_db_prep_lookup(lookup_type, value,
+                connection, prepared)
+
+        # the value of the geometric lookups is rendered with the column
+        # by query.GeoWhereNode
+        ensure_registered(connection)
+        return [value if prepared else self.get_prep_lookup(lookup_type, value)]
+
+    def get_placeholder(self, value, connection):
+        # geometric values are sent as typed text parameters
+        return "%%s::%s" % self.db_type(connection)
 
     def to_python(self, value):
+        # text is only loaded before the types are registered, by a
+        # manager other than GeoManager
+        if isinstance(value, basestring):
+            ensure_registered(connection)
+            return objects.CAST_MAPPER[self.dbtype_name](value, None)
+        return value
+
+    def post_create_sql(self, style, db_table, connection=None):
+        """
+        Spatial index statements, executed by syncdb and south after
+        the column is created. Neither passes the connection creating
+        the table, so by default it is the database the router writes
+        the model to.
+        """
+        if not self.spatial_index:
+            return []
+
+        if connection is None:
+            connection = connections[router.db_for_write(self.model)]
+
+        qn = connection.ops.quote_name
+        index_name = truncate_name("%s_%s_%s" % (db_table, self.column,
+            self.index_method), connection.ops.max_name_length())
+
+        return [
+            style.SQL_KEYWORD("CREATE INDEX") + " " +
+            style.SQL_TABLE(qn(index_name)) + " " +
+            style.SQL_KEYWORD("ON") + " " +
+            style.SQL_TABLE(qn(db_table)) + " " +
+            style.SQL_KEYWORD("USING") + " " + self.index_method + " " +
+            "(%s);" % style.SQL_FIELD(qn(self.column)),
+        ]
+
+class BoundingBoxField(GeometricField):
+    """
+    Indexed ``box`` column holding the bounding box of the geometric
+    field ``source``, added by its ``bbox_field`` option. It is computed
+    on save (also by ``bulk_create`` and ``copy_insert``) and by
+    ``GeoQuerySet.update``; expressions and lookups on the source use it
+    as an index prefilter.
+
+    A save with ``update_fields`` that lists the source must list the
+    companion too (see ``check_companion_update_fields``)::
+
+        shape.save(update_fields=["path", "path_bbox"])
+    """
+
+    def __init__(self, source, *args, **kwargs):
+        self.source = source
+        # frozen by south with the GeometricField rules too
+        kwargs.pop('dbtype', None)
+        kwargs.setdefault('spatial_index', True)
+        kwargs['editable'] = False
+        super(BoundingBoxField, self).__init__(objects.Box, *args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        source = model_instance._meta.get_field(self.source)
+        value = bounding_box(getattr(model_instance, source.attname),
+                             source.dbtype_name)
+        setattr(model_instance, self.attname, value)
         return value
 
 try:
     from south.modelsinspector import add_introspection_rules
-    add_introspection_rules(rules=[], patterns=['^djorm_pggeom.fields\.GeometricField$'])
+    add_introspection_rules(rules=[
+        ((GeometricField,), [], {
+            "dbtype": ["dbtype_name", {}],
+            "spatial_index": ["spatial_index", {"default": False}],
+            "index_method": ["index_method", {"default": "gist"}],
+            # bbox_field is left out: the companion is frozen as a field
+        }),
+        ((BoundingBoxField,), [], {
+            "source": ["source", {}],
+        }),
+    ], patterns=['^djorm_pggeom.fields\.GeometricField$',
+                 '^djorm_pggeom.fields\.BoundingBoxField$'])
 except ImportError:
     pass
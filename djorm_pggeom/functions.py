@@ -2,15 +2,57 @@
 
 from djorm_expressions.base import SqlFunction
 
+from .adapt import to_text
+
 class Distance(SqlFunction):
-    sql_template = '(%(field)s <-> %%s)'
+    """
+    Distance to a value, sent as a typed text parameter (like
+    ``TypedExpression``) so the statement is the same for any value.
+    """
+    sql_template = '(%(field)s <-> %%s%(cast)s)'
 
     def between(self, value):
-        self.args.extend([value])
+        text = to_text(value)
+        if text is None:
+            self.extern_params["cast"] = ""
+        else:
+            self.extern_params["cast"] = "::%s" % value.__class__.__name__.lower()
+            value = text
+
+        self.args = list(self.args) + [value]
         return self
 
-class Box(SqlFunction):
+class GeometricFunction(SqlFunction):
+    """
+    Function with alternative templates (``type_templates``) for the
+    column types postgresql does not accept as argument, selected with
+    the ``dbtype`` keyword: ``Center("shape", dbtype="polygon")``.
+    """
+    type_templates = {}
+
+    def __init__(self, field, *args, **kwargs):
+        dbtype = kwargs.pop("dbtype", None)
+        super(GeometricFunction, self).__init__(field, *args, **kwargs)
+        if dbtype in self.type_templates:
+            self.sql_template = self.type_templates[dbtype]
+
+class Box(GeometricFunction):
     sql_function = "box"
+    type_templates = {
+        'point': 'box(%(field)s, %(field)s)',
+        'lseg': 'box(%(field)s[0], %(field)s[1])',
+        'box': '%(field)s',
+        'path': 'box(polygon(pclose(%(field)s)))',
+    }
+
+class BoundingBox(Box):
+    """
+    Like ``Box`` but circles get the circumscribed box (``box(circle)``
+    is the inscribed one).
+    """
+    type_templates = dict(Box.type_templates, circle=
+        'box(center(%(field)s) + point(-radius(%(field)s), -radius(%(field)s)), '
+        'center(%(field)s) + point(radius(%(field)s), radius(%(field)s)))')
 
 class Circle(SqlFunction):
     sql_function = "circle"
@@ -18,11 +60,20 @@ class Circle(SqlFunction):
 class Point(SqlFunction):
     sql_function = "point"
 
-class Area(SqlFunction):
+class Area(GeometricFunction):
     sql_function = "area"
+    type_templates = {
+        'polygon': 'area(path(%(field)s))',
+    }
 
-class Center(SqlFunction):
+class Center(GeometricFunction):
     sql_function = "center"
+    type_templates = {
+        'point': '%(field)s',
+        'lseg': '(@@ %(field)s)',
+        'path': '(@@ polygon(pclose(%(field)s)))',
+        'polygon': '(@@ %(field)s)',
+    }
 
 class Height(SqlFunction):
     sql_function = "height"
@@ -36,5 +87,5 @@ class Radius(SqlFunction):
 class Width(SqlFunction):
     sql_function = "width"
 
-class NPoints(SqlFunction):
+class NPoints(GeometricFunction):
     sql_function = "npoints"
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in instrumentation of the typecasters (``CAST_MAPPER``) and
+adapters (``ADAPT_MAPPER`` and the text encoders used for query
+parameters): per type counts, bytes and cumulative time.
+
+It is enabled with ``DJORM_PGGEOM_INSTRUMENT = True``, read when the
+types are registered. The wrappers are only installed then, so the
+disabled path runs the original functions with no extra cost.
+
+Totals are available with ``get_stats()``, and every value is reported
+through the ``signals`` module, for example to statsd::
+
+    @receiver(geometry_cast)
+    def report(sender, type_name, size, duration, **kwargs):
+        statsd.timing("pggeom.cast.%s" % type_name, duration * 1000)
+"""
+
+import threading
+from timeit import default_timer as timer
+
+_lock = threading.Lock()
+_stats = {}
+
+# type name of the measures of all the geometric types (registration)
+ALL_TYPES = "all"
+
+
+class Counter(object):
+    __slots__ = ('count', 'bytes', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {"count": self.count, "bytes": self.bytes, "seconds": self.seconds}
+
+
+def record(operation, type_name, size, duration):
+    """
+    Add one measure to the totals of ``operation`` ("cast", "adapt" or
+    "registration") and ``type_name``.
+    """
+    with _lock:
+        counter = _stats.get((operation, type_name))
+        if counter is None:
+            counter = _stats[(operation, type_name)] = Counter()
+        counter.count += 1
+        counter.bytes += size
+        counter.seconds += duration
+
+
+def get_stats():
+    """
+    Return ``{operation: {type_name: {"count", "bytes", "seconds"}}}``.
+    The registration of the types is recorded once for all of them, as
+    ``ALL_TYPES``.
+    """
+    with _lock:
+        result = {}
+        for (operation, type_name), counter in _stats.items():
+            result.setdefault(operation, {})[type_name] = counter.as_dict()
+        return result
+
+
+def reset_stats():
+    with _lock:
+        _stats.clear()
+
+
+def instrument_cast(type_name, cast_function):
+    """
+    Wrap a typecaster function. With lazy casting the time is measured
+    when the value is parsed.
+    """
+    from .signals import geometry_cast
+
+    def _cast(value, cur):
+        if value is None:
+            return None
+
+        start = timer()
+        result = cast_function(value, cur)
+        duration = timer() - start
+
+        size = payload_size(value)
+        record("cast", type_name, size, duration)
+        geometry_cast.send(sender=None, type_name=type_name,
+                           size=size, duration=duration)
+        return result
+    return _cast
+
+
+def payload_size(value):
+    """
+    Return the size in bytes of a text value.
+    """
+    if isinstance(value, bytes):
+        return len(value)
+    return len(value.encode("utf-8"))
+
+
+def instrument_adapt(type_name, adapt_function, size=payload_size):
+    """
+    Wrap an adapter (``size`` measures its result) or a text encoder.
+    """
+    from .signals import geometry_adapted
+
+    def _adapt(value):
+        start = timer()
+        result = adapt_function(value)
+        duration = timer() - start
+
+        length = size(result)
+        record("adapt", type_name, length, duration)
+        geometry_adapted.send(sender=None, type_name=type_name,
+                              size=length, duration=duration)
+        return result
+
+    _adapt.wrapped = adapt_function
+    return _adapt
+
+
+def adapted_size(adapted):
+    return payload_size(adapted.getquoted())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from .adapt import ADAPT_MAPPER, TEXT_MAPPER, as_is
+
+
+class LazyGeometry(object):
+    """
+    Proxy that keeps the raw postgresql text of a geometric value and
+    parses it on first use (attribute access, iteration, comparison...).
+
+    ``isinstance`` checks against the proxied class work without
+    parsing the value.
+    """
+
+    __slots__ = ('_cls', '_cast', '_raw', '_value')
+
+    def __init__(self, cls, raw, cast):
+        self._cls = cls
+        self._cast = cast
+        self._raw = raw
+        self._value = None
+
+    @property
+    def __class__(self):
+        return self._cls
+
+    @property
+    def is_resolved(self):
+        return self._raw is None
+
+    def _resolve(self):
+        if self._raw is not None:
+            self._value = self._cast(self._raw, None)
+            self._raw = None
+        return self._value
+
+    def __getattr__(self, name):
+        # geometric classes use __slots__, so every instance attribute
+        # is visible on the class; other lookups (hasattr probes made by
+        # django or psycopg2) fail without parsing the value.
+        if not hasattr(self._cls, name):
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+    def __getitem__(self, index):
+        return self._resolve()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, LazyGeometry):
+            other = other._resolve()
+        return self._resolve() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self._resolve())
+
+    def __reduce_ex__(self, protocol):
+        return self._resolve().__reduce_ex__(protocol)
+
+
+def lazy_cast(cls, cast_function):
+    """
+    Wrap a typecaster function for return ``LazyGeometry`` proxies.
+    """
+
+    def _cast(value, cur):
+        if value is None:
+            return None
+        return LazyGeometry(cls, value, cast_function)
+    return _cast
+
+
+def adapt_lazy(obj):
+    """
+    Send back unparsed values as received, without decoding them.
+    """
+    if obj._raw is not None:
+        return as_is("'%s'::%s" % (obj._raw.replace("'", "''"),
+                                  obj._cls.type_name().lower()))
+    return ADAPT_MAPPER[obj._cls.type_name()](obj._value)
+
+
+def text_lazy(obj):
+    if obj._raw is not None:
+        return obj._raw
+    return TEXT_MAPPER[obj._cls.type_name()](obj._value)
+
+TEXT_MAPPER['LazyGeometry'] = text_lazy
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Field lookups for the geometric operators exposed by
+``expressions.GeoExpression``, usable in ``filter()``, ``exclude()``,
+``get()`` and ``Q`` objects of a ``GeoQuerySet``
+(``pos__contained_on=Box(...)``), also through relations and combined
+with other lookups. ``GeometricField`` accepts them and
+``query.GeoWhereNode`` renders them with ``lookup_sql``.
+"""
+
+from .adapt import to_text, array_type_name, text_array
+from .objects import Point, Box, Polygon
+
+# lookup name -> operator, named as GeoExpression methods
+GEOMETRIC_OPERATORS = {
+    'overlaps': '&&',
+    'is_strictly_left_of': '<<',
+    'is_strictly_right_of': '>>',
+    'does_not_extend_above': '&<|',
+    'does_not_extend_below': '|&>',
+    'does_not_extend_right': '&<',
+    'does_not_extend_left': '&>',
+    'intersects_with': '?#',
+    'contains': '@>',
+    'contained_on': '<@',
+    'is_horizontal_aligned': '?-',
+    'is_vertical_aligned': '?|',
+    'is_perpendicular_to': '?-|',
+    'is_parallel_to': '?||',
+    'same_as': '~=',
+}
+
+# unary lookups, used as ``lseg__is_horizontal=True``
+GEOMETRIC_UNARY_OPERATORS = {
+    'is_horizontal': '?-',
+    'is_vertical': '?|',
+}
+
+# operators implying that the bounding boxes overlap, so a companion
+# box column (``GeometricField(bbox_field=True)``) can prefilter them
+BBOX_PREFILTER_OPERATORS = ('&&', '@>', '<@', '?#', '~=')
+
+# every lookup name, ``within_distance`` takes a ``(point, radius)`` pair
+GEOMETRIC_LOOKUPS = frozenset(list(GEOMETRIC_OPERATORS) +
+    list(GEOMETRIC_UNARY_OPERATORS) + ['not_intersects_with', 'within_distance'])
+
+
+def bbox_prefilter(column, operator, value):
+    """
+    Return ``(sql, params)`` of the ``column && bounding box`` condition
+    that can precede the ``operator`` predicate on ``value``, or None.
+    """
+    if operator not in BBOX_PREFILTER_OPERATORS:
+        return None
+
+    if isinstance(value, (list, tuple)):
+        if array_type_name(value) is None:
+            return None
+        boxes = [v.bounding_box() for v in value]
+        return "%s && ANY(%%s::box[])" % column, [text_array(boxes, 'Box')]
+
+    if to_text(value) is None:
+        return None
+    return "%s && %%s::box" % column, [to_text(value.bounding_box())]
+
+
+def operand_sql(value):
+    """
+    Return ``(sql, params)`` of the right operand of a geometric
+    operator: a typed text parameter (``%s::box``) for a geometric value
+    and an array compared with ``ANY`` (``ANY(%s::box[])``) for a list or
+    tuple of them.
+    """
+    if isinstance(value, (list, tuple)):
+        type_name = array_type_name(value)
+        if type_name is not None:
+            return "ANY(%%s::%s[])" % type_name.lower(), [text_array(value, type_name)]
+
+    text = to_text(value)
+    if text is None:
+        return "%s", [value]
+    return "%%s::%s" % value.__class__.__name__.lower(), [text]
+
+
+def lookup_sql(column, lookup_type, value, dbtype, bbox_column=None):
+    """
+    Return ``(sql, params)`` of the geometric lookup ``lookup_type`` of
+    ``column`` (of the geometric type ``dbtype``) with ``value``. The
+    companion box column ``bbox_column`` prefilters the operators
+    implying that the bounding boxes overlap.
+    """
+    if lookup_type in GEOMETRIC_UNARY_OPERATORS:
+        sql = "%s %s" % (GEOMETRIC_UNARY_OPERATORS[lookup_type], column)
+        return (sql if value else "NOT %s" % sql), []
+    elif lookup_type == 'within_distance':
+        point, radius = value
+        return within_distance_sql(column, dbtype, point, radius, bbox_column)
+    elif lookup_type == 'not_intersects_with':
+        sql, params = lookup_sql(column, 'intersects_with', value, dbtype)
+        return "NOT (%s)" % sql, params
+
+    operator = GEOMETRIC_OPERATORS[lookup_type]
+    operand, params = operand_sql(value)
+    sql = "%s %s %s" % (column, operator, operand)
+
+    prefilter = None
+    if bbox_column is not None:
+        prefilter = bbox_prefilter(bbox_column, operator, value)
+    if prefilter is None:
+        return sql, params
+    return "(%s AND %s)" % (prefilter[0], sql), prefilter[1] + params
+
+
+def within_distance_sql(column, dbtype, point, radius, bbox_column=None):
+    """
+    Return ``(sql, params)`` of the predicate ``distance from point to
+    column <= radius``, indexable for the ``dbtype`` of the column:
+    ``column <@ circle`` for points, ``column && circle`` for circles and
+    a ``&&`` prefilter against the bounding box of the circle (on the
+    companion box column if there is one) followed by the exact distance
+    for the other types.
+    """
+    if not isinstance(point, Point):
+        point = Point(*point)
+    center = to_text(point)
+
+    if dbtype == 'point':
+        return "%s <@ circle(%%s::point, %%s)" % column, [center, radius]
+    elif dbtype == 'circle':
+        return "%s && circle(%%s::point, %%s)" % column, [center, radius]
+
+    sql = "%%s::point <-> %s <= %%s" % column
+    params = [center, radius]
+
+    xmin, ymin, xmax, ymax = point.x - radius, point.y - radius, \
+        point.x + radius, point.y + radius
+    if bbox_column is not None:
+        column, dbtype = bbox_column, 'box'
+
+    if dbtype == 'box':
+        extent = to_text(Box([xmin, ymin], [xmax, ymax]))
+    elif dbtype == 'polygon':
+        extent = to_text(Polygon.from_coords([xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax]))
+    else:
+        # lseg and path columns can not be indexed
+        return sql, params
+
+    return "(%s && %%s::%s AND %s)" % (column, dbtype, sql), [extent] + params
+
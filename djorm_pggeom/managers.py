@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+from django.db import connections
+from django.db.models.fields import FieldDoesNotExist
+from djorm_expressions.models import ExpressionQuerySet, ExpressionManager
+
+from .expressions import GeoExpression, BoundingBoxExpression
+from .adapt import array_type_name, text_array, to_text
+from .cursors import server_side_chunks
+from .fields import bounding_box
+from .lookups import GEOMETRIC_OPERATORS
+from .objects import CAST_MAPPER
+from .query import GeoQuery
+from .registry import ensure_registered
+from . import functions, parallel
+
+# the elements of the array are numbered by a generate_series of the
+# same length, which set returning functions in the select list follow
+# in lockstep: WITH ORDINALITY requires postgresql >= 9.4
+UNNEST_JOIN_SQL = """
+SELECT _q._pk, _v._index - 1 FROM (%(query)s) AS _q (_pk, _geometry)
+JOIN (SELECT unnest(%%s::%(type)s[]), generate_series(1, %%s)) AS _v (_value, _index)
+ON _q._geometry %(operator)s _v._value
+ORDER BY _v._index, _q._pk
+"""
+
+CLUSTER_GRID_SQL = """
+SELECT floor((_q._point[0] - %%s) / %%s), floor((_q._point[1] - %%s) / %%s), count(*),
+    point(avg(_q._point[0]), avg(_q._point[1])),
+    box(point(min(_q._point[0]), min(_q._point[1])), point(max(_q._point[0]), max(_q._point[1])))
+FROM (%(query)s) AS _q (_point)
+WHERE _q._point IS NOT NULL%(viewport)s
+GROUP BY 1, 2
+ORDER BY 1, 2
+"""
+
+# projections of geometry_summary: suffix, function, column types
+SUMMARY_FUNCTIONS = (
+    ("bbox", functions.BoundingBox, None),
+    ("center", functions.Center, None),
+    ("npoints", functions.NPoints, ("path", "polygon")),
+    ("area", functions.Area, ("box", "circle", "path", "polygon")),
+)
+
+
+class GeoQuerySetMixin(object):
+    def __init__(self, model=None, query=None, using=None):
+        # the geometric lookups are parsed and rendered by GeoQuery
+        super(GeoQuerySetMixin, self).__init__(model, query or GeoQuery(model), using)
+
+    def nearest(self, field, value, k=10, distance_alias=None):
+        """
+        Return the ``k`` rows nearest to ``value`` ordered by distance.
+
+        The query is rendered as ``ORDER BY field <-> value LIMIT k``,
+        which postgresql resolves with a GiST index scan (KNN) when
+        ``field`` has one. The distance is annotated on each row as
+        ``distance_alias`` (by default ``<field>_distance``).
+        """
+        alias = distance_alias or "%s_distance" % field.replace("__", "_")
+        qs = self.annotate_functions(**{
+            alias: functions.Distance(field).between(value)})
+
+        qs = qs.order_by(alias)
+        return qs[:k] if k is not None else qs
+
+    def within_distance(self, field, point, radius, distance_alias=None):
+        """
+        Filter the rows whose ``field`` is at most ``radius`` from
+        ``point``, using its spatial index. With ``distance_alias`` the
+        distance is annotated on each row.
+        """
+        qs = self.where(GeoExpression(field).within_distance(point, radius))
+        if distance_alias is not None:
+            qs = qs.annotate_functions(**{
+                distance_alias: functions.Distance(field).between(point)})
+        return qs
+
+    def _geometric_dbtype(self, field):
+        return self.model._meta.get_field(field).dbtype_name.lower()
+
+    def update(self, **kwargs):
+        """
+        Update the companion box columns (``bbox_field``) of the
+        geometric fields set, computed in the database for expressions
+        (``F("other_path")``).
+        """
+        for name, value in list(kwargs.items()):
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+
+            companion = getattr(field, "bbox_field", None)
+            if not companion or companion in kwargs:
+                continue
+            elif hasattr(value, "evaluate"):
+                kwargs[companion] = BoundingBoxExpression(value, field.dbtype_name.lower())
+            else:
+                kwargs[companion] = bounding_box(value, field.dbtype_name)
+        return super(GeoQuerySetMixin, self).update(**kwargs)
+
+    def only_bbox(self, field, alias=None):
+        """
+        Defer the geometric ``field`` and load only its bounding box,
+        as a ``Box`` in ``alias`` (by default ``<field>_bbox``). Fields
+        with a companion box column (``bbox_field``) load it instead.
+        """
+        companion = self.model._meta.get_field(field).bbox_field
+        if companion and alias in (None, companion):
+            return self.defer(field)
+
+        alias = alias or "%s_bbox" % field
+        bbox = functions.BoundingBox(field, dbtype=self._geometric_dbtype(field))
+        return self.defer(field).annotate_functions(**{alias: bbox})
+
+    def geometry_summary(self, field):
+        """
+        Defer the geometric ``field`` and load a summary instead:
+        ``<field>_bbox`` (``Box``), ``<field>_center`` (``Point``) and,
+        for the types that define them, ``<field>_npoints`` and
+        ``<field>_area``.
+        """
+        dbtype = self._geometric_dbtype(field)
+        annotations = {}
+        for suffix, function, dbtypes in SUMMARY_FUNCTIONS:
+            if dbtypes is None or dbtype in dbtypes:
+                annotations["%s_%s" % (field, suffix)] = function(field, dbtype=dbtype)
+        return self.defer(field).annotate_functions(**annotations)
+
+    def cluster_grid(self, field, cell_size, bbox=None, origin=(0, 0)):
+        """
+        Group the rows in the cells of a grid of ``cell_size`` (a number
+        or a ``(width, height)`` pair) starting at ``origin``, by the
+        ``field`` point (or its center for other types), with one
+        aggregate query. Return a list of dicts with the ``cell``
+        (column and row), the ``count`` of rows, their ``center`` and
+        their ``extent`` (a ``Box``), ordered by cell::
+
+            Shop.objects.cluster_grid("pos", 0.5, bbox=Box(...))
+
+        With ``bbox`` only the points in the viewport are grouped; for
+        point columns the filter (``<@``) can use their spatial index.
+        """
+        if isinstance(cell_size, (list, tuple)):
+            width, height = cell_size
+        else:
+            width = height = cell_size
+
+        dbtype = self._geometric_dbtype(field)
+        qs, viewport, params = self.order_by(), "", []
+        if dbtype == "point":
+            if bbox is not None:
+                qs = qs.where(GeoExpression(field).contained_on(bbox))
+            qs = qs.values_list(field)
+        else:
+            qs = qs.annotate_functions(_point=functions.Center(field, dbtype=dbtype))\
+                .values_list("_point")
+            if bbox is not None:
+                viewport, params = " AND _q._point <@ %s::box", [to_text(bbox)]
+
+        query, query_params = qs.query.get_compiler(self.db).as_sql()
+        sql = CLUSTER_GRID_SQL % {"query": query, "viewport": viewport}
+        params = [origin[0], width, origin[1], height] + list(query_params) + params
+
+        cursor = connections[self.db].cursor()
+        try:
+            cursor.execute(sql, params)
+            return [{"cell": (int(x), int(y)), "count": count, "center": center,
+                     "extent": extent} for x, y, count, center, extent in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def _geometry_text_sql(self, field):
+        """
+        Return ``(sql, params)`` of a query selecting the text of the
+        geometric ``field`` and the primary key (in that order).
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        column = "%s.%s" % (qn(self.model._meta.db_table), qn(field.column))
+
+        # extra select columns always come first.
+        qs = self.extra(select={"_geometry_text": "%s::text" % column})\
+            .values_list("_geometry_text", "pk")
+        return qs.query.get_compiler(self.db).as_sql()
+
+    def iter_geometries(self, field, chunk_size=2000, pool=None, coords=False,
+                        prefetch=None):
+        """
+        Iterate over ``(pk, geometry)`` pairs of a geometric field using a
+        server side cursor, fetching and decoding ``chunk_size`` rows at
+        a time, so memory usage does not depend on the table size.
+
+        With a process ``pool`` (``multiprocessing.Pool`` or a
+        ``concurrent.futures`` executor) the chunks are decoded by its
+        workers while the next ones are fetched, keeping the row order
+        (see ``parallel``). With ``coords`` the flat ``array('d')`` of
+        coordinates of every value is returned instead of an object.
+        """
+        field = self.model._meta.get_field(field)
+        type_name = field.dbtype_name
+
+        sql, params = self._geometry_text_sql(field)
+        chunks = server_side_chunks(connections[self.db], sql, params, chunk_size)
+
+        if pool is None and not coords:
+            cast = CAST_MAPPER[type_name]
+            for rows in chunks:
+                for value, pk in rows:
+                    yield pk, cast(value, None)
+            return
+
+        # the primary keys of the chunks being decoded
+        pks = deque()
+
+        def _values():
+            for rows in chunks:
+                pks.append([pk for value, pk in rows])
+                yield [value for value, pk in rows]
+
+        if pool is None:
+            decoded = (parallel.decode_chunk(type_name, values) for values in _values())
+        else:
+            decoded = parallel.parallel_decode(pool, type_name, _values(), prefetch)
+
+        for buffers in decoded:
+            if coords:
+                values = parallel.split_chunk(buffers[0], buffers[1])
+            else:
+                values = parallel.build_chunk(type_name, *buffers)
+            for pk, value in zip(pks.popleft(), values):
+                yield pk, value
+
+    def unnest_join(self, field, values, lookup="contains"):
+        """
+        Match a list of geometric values against the rows with one
+        query, joining them with ``unnest(array)``. Return the
+        ``(pk, index)`` pairs of the rows whose ``field`` satisfies
+        ``lookup`` (a ``GeoExpression`` method name) with the value at
+        ``index`` of ``values``::
+
+            # which zone contains each of 5000 points
+            Zone.objects.unnest_join("area", points, "contains")
+        """
+        type_name = array_type_name(values)
+        if type_name is None:
+            raise TypeError("values must be a sequence of geometric objects of the same type")
+
+        query, params = self.values_list("pk", field).query.get_compiler(self.db).as_sql()
+        sql = UNNEST_JOIN_SQL % {"query": query, "type": type_name.lower(),
+                                 "operator": GEOMETRIC_OPERATORS[lookup]}
+
+        cursor = connections[self.db].cursor()
+        try:
+            cursor.execute(sql, tuple(params) + (text_array(values, type_name), len(values)))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+class GeoManagerMixin(object):
+    def nearest(self, *args, **kwargs):
+        return self.get_query_set().nearest(*args, **kwargs)
+
+    def iter_geometries(self, *args, **kwargs):
+        return self.get_query_set().iter_geometries(*args, **kwargs)
+
+    def unnest_join(self, *args, **kwargs):
+        return self.get_query_set().unnest_join(*args, **kwargs)
+
+    def within_distance(self, *args, **kwargs):
+        return self.get_query_set().within_distance(*args, **kwargs)
+
+    def cluster_grid(self, *args, **kwargs):
+        return self.get_query_set().cluster_grid(*args, **kwargs)
+
+    def only_bbox(self, *args, **kwargs):
+        return self.get_query_set().only_bbox(*args, **kwargs)
+
+    def geometry_summary(self, *args, **kwargs):
+        return self.get_query_set().geometry_summary(*args, **kwargs)
+
+
+class GeoQuerySet(GeoQuerySetMixin, ExpressionQuerySet):
+    pass
+
+
+class GeoManager(GeoManagerMixin, ExpressionManager):
+    """
+    Expression manager with geometric helpers.
+    """
+
+    use_for_related_fields = True
+
+    def get_query_set(self):
+        ensure_registered(connections[self.db])
+        return GeoQuerySet(model=self.model, using=self._db)
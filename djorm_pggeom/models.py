@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
 
-def register_geometric_types(connection, **kwargs):
-    from . import objects
+from django.db.backends.signals import connection_created
 
-    for objectname in objects.__all__:
-        obj_class = getattr(objects, objectname)
-        obj_class.register_cast(connection)
-        obj_class.register_adapter()
-        print "Registering:", obj_class.__name__
+from .registry import ensure_registered
 
 
-from djorm_core.models import connection_handler
-connection_handler.attach_handler(register_geometric_types, vendor="postgresql", unique=True)
+def register_geometric_types(sender, connection, **kwargs):
+    # values() and raw cursors of any manager get geometric objects too
+    ensure_registered(connection)
+
+connection_created.connect(register_geometric_types,
+                           dispatch_uid="djorm_pggeom_register_types")
@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
 
-import re
-from django.utils import simplejson as json
-from django.db import connection
-from psycopg2.extensions import adapt, register_adapter, AsIs, new_type, register_type
+import sys
+from array import array
 
-from .adapt import ADAPT_MAPPER
+from .adapt import ADAPT_MAPPER, ARRAY_DELIMITERS, TEXT_MAPPER
+from .instrumentation import instrument_cast, instrument_adapt, adapted_size
+from .lazy import LazyGeometry, lazy_cast, adapt_lazy
+from .registry import get_type_oids
+from . import decoder
+
+try:
+    NUMBER_TYPES = (int, long, float)
+except NameError:
+    # python 3
+    NUMBER_TYPES = (int, float)
+    xrange = range
 
-rx_circle_float = re.compile(r'<\(([\d\.\-]*),([\d\.\-]*)\),([\d\.\-]*)>')
-rx_line = re.compile(r'\[\(([\d\.\-]*),\s*([\w\.\-]*)\),\s*\(([\d\.\-]*),\s*([\d\.\+]*)\)\]')
-rx_point = re.compile(r'\(([\d\.\-]*),\s*([\d\.\-]*)\)')
-rx_box = re.compile(r'\(([\d\.\-]*),\s*([\d\.\-]*)\),\s*\(([\d\.\-]*),\s*([\d\.\-]*)\)')
-rx_path_identify = re.compile(r'^((?:\(|\[))(.*)(?:\)|\])$')
 
 """ SQL->PYTHON CAST """
 
@@ -19,82 +23,40 @@ def cast_point(value, cur):
     if value is None:
         return None
 
-    res = rx_point.search(value)
-    if not res:
-        raise ValueError("bad point representation: %r" % value)
-
-    return Point.from_tuple([int(x) if "." not in x else float(x) \
-        for x in res.groups()])
+    return Point.from_tuple(decoder.decode_point(value))
 
 
 def cast_circle(value, cur):
     if value is None:
         return None
 
-    rxres = rx_circle_float.search(value)
-    if not rxres:
-        raise ValueError("bad circle representation: %r" % value)
-
-    return Circle.from_tuple([int(x) if "." not in x else float(x) \
-        for x in rxres.groups()])
+    return Circle.from_tuple(decoder.decode_circle(value))
 
 def cast_lseg(value, cur):
     if value is None:
         return None
 
-    rxres = rx_line.search(value)
-    if not rxres:
-        raise ValueError("bad lseg representation: %r" % value)
-
-    return Lseg.from_tuple([int(x) if "." not in x else float(x) \
-        for x in rxres.groups()])
+    coords = decoder.decode_lseg(value)
+    return Lseg(coords[:2], coords[2:])
 
 def cast_box(value, cur):
     if value is None:
         return None
 
-    rxres = rx_box.search(value)
-    if not rxres:
-        raise ValueError("bad box representation: %r" % value)
-
-    return Box.from_tuple([int(x) if "." not in x else float(x) \
-        for x in rxres.groups()])
+    return Box.from_tuple(decoder.decode_box(value))
 
 def cast_path(value, cur):
     if value is None:
         return None
 
-    ident = rx_path_identify.search(value)
-    if not ident:
-        raise ValueError("bad path representation: %r" % value)
-
-    is_closed = True if "(" == ident.group(1) else False
-    points = ident.group(2)
-    if not points.strip():
-        raise ValueError("bad path representation: %r" % value)
-
-    return Path(*[(
-        int(x) if "." not in x else float(x), \
-        int(y) if "." not in y else float(y) \
-    ) for x, y in rx_point.findall(points)], closed=is_closed)
+    is_closed, coords = decoder.decode_path(value)
+    return Path.from_coords(coords, closed=is_closed)
 
 def cast_polygon(value, cur):
     if value is None:
         return None
 
-    ident = rx_path_identify.search(value)
-    if not ident:
-        raise ValueError("bad path representation: %r" % value)
-
-    is_closed = True if "(" == ident.group(1) else False
-    points = ident.group(2)
-    if not points.strip():
-        raise ValueError("bad path representation: %r" % value)
-
-    return Polygon(*[(
-        int(x) if "." not in x else float(x), \
-        int(y) if "." not in y else float(y) \
-    ) for x, y in rx_point.findall(points)], closed=is_closed)
+    return Polygon.from_coords(decoder.decode_polygon(value))
 
 
 CAST_MAPPER = {
@@ -106,6 +68,53 @@ CAST_MAPPER = {
     'Lseg': cast_lseg,
 }
 
+def array_cast(cls, cast_function):
+    """
+    Build the typecaster of the array type of ``cls``.
+    """
+    delimiter = ARRAY_DELIMITERS.get(cls.type_name(), ",")
+
+    def _cast(value, cur):
+        if value is None:
+            return None
+        return [cast_function(x, cur) for x in decoder.decode_array(value, delimiter)]
+    return _cast
+
+
+""" PICKLING """
+
+# coordinate buffers are pickled as little endian doubles
+_SWAP_BYTES = sys.byteorder != "little"
+
+
+def pack_coords(coords):
+    """
+    Return the coordinates as a little endian buffer of doubles.
+    """
+    if _SWAP_BYTES or not isinstance(coords, array) or coords.typecode != 'd':
+        coords = array('d', coords)
+    if _SWAP_BYTES:
+        coords.byteswap()
+    return coords.tostring() if hasattr(coords, "tostring") else coords.tobytes()
+
+
+def unpack_coords(data):
+    """
+    Return the ``array('d')`` of a ``pack_coords`` buffer.
+    """
+    coords = array('d')
+    if hasattr(coords, "frombytes"):
+        coords.frombytes(data)
+    else:
+        coords.fromstring(data)
+    if _SWAP_BYTES:
+        coords.byteswap()
+    return coords
+
+
+def _unpickle_path(cls, data, closed):
+    return cls.from_coords(unpack_coords(data), closed=closed, copy=False)
+
 
 class GeometricMeta(type):
     """
@@ -123,19 +132,38 @@ class GeometricMeta(type):
     #        return super(GeometricMeta, cls).__call__(*args)
     #    raise ValueError("Incorrect parameters")
 
-    def register_cast(cls, connection):
+    def register_cast(cls, connection, lazy=False, instrument=False):
+        from psycopg2 import extensions
+
         cast_function = CAST_MAPPER[cls.type_name()]
-        cursor = connection.cursor()
-        cursor.execute(cls.sql_for_oid())
-        oid = cursor.description[0][1]
-        cursor.close()
+        if instrument:
+            cast_function = instrument_cast(cls.type_name(), cast_function)
+        if lazy:
+            cast_function = lazy_cast(cls, cast_function)
+            extensions.register_adapter(LazyGeometry, adapt_lazy)
+
+        oid, array_oid = get_type_oids()[cls.db_type(connection)]
+        PGTYPE = extensions.new_type((oid,), cls.type_name().upper(), cast_function)
+        extensions.register_type(PGTYPE)
 
-        PGTYPE = new_type((oid,), cls.type_name().upper(), cast_function)
-        register_type(PGTYPE)
+        PGARRAY = extensions.new_type((array_oid,), "%sARRAY" % cls.type_name().upper(),
+                                      array_cast(cls, cast_function))
+        extensions.register_type(PGARRAY)
 
-    def register_adapter(cls):
-        adapt_function = ADAPT_MAPPER[cls.type_name()]
-        register_adapter(cls, adapt_function)
+    def register_adapter(cls, instrument=False):
+        from psycopg2 import extensions
+
+        name = cls.type_name()
+        adapt_function = ADAPT_MAPPER[name]
+
+        # the text encoders are used for the parameters of the orm
+        text_function = getattr(TEXT_MAPPER[name], "wrapped", TEXT_MAPPER[name])
+        if instrument:
+            adapt_function = instrument_adapt(name, adapt_function, adapted_size)
+            text_function = instrument_adapt(name, text_function)
+
+        TEXT_MAPPER[name] = text_function
+        extensions.register_adapter(cls, adapt_function)
 
     def type_name(cls):
         return cls.__name__
@@ -143,21 +171,22 @@ class GeometricMeta(type):
     def db_type(cls, connection):
         return cls.type_name().lower()
 
-    def sql_for_oid(cls):
-        ntype = cls.type_name().lower()
-        return "SELECT NULL::%s" % (ntype)
+
+# declared without __metaclass__, valid for python 2 and 3
+GeometricBase = GeometricMeta(str("GeometricBase"), (object,), {"__slots__": ()})
 
 
-class Point(object):
+
+class Point(GeometricBase):
     """
     Class that rep resents of geometric point.
     """
-    __metaclass__ = GeometricMeta
+    __slots__ = ('x', 'y')
 
     def __init__(self, x, y):
         super(Point, self).__init__()
-        assert isinstance(x, (int, long, float)), "x must be int or float"
-        assert isinstance(y, (int, long, float)), "y must be int or float"
+        assert isinstance(x, NUMBER_TYPES), "x must be int or float"
+        assert isinstance(y, NUMBER_TYPES), "y must be int or float"
 
         self.x = x
         self.y = y
@@ -170,7 +199,18 @@ class Point(object):
         return "<Point({0},{1})>".format(self.x, self.y)
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Point):
+            return NotImplemented
+        return self.x == other.x and self.y == other.y
+
+    def __ne__(self, other):
+        return not self == other
+
+    def bounding_box(self):
+        return Box(self, self)
+
+    def __reduce__(self):
+        return (Point, (self.x, self.y))
 
     @classmethod
     def from_tuple(cls, data):
@@ -179,13 +219,13 @@ class Point(object):
         return cls(data[0], data[1])
 
 
-class Circle(object):
-    __metaclass__ = GeometricMeta
+class Circle(GeometricBase):
+    __slots__ = ('point', 'r')
 
     def __init__(self, point, radius):
         super(Circle, self).__init__()
         assert isinstance(point, (list, tuple, Point)), "point must be a list or Point instance"
-        assert isinstance(radius, (int, long, float)), "radius must be int or float"
+        assert isinstance(radius, NUMBER_TYPES), "radius must be int or float"
 
         if isinstance(point, (list, tuple)):
             if len(point) != 2:
@@ -205,7 +245,19 @@ class Circle(object):
         yield self.r
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Circle):
+            return NotImplemented
+        return self.point == other.point and self.r == other.r
+
+    def __ne__(self, other):
+        return not self == other
+
+    def bounding_box(self):
+        x, y, r = self.point.x, self.point.y, self.r
+        return Box([x - r, y - r], [x + r, y + r])
+
+    def __reduce__(self):
+        return (Circle, ((self.point.x, self.point.y), self.r))
 
     @classmethod
     def from_tuple(cls, data):
@@ -220,8 +272,8 @@ class Circle(object):
         raise ValueError("Incorrect length of data parameter")
 
 
-class Lseg(object):
-    __metaclass__ = GeometricMeta
+class Lseg(GeometricBase):
+    __slots__ = ('start_point', 'end_point')
 
     def __init__(self, start_point, end_point):
         super(Lseg, self).__init__()
@@ -247,7 +299,20 @@ class Lseg(object):
         yield self.end_point
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Lseg):
+            return NotImplemented
+        return self.start_point == other.start_point and \
+            self.end_point == other.end_point
+
+    def __ne__(self, other):
+        return not self == other
+
+    def bounding_box(self):
+        (x1, y1), (x2, y2) = self
+        return Box([min(x1, x2), min(y1, y2)], [max(x1, x2), max(y1, y2)])
+
+    def __reduce__(self):
+        return (self.__class__, (tuple(self.start_point), tuple(self.end_point)))
 
     @classmethod
     def from_tuple(cls, data):
@@ -259,8 +324,8 @@ class Lseg(object):
 
 
 
-class Box(object):
-    __metaclass__ = GeometricMeta
+class Box(GeometricBase):
+    __slots__ = ('start_point', 'end_point')
 
     def __init__(self, start_point, end_point):
         super(Box, self).__init__()
@@ -286,7 +351,20 @@ class Box(object):
         yield self.end_point
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Box):
+            return NotImplemented
+        return self.start_point == other.start_point and \
+            self.end_point == other.end_point
+
+    def __ne__(self, other):
+        return not self == other
+
+    def bounding_box(self):
+        (x1, y1), (x2, y2) = self
+        return Box([min(x1, x2), min(y1, y2)], [max(x1, x2), max(y1, y2)])
+
+    def __reduce__(self):
+        return (self.__class__, (tuple(self.start_point), tuple(self.end_point)))
 
     @classmethod
     def from_tuple(cls, data):
@@ -297,14 +375,16 @@ class Box(object):
         raise ValueError("Incorrect length of data parameter")
 
 
-class Path(object):
-    __metaclass__ = GeometricMeta
-
-    closed = False
+class Path(GeometricBase):
+    """
+    Sequence of points stored as one flat ``array('d')`` of
+    coordinates. Point instances are only created on access.
+    """
+    __slots__ = ('coords', 'closed')
 
     def __init__(self, *args, **kwargs):
         super(Path, self).__init__()
-        self.points = []
+        self.coords = array('d')
         self.closed = kwargs.pop('closed', True)
 
         if len(args) < 1:
@@ -312,34 +392,102 @@ class Path(object):
 
         for item in args:
             if isinstance(item, (tuple, list)):
-                self.points.append(Point.from_tuple(item))
+                if len(item) != 2:
+                    raise ValueError("Incorrect lenght of data parameter")
+                self.coords.extend(item)
             elif isinstance(item, Point):
-                self.points.append(item)
+                self.coords.extend((item.x, item.y))
             else:
                 raise ValueError("invalid content")
 
+    @property
+    def points(self):
+        """
+        Tuple of the points, changes are made by assigning a new
+        sequence of points (or tuples).
+        """
+        return tuple(self)
+
+    @points.setter
+    def points(self, points):
+        coords = array('d')
+        for item in points:
+            if isinstance(item, Point):
+                coords.extend((item.x, item.y))
+            elif len(item) == 2:
+                coords.extend(item)
+            else:
+                raise ValueError("Incorrect lenght of data parameter")
+        self.coords = coords
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            coords = self.coords
+            return tuple(Point(coords[i * 2], coords[i * 2 + 1]) \
+                for i in xrange(*index.indices(len(self))))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("point index out of range")
+        return Point(self.coords[index * 2], self.coords[index * 2 + 1])
+
     def __repr__(self):
         return "<Path {0}...{1} closed={2} length={3}>".format(
-            self.points[0], self.points[-1], self.closed, len(self.points))
+            self[0], self[-1], self.closed, len(self))
 
     def __iter__(self):
-        for item in self.points:
-            yield item
+        coords = self.coords
+        for index in xrange(0, len(coords), 2):
+            yield Point(coords[index], coords[index + 1])
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Path):
+            return NotImplemented
+        return self.closed == other.closed and self.coords == other.coords
+
+    def __ne__(self, other):
+        return not self == other
+
+    def bounding_box(self):
+        xs, ys = self.coords[::2], self.coords[1::2]
+        return Box([min(xs), min(ys)], [max(xs), max(ys)])
+
+    def __reduce__(self):
+        # one buffer instead of a pickled float per coordinate
+        return (_unpickle_path, (self.__class__, pack_coords(self.coords), self.closed))
 
     @classmethod
-    def from_tuple(self, data):
+    def from_tuple(cls, data):
         return cls(*data)
 
+    @classmethod
+    def from_coords(cls, coords, closed=True, copy=True):
+        """
+        Create instance from a flat sequence of coordinates
+        (x1, y1, x2, y2, ...) without creating intermediate points.
+        With ``copy=False`` an ``array('d')`` is used as is.
+        """
+        if not coords or len(coords) % 2:
+            raise ValueError("Incorrect length of coords parameter")
+
+        obj = cls.__new__(cls)
+        if copy or not isinstance(coords, array) or coords.typecode != 'd':
+            coords = array('d', coords)
+        obj.coords = coords
+        obj.closed = closed
+        return obj
+
 
 class Polygon(Path):
-    __metaclass__ = GeometricMeta
+    __slots__ = ()
 
     def __repr__(self):
         return "<Polygon {0}...{1} closed={2} length={3}>".format(
-            self.points[0], self.points[-1], self.closed, len(self.points))
+            self[0], self[-1], self.closed, len(self))
 
 
 __all__ = ['Polygon', 'Point', 'Box', 'Circle', 'Path', 'Lseg']
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decoding of chunks of geometric text values in other processes, for
+result sets too large to be parsed by one core.
+
+Workers return every chunk as flat buffers (an ``array('d')`` with the
+coordinates of all the values and an ``array('l')`` with the number of
+coordinates of each one, -1 for NULL), which are pickled as raw bytes;
+the geometric objects are rebuilt from them in the calling process
+without parsing text::
+
+    pool = multiprocessing.Pool(4)
+    for pk, polygon in Zone.objects.iter_geometries("area", pool=pool):
+        ...
+
+Any ``multiprocessing.Pool`` or ``concurrent.futures`` executor can be
+used. Results keep the order of the chunks.
+"""
+
+from array import array
+from collections import deque
+
+from . import decoder
+from .objects import Point, Circle, Lseg, Box, Path, Polygon
+
+# type name -> function returning the flat coordinates of a text value,
+# paths are decoded with their closed flag
+FLAT_DECODERS = {
+    'Point': decoder.decode_point,
+    'Circle': decoder.decode_circle,
+    'Lseg': decoder.decode_lseg,
+    'Box': decoder.decode_box,
+    'Polygon': decoder.decode_polygon,
+}
+
+# type name -> function building an object from its flat coordinates
+BUILDERS = {
+    'Point': lambda coords: Point.from_tuple(coords.tolist()),
+    'Circle': lambda coords: Circle.from_tuple(coords.tolist()),
+    'Lseg': lambda coords: Lseg(coords[:2].tolist(), coords[2:].tolist()),
+    'Box': lambda coords: Box.from_tuple(coords.tolist()),
+    'Polygon': lambda coords: Polygon.from_coords(coords, copy=False),
+}
+
+
+def decode_chunk(type_name, values):
+    """
+    Decode a list of text values (or None) of ``type_name`` and return
+    the ``(coords, lengths, closed)`` buffers of the chunk; ``closed``
+    has the flag of every path, and is empty for other types.
+    """
+    is_path = type_name == 'Path'
+    decode = decoder.decode_path if is_path else FLAT_DECODERS[type_name]
+    coords, lengths, closed = array('d'), array('l'), bytearray()
+
+    for value in values:
+        if value is None:
+            lengths.append(-1)
+            if is_path:
+                closed.append(0)
+            continue
+
+        if is_path:
+            is_closed, value_coords = decode(value)
+            closed.append(is_closed)
+        else:
+            value_coords = decode(value)
+        coords.extend(value_coords)
+        lengths.append(len(value_coords))
+
+    return coords, lengths, closed
+
+
+def split_chunk(coords, lengths):
+    """
+    Yield the coordinates of every value of a decoded chunk as an
+    ``array('d')``, or None.
+    """
+    offset = 0
+    for length in lengths:
+        if length < 0:
+            yield None
+            continue
+        yield coords[offset:offset + length]
+        offset += length
+
+
+def build_chunk(type_name, coords, lengths, closed):
+    """
+    Return the geometric objects of a decoded chunk.
+    """
+    if type_name == 'Path':
+        return [None if value is None else
+                Path.from_coords(value, closed=bool(is_closed), copy=False)
+                for value, is_closed in zip(split_chunk(coords, lengths), closed)]
+
+    build = BUILDERS[type_name]
+    return [None if value is None else build(value) \
+        for value in split_chunk(coords, lengths)]
+
+
+def _submit(pool, func, *args):
+    """
+    Schedule ``func(*args)`` in a multiprocessing pool or a futures
+    executor and return a function waiting for the result.
+    """
+    if hasattr(pool, "submit"):
+        return pool.submit(func, *args).result
+    return pool.apply_async(func, args).get
+
+
+def parallel_decode(pool, type_name, chunks, prefetch=None):
+    """
+    Decode ``chunks`` (lists of text values) in ``pool`` and yield the
+    decoded buffers in order. At most ``prefetch`` chunks (by default
+    twice the pool size) are pending, so memory usage is bounded.
+    """
+    if prefetch is None:
+        prefetch = 2 * (getattr(pool, "_processes", None) or
+                        getattr(pool, "_max_workers", None) or 2)
+
+    pending = deque()
+    for chunk in chunks:
+        pending.append(_submit(pool, decode_chunk, type_name, chunk))
+        if len(pending) >= prefetch:
+            yield pending.popleft()()
+
+    while pending:
+        yield pending.popleft()()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Query classes of ``GeoQuerySet``: ``GeoQuery`` parses the geometric
+lookups (``pos__contained_on``) as lookup types, on the field of the
+model or through relations, and ``GeoWhereNode`` renders them, so they
+are combined, negated and joined like any other lookup.
+
+Django resolves the lookup types with the query class, so they are
+available on the querysets of ``GeoManager`` (also on the related
+managers, and on the ``exclude()`` subqueries), as the lookups of
+``django.contrib.gis`` on its ``GeoManager``.
+"""
+
+from django.db.models.sql.constants import QUERY_TERMS
+from django.db.models.sql.query import Query
+from django.db.models.sql.where import WhereNode, Constraint, AND
+
+from .fields import GeometricField
+from .lookups import GEOMETRIC_LOOKUPS, lookup_sql
+
+
+class GeoWhereNode(WhereNode):
+    """
+    Where node rendering the geometric lookups of geometric fields with
+    ``lookups.lookup_sql``, with their companion box column as
+    prefilter. The other lookups are rendered by django.
+    """
+
+    def make_atom(self, child, qn, connection):
+        lvalue, lookup_type, value_annotation, value = child
+        if not isinstance(lvalue, Constraint) or lookup_type not in GEOMETRIC_LOOKUPS \
+                or not isinstance(lvalue.field, GeometricField):
+            return super(GeoWhereNode, self).make_atom(child, qn, connection)
+
+        field = lvalue.field
+        (alias, column, db_type), params = lvalue.process(lookup_type, value, connection)
+        column_sql = self.sql_for_columns((alias, column, db_type), qn, connection)
+
+        bbox_column_sql = None
+        if field.bbox_field:
+            companion = field.model._meta.get_field(field.bbox_field)
+            bbox_column_sql = self.sql_for_columns((alias, companion.column, None),
+                                                   qn, connection)
+
+        return lookup_sql(column_sql, lookup_type, params[0],
+                          field.dbtype_name.lower(), bbox_column_sql)
+
+
+class GeoQuery(Query):
+    """
+    Query accepting the geometric lookup types, rendered by
+    ``GeoWhereNode``.
+    """
+
+    query_terms = QUERY_TERMS | GEOMETRIC_LOOKUPS
+
+    def __init__(self, model, where=GeoWhereNode):
+        super(GeoQuery, self).__init__(model, where)
+
+    def split_exclude(self, filter_expr, prefix, can_reuse):
+        """
+        As ``Query.split_exclude``, with the subquery of the excluded
+        rows of a multi-valued relation built by this class, so it can
+        use the geometric lookups.
+        """
+        query = self.__class__(self.model)
+        query.add_filter(filter_expr)
+        query.bump_prefix()
+        query.clear_ordering(True)
+        query.set_start(prefix)
+        alias, col = query.select[0]
+        query.where.add((Constraint(alias, col, None), 'isnull', False), AND)
+
+        self.add_filter(('%s__in' % prefix, query), negate=True, trim=True,
+                can_reuse=can_reuse)
+
+        active_positions = len([count for count
+                                in query.alias_refcount.items() if count])
+        if active_positions > 1:
+            self.add_filter(('%s__isnull' % prefix, False), negate=True,
+                    trim=True, can_reuse=can_reuse)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+Installation of the typecasters and adapters of the geometric types.
+
+Nothing is done on import. ``ensure_registered`` is called when a
+django connection is created (see ``models``) and by the entry points
+reading geometric values (``GeoManager`` querysets, geometric query
+parameters, ``serializers``, ``GeometryArray`` and ``SpatialIndex``),
+and it is a flag check after the first time. The geometric types are
+built into postgresql with fixed oids, so no query is needed.
+"""
+
+import logging
+from timeit import default_timer as timer
+
+logger = logging.getLogger("djorm_pggeom")
+
+GEOMETRIC_TYPES = ('point', 'lseg', 'box', 'path', 'polygon', 'circle')
+
+# {typname: (oid, array oid)}, as defined by pg_type.dat
+BUILTIN_TYPE_OIDS = {
+    'point': (600, 1017),
+    'lseg': (601, 1018),
+    'path': (602, 1019),
+    'box': (603, 1020),
+    'polygon': (604, 1027),
+    'circle': (718, 719),
+}
+
+_installed = False
+
+
+def get_type_oids():
+    """
+    Return the oids of all geometric types and their arrays.
+    """
+    return BUILTIN_TYPE_OIDS
+
+
+def ensure_registered(connection):
+    """
+    Register the geometric types unless it is already done.
+    """
+    if not _installed:
+        register_geometric_types(connection)
+
+
+def register_geometric_types(connection, **kwargs):
+    """
+    Install the typecasters and adapters of all geometric types.
+
+    psycopg2 keeps them globally, so this only does work the first time
+    it is called in a process.
+    """
+    global _installed
+    if _installed:
+        return
+
+    from django.conf import settings
+
+    from . import objects
+    from .instrumentation import record, ALL_TYPES
+    from .signals import geometric_types_registered
+
+    start = timer()
+
+    # DJORM_PGGEOM_LAZY: True for all types or a list of type names.
+    lazy = getattr(settings, "DJORM_PGGEOM_LAZY", False)
+    instrument = getattr(settings, "DJORM_PGGEOM_INSTRUMENT", False)
+
+    for objectname in objects.__all__:
+        obj_class = getattr(objects, objectname)
+        obj_class.register_cast(connection,
+            lazy=(lazy is True or objectname in (lazy or ())),
+            instrument=instrument)
+        obj_class.register_adapter(instrument=instrument)
+        logger.debug("Registering: %s", obj_class.__name__)
+
+    _installed = True
+
+    duration = timer() - start
+    record("registration", ALL_TYPES, 0, duration)
+    geometric_types_registered.send(sender=None, connection=connection,
+                                    duration=duration, instrumented=instrument)
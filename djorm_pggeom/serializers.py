@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+GeoJSON, WKT and WKB serialization of the geometric objects, a
+streaming GeoJSON exporter of querysets and a compact binary format
+(``dumps``/``loads``) for byte oriented caches.
+
+The postgresql types are mapped to the simple features geometries:
+
+=========== ============================================================
+Point       Point
+Lseg        LineString
+Path        LineString (closed paths repeat the first point)
+Polygon     Polygon
+Box         Polygon of its four corners
+Circle      Polygon of ``vertices`` points (32 by default)
+=========== ============================================================
+
+Text is built directly from the coordinates (without intermediate
+dicts); ``to_geojson`` returns the dict when one is needed. JSON has no
+Infinity and NaN, so GeoJSON of values with them raises ValueError.
+"""
+
+import math
+import struct
+import sys
+from array import array
+
+from .cursors import server_side_chunks
+from .objects import Point, Circle, Lseg, Box, Path, Polygon
+from .objects import pack_coords, unpack_coords
+from .registry import ensure_registered
+
+CIRCLE_VERTICES = 32
+
+# WKB geometry types
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+
+# coordinates are written in the machine byte order
+_WKB_BYTE_ORDER = 1 if sys.byteorder == "little" else 0
+_wkb_header = struct.Struct("=BI")
+_wkb_count = struct.Struct("=I")
+
+
+def flat_coords(value, vertices=CIRCLE_VERTICES):
+    """
+    Return ``(geometry type, coords)`` of a geometric object, being
+    coords a flat ``array('d')``; rings and closed paths end with their
+    first point.
+    """
+    if isinstance(value, Point):
+        return "Point", array('d', (value.x, value.y))
+    elif isinstance(value, Lseg):
+        return "LineString", array('d', (value.start_point.x, value.start_point.y,
+                                         value.end_point.x, value.end_point.y))
+    elif isinstance(value, Box):
+        (x1, y1), (x2, y2) = value
+        return "Polygon", array('d', (x1, y1, x2, y1, x2, y2, x1, y2, x1, y1))
+    elif isinstance(value, Circle):
+        x, y, r = value.point.x, value.point.y, value.r
+        coords = array('d')
+        for i in range(vertices):
+            angle = 2 * math.pi * i / vertices
+            coords.extend((x + r * math.cos(angle), y + r * math.sin(angle)))
+        coords.extend(coords[:2])
+        return "Polygon", coords
+    elif isinstance(value, Path):
+        coords = value.coords
+        if value.closed and coords[:2] != coords[-2:]:
+            coords = coords + coords[:2]
+        return "Polygon" if isinstance(value, Polygon) else "LineString", coords
+
+    raise TypeError("%r is not a geometric object" % (value,))
+
+
+def _pairs(coords, template, separator):
+    return separator.join([template % (coords[i], coords[i + 1]) \
+        for i in range(0, len(coords), 2)])
+
+
+def _not_finite(value):
+    return ValueError("GeoJSON coordinates must be finite: %r" % (value,))
+
+
+""" GEOJSON """
+
+def to_geojson(value, vertices=CIRCLE_VERTICES):
+    """
+    Return the GeoJSON geometry of a geometric object as a dict.
+    """
+    kind, coords = flat_coords(value, vertices)
+    if any(math.isinf(x) or math.isnan(x) for x in coords):
+        raise _not_finite(value)
+    points = [[coords[i], coords[i + 1]] for i in range(0, len(coords), 2)]
+
+    if kind == "Point":
+        points = points[0]
+    elif kind == "Polygon":
+        points = [points]
+    return {"type": kind, "coordinates": points}
+
+
+def geojson(value, vertices=CIRCLE_VERTICES):
+    """
+    Return the GeoJSON text of a geometric object (``null`` for None).
+    """
+    if value is None:
+        return "null"
+
+    kind, coords = flat_coords(value, vertices)
+    points = _pairs(coords, "[%r,%r]", ",")
+    # inf and nan are the only float reprs with an "n"
+    if "n" in points:
+        raise _not_finite(value)
+    if kind == "LineString":
+        points = "[%s]" % points
+    elif kind == "Polygon":
+        points = "[[%s]]" % points
+    return '{"type":"%s","coordinates":%s}' % (kind, points)
+
+
+""" WKT """
+
+def wkt(value, vertices=CIRCLE_VERTICES):
+    """
+    Return the WKT of a geometric object.
+    """
+    kind, coords = flat_coords(value, vertices)
+    points = _pairs(coords, "%r %r", ", ")
+    if kind == "Polygon":
+        points = "(%s)" % points
+    return "%s (%s)" % (kind.upper(), points)
+
+
+""" WKB """
+
+def wkb(value, vertices=CIRCLE_VERTICES):
+    """
+    Return the WKB of a geometric object, in the byte order of the
+    machine.
+    """
+    kind, coords = flat_coords(value, vertices)
+    data = coords.tostring() if hasattr(coords, "tostring") else coords.tobytes()
+
+    if kind == "Point":
+        return _wkb_header.pack(_WKB_BYTE_ORDER, WKB_POINT) + data
+    elif kind == "LineString":
+        return _wkb_header.pack(_WKB_BYTE_ORDER, WKB_LINESTRING) + \
+            _wkb_count.pack(len(coords) // 2) + data
+    return _wkb_header.pack(_WKB_BYTE_ORDER, WKB_POLYGON) + \
+        _wkb_count.pack(1) + _wkb_count.pack(len(coords) // 2) + data
+
+
+""" BYTES """
+
+# a value is a one byte tag followed by its little endian doubles, the
+# number of doubles of paths and the length of lists go first
+_packers = {
+    b"P": struct.Struct("<2d"),
+    b"C": struct.Struct("<3d"),
+    b"L": struct.Struct("<4d"),
+    b"B": struct.Struct("<4d"),
+}
+_count = struct.Struct("<I")
+_PATH_TAGS = {b"[": (Path, False), b"(": (Path, True), b"G": (Polygon, True)}
+
+
+def _dump(value, write):
+    if value is None:
+        write(b"N")
+    elif isinstance(value, (list, tuple)):
+        write(b"A" + _count.pack(len(value)))
+        for item in value:
+            _dump(item, write)
+    elif isinstance(value, Point):
+        write(b"P" + _packers[b"P"].pack(value.x, value.y))
+    elif isinstance(value, Circle):
+        write(b"C" + _packers[b"C"].pack(value.point.x, value.point.y, value.r))
+    elif isinstance(value, (Lseg, Box)):
+        (x1, y1), (x2, y2) = value
+        tag = b"L" if isinstance(value, Lseg) else b"B"
+        write(tag + _packers[tag].pack(x1, y1, x2, y2))
+    elif isinstance(value, Path):
+        if isinstance(value, Polygon):
+            tag = b"G"
+        else:
+            tag = b"(" if value.closed else b"["
+        write(tag + _count.pack(len(value.coords)))
+        write(pack_coords(value.coords))
+    else:
+        raise TypeError("%r is not a geometric object" % (value,))
+
+
+def _load(data, offset):
+    tag = data[offset:offset + 1]
+    offset += 1
+
+    if tag == b"N":
+        return None, offset
+    elif tag == b"A":
+        length, = _count.unpack_from(data, offset)
+        offset += _count.size
+        values = []
+        for i in range(length):
+            value, offset = _load(data, offset)
+            values.append(value)
+        return values, offset
+    elif tag in _PATH_TAGS:
+        cls, closed = _PATH_TAGS[tag]
+        length, = _count.unpack_from(data, offset)
+        offset += _count.size
+        end = offset + length * 8
+        coords = unpack_coords(data[offset:end])
+        return cls.from_coords(coords, closed=closed, copy=False), end
+
+    packer = _packers.get(tag)
+    if packer is None:
+        raise ValueError("bad geometric data at %d: %r" % (offset - 1, tag))
+    coords = packer.unpack_from(data, offset)
+    offset += packer.size
+
+    if tag == b"P":
+        return Point(*coords), offset
+    elif tag == b"C":
+        return Circle(coords[:2], coords[2]), offset
+    elif tag == b"L":
+        return Lseg(coords[:2], coords[2:]), offset
+    return Box(coords[:2], coords[2:]), offset
+
+
+def dumps(value):
+    """
+    Return the compact binary form of a geometric object, None or a
+    list (or tuple) of them, for caches storing bytes.
+    """
+    parts = []
+    _dump(value, parts.append)
+    return b"".join(parts)
+
+
+def loads(data):
+    """
+    Return the value of a ``dumps`` result (sequences as lists).
+    """
+    try:
+        value, offset = _load(data, 0)
+    except struct.error:
+        raise ValueError("truncated geometric data")
+    if offset != len(data):
+        raise ValueError("bad geometric data length")
+    return value
+
+
+""" STREAMING EXPORT """
+
+def _queryset_chunks(queryset, fields, chunk_size):
+    """
+    Yield the ``values_list`` rows of ``fields`` of a queryset in lists
+    of at most ``chunk_size``, read with a server side cursor.
+    """
+    from django.db import connections
+
+    connection = connections[queryset.db]
+    ensure_registered(connection)
+
+    query = queryset.values_list(*fields).query
+    sql, params = query.get_compiler(queryset.db).as_sql()
+    return server_side_chunks(connection, sql, params, chunk_size)
+
+
+def stream_wkt(queryset, field, vertices=CIRCLE_VERTICES, chunk_size=2000):
+    """
+    Yield the ``(pk, WKT)`` pairs of the ``field`` geometries of
+    ``queryset`` (None for NULL), reading the rows with a server side
+    cursor like ``stream_geojson``.
+    """
+    for rows in _queryset_chunks(queryset, ("pk", field), chunk_size):
+        for pk, value in rows:
+            yield pk, None if value is None else wkt(value, vertices)
+
+
+def stream_wkb(queryset, field, vertices=CIRCLE_VERTICES, chunk_size=2000):
+    """
+    Yield the ``(pk, WKB)`` pairs of the ``field`` geometries of
+    ``queryset`` (None for NULL), like ``stream_wkt``.
+    """
+    for rows in _queryset_chunks(queryset, ("pk", field), chunk_size):
+        for pk, value in rows:
+            yield pk, None if value is None else wkb(value, vertices)
+
+
+def stream_geojson(queryset, field, properties=(), vertices=CIRCLE_VERTICES,
+                   chunk_size=2000):
+    """
+    Yield the GeoJSON FeatureCollection of the ``field`` geometries of
+    ``queryset`` in pieces, reading the rows with a server side cursor,
+    so neither the rows nor the document are kept in memory. Features
+    have the primary key as ``id`` and the ``properties`` fields::
+
+        return StreamingHttpResponse(stream_geojson(Zone.objects.all(),
+            "area", ["name"]), content_type="application/geo+json")
+    """
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    chunks = _queryset_chunks(queryset, ("pk", field) + tuple(properties), chunk_size)
+
+    yield '{"type":"FeatureCollection","features":['
+    separator = ""
+    for rows in chunks:
+        features = []
+        for row in rows:
+            features.append('%s{"type":"Feature","id":%s,"geometry":%s,"properties":%s}' % (
+                separator, encoder.encode(row[0]), geojson(row[1], vertices),
+                encoder.encode(dict(zip(properties, row[2:])))))
+            separator = ","
+        yield "".join(features)
+    yield "]}"
+
+
+def write_geojson(queryset, field, output, **kwargs):
+    """
+    Write the ``stream_geojson`` FeatureCollection to a file like object.
+    """
+    for piece in stream_geojson(queryset, field, **kwargs):
+        output.write(piece)
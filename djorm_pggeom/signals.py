@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+from django.dispatch import Signal
+
+# sent for every value decoded by an instrumented typecaster, with
+# ``type_name``, ``size`` (bytes of the text) and ``duration`` (seconds)
+geometry_cast = Signal()
+
+# sent for every value encoded by an instrumented adapter, with
+# ``type_name``, ``size`` and ``duration``
+geometry_adapted = Signal()
+
+# sent once the geometric types are registered, with ``connection``,
+# ``duration`` and ``instrumented``
+geometric_types_registered = Signal()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-process R-tree over already fetched geometric values, for answering
+overlap, containment and nearest neighbour queries without scanning
+every cached value.
+
+Entries are indexed by their bounding box and the candidates are
+refined with the exact postgresql predicate for box and circle values
+(including the fuzzy comparisons with ``EPSILON``). Other types (lseg,
+path, polygon) are matched by bounding box only.
+"""
+
+import heapq
+import itertools
+import math
+
+from .columnar import EPSILON
+from .objects import Point, Box, Circle
+from .registry import ensure_registered
+
+
+def _extent(geometry):
+    (x1, y1), (x2, y2) = geometry.bounding_box()
+    return (x1, y1, x2, y2)
+
+def _union(a, b):
+    if a is None:
+        return b
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+def _area(e):
+    return (e[2] - e[0]) * (e[3] - e[1])
+
+def _intersects(a, b):
+    # with the EPSILON margin, so candidates are a superset of fuzzy matches
+    return a[0] - b[2] <= EPSILON and b[0] - a[2] <= EPSILON and \
+        a[1] - b[3] <= EPSILON and b[1] - a[3] <= EPSILON
+
+def _encloses(a, b):
+    return a[0] - b[0] <= EPSILON and a[1] - b[1] <= EPSILON and \
+        b[2] - a[2] <= EPSILON and b[3] - a[3] <= EPSILON
+
+def _min_distance(x, y, e):
+    dx = max(e[0] - x, x - e[2], 0.0)
+    dy = max(e[1] - y, y - e[3], 0.0)
+    return math.hypot(dx, dy)
+
+
+""" EXACT PREDICATES """
+
+def _overlaps(a, b, ea, eb):
+    if isinstance(a, Circle) and isinstance(b, Circle):
+        return math.hypot(a.point.x - b.point.x, a.point.y - b.point.y) - \
+            (a.r + b.r) <= EPSILON
+    return _intersects(ea, eb)
+
+def _contained_on(a, b, ea, eb):
+    """
+    ``a <@ b``
+    """
+    if isinstance(a, Point):
+        if isinstance(b, Box):
+            return eb[0] <= a.x <= eb[2] and eb[1] <= a.y <= eb[3]
+        elif isinstance(b, Circle):
+            return math.hypot(a.x - b.point.x, a.y - b.point.y) <= b.r
+    elif isinstance(a, Circle) and isinstance(b, Circle):
+        return math.hypot(a.point.x - b.point.x, a.point.y - b.point.y) + \
+            a.r - b.r <= EPSILON
+    return _encloses(eb, ea)
+
+def _distance(x, y, geometry, extent):
+    if isinstance(geometry, Circle):
+        return max(math.hypot(x - geometry.point.x, y - geometry.point.y) - geometry.r, 0.0)
+    return _min_distance(x, y, extent)
+
+
+class _Node(object):
+    __slots__ = ('leaf', 'entries', 'extent')
+
+    def __init__(self, leaf, entries):
+        self.leaf = leaf
+        self.entries = entries
+        self.update()
+
+    def update(self):
+        extent = None
+        for child_extent, child in self.entries:
+            extent = _union(extent, child_extent)
+        self.extent = extent
+
+
+class SpatialIndex(object):
+    """
+    R-tree of geometric values identified by a key (usually the primary
+    key of the row). Queries return keys::
+
+        index = SpatialIndex.bulk_load(qs.values_list("pk", "barea"))
+        index.overlaps(Box((0, 0), (10, 10)))
+        index.nearest(Point(1, 1), k=5)
+    """
+
+    def __init__(self, max_entries=16):
+        if max_entries < 4:
+            raise ValueError("max_entries must be at least 4")
+
+        self.max_entries = max_entries
+        self.min_entries = max_entries * 2 // 5
+        self._items = {}
+        self._root = _Node(True, [])
+
+    @classmethod
+    def bulk_load(cls, items, max_entries=16):
+        """
+        Build a packed tree from ``(key, geometry)`` pairs using
+        sort-tile-recursive (STR) packing. None geometries are skipped.
+        """
+        index = cls(max_entries=max_entries)
+        entries = []
+        for key, geometry in items:
+            if geometry is None:
+                continue
+            extent = _extent(geometry)
+            index._items[key] = (geometry, extent)
+            entries.append((extent, key))
+
+        leaf = True
+        while len(entries) > max_entries:
+            entries = [(node.extent, node) for node in index._pack(entries, leaf)]
+            leaf = False
+        index._root = _Node(leaf, entries)
+        return index
+
+    @classmethod
+    def from_queryset(cls, queryset, field, max_entries=16):
+        from django.db import connections
+        ensure_registered(connections[queryset.db])
+
+        return cls.bulk_load(queryset.values_list("pk", field), max_entries)
+
+    def _pack(self, entries, leaf):
+        size = self.max_entries
+        pages = int(math.ceil(len(entries) / float(size)))
+        slab = size * int(math.ceil(math.sqrt(pages)))
+
+        entries.sort(key=lambda e: e[0][0] + e[0][2])
+        nodes = []
+        for i in range(0, len(entries), slab):
+            column = sorted(entries[i:i + slab], key=lambda e: e[0][1] + e[0][3])
+            for j in range(0, len(column), size):
+                nodes.append(_Node(leaf, column[j:j + size]))
+        return nodes
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        return default if item is None else item[0]
+
+    # incremental updates
+
+    def insert(self, key, geometry):
+        """
+        Add ``geometry`` under ``key``, replacing the previous value.
+        """
+        if key in self._items:
+            self.delete(key)
+
+        extent = _extent(geometry)
+        self._items[key] = (geometry, extent)
+        self._insert_entry(extent, key)
+
+    def _insert_entry(self, extent, key):
+        split = self._insert(self._root, extent, key)
+        if split is not None:
+            old = self._root
+            self._root = _Node(False, [(old.extent, old), (split.extent, split)])
+
+    def _insert(self, node, extent, key):
+        if node.leaf:
+            node.entries.append((extent, key))
+        else:
+            def _cost(i):
+                child_extent = node.entries[i][0]
+                area = _area(child_extent)
+                return (_area(_union(child_extent, extent)) - area, area)
+
+            index = min(range(len(node.entries)), key=_cost)
+            child = node.entries[index][1]
+            split = self._insert(child, extent, key)
+            node.entries[index] = (child.extent, child)
+            if split is not None:
+                node.entries.append((split.extent, split))
+
+        if len(node.entries) > self.max_entries:
+            return self._split(node)
+        node.extent = _union(node.extent, extent)
+        return None
+
+    def _split(self, node):
+        """
+        Quadratic split: keep one group in ``node`` and return a new
+        node with the other one.
+        """
+        entries = node.entries
+
+        def _waste(pair):
+            a, b = entries[pair[0]][0], entries[pair[1]][0]
+            return _area(_union(a, b)) - _area(a) - _area(b)
+
+        first, second = max(itertools.combinations(range(len(entries)), 2), key=_waste)
+        groups = ([entries[first]], [entries[second]])
+        extents = [entries[first][0], entries[second][0]]
+        rest = [e for i, e in enumerate(entries) if i not in (first, second)]
+
+        while rest:
+            for i in (0, 1):
+                if len(groups[i]) + len(rest) <= self.min_entries:
+                    groups[i].extend(rest)
+                    rest = []
+            if not rest:
+                break
+
+            def _preference(entry):
+                return abs((_area(_union(extents[0], entry[0])) - _area(extents[0])) -
+                           (_area(_union(extents[1], entry[0])) - _area(extents[1])))
+
+            entry = max(rest, key=_preference)
+            rest.remove(entry)
+            growth = [_area(_union(extents[i], entry[0])) - _area(extents[i]) for i in (0, 1)]
+            i = 0 if (growth[0], len(groups[0])) <= (growth[1], len(groups[1])) else 1
+            groups[i].append(entry)
+            extents[i] = _union(extents[i], entry[0])
+
+        node.entries = groups[0]
+        node.update()
+        return _Node(node.leaf, groups[1])
+
+    def delete(self, key):
+        """
+        Remove ``key`` from the index. Raises KeyError if not found.
+        """
+        geometry, extent = self._items.pop(key)
+        orphans = []
+        self._delete(self._root, extent, key, orphans)
+
+        root = self._root
+        while not root.leaf and len(root.entries) == 1:
+            root = root.entries[0][1]
+        if not root.entries:
+            root = _Node(True, [])
+        self._root = root
+
+        for orphan in orphans:
+            self._insert_entry(self._items[orphan][1], orphan)
+
+    def _delete(self, node, extent, key, orphans):
+        if node.leaf:
+            for i, (child_extent, child) in enumerate(node.entries):
+                if child == key:
+                    del node.entries[i]
+                    node.update()
+                    return True
+            return False
+
+        for i, (child_extent, child) in enumerate(node.entries):
+            if _encloses(child_extent, extent) and self._delete(child, extent, key, orphans):
+                if len(child.entries) < self.min_entries:
+                    # condense the tree: reinsert the entries of underfull nodes
+                    del node.entries[i]
+                    orphans.extend(self._keys(child))
+                else:
+                    node.entries[i] = (child.extent, child)
+                node.update()
+                return True
+        return False
+
+    def _keys(self, node):
+        if node.leaf:
+            return [key for extent, key in node.entries]
+        return [key for extent, child in node.entries for key in self._keys(child)]
+
+    # queries
+
+    def _search(self, extent, predicate):
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for child_extent, child in node.entries:
+                if predicate(child_extent, extent):
+                    if node.leaf:
+                        yield child
+                    else:
+                        stack.append(child)
+
+    def overlaps(self, geometry):
+        """
+        Keys of the values that overlap ``geometry`` (``&&``).
+        """
+        extent = _extent(geometry)
+        items = self._items
+        return [key for key in self._search(extent, _intersects)
+                if _overlaps(items[key][0], geometry, items[key][1], extent)]
+
+    def contained_on(self, geometry):
+        """
+        Keys of the values contained on ``geometry`` (``<@``).
+        """
+        extent = _extent(geometry)
+        items = self._items
+        return [key for key in self._search(extent, _intersects)
+                if _contained_on(items[key][0], geometry, items[key][1], extent)]
+
+    def contains(self, geometry):
+        """
+        Keys of the values that contain ``geometry`` (``@>``).
+        """
+        extent = _extent(geometry)
+        items = self._items
+        return [key for key in self._search(extent, _encloses)
+                if _contained_on(geometry, items[key][0], extent, items[key][1])]
+
+    def nearest(self, point, k=1, with_distance=False):
+        """
+        Keys of the ``k`` values nearest to ``point``, closest first
+        (``<->``, best-first search). Non circle values are measured to
+        their bounding box. With ``with_distance`` returns
+        ``(key, distance)`` pairs.
+        """
+        x, y = point.x, point.y
+        counter = itertools.count()
+        heap = [(0.0, next(counter), False, self._root)]
+        result = []
+
+        while heap and len(result) < k:
+            distance, _, is_key, item = heapq.heappop(heap)
+            if is_key:
+                result.append((item, distance) if with_distance else item)
+            elif item.leaf:
+                for extent, key in item.entries:
+                    heapq.heappush(heap, (_distance(x, y, self._items[key][0], extent),
+                                          next(counter), True, key))
+            else:
+                for extent, child in item.entries:
+                    heapq.heappush(heap, (_min_distance(x, y, extent),
+                                          next(counter), False, child))
+        return result
@@ -16,7 +16,9 @@ setup(
     maintainer = 'Andrey Antukh',
     maintainer_email = 'niwi@niwi.be',
     install_requires = [
-        'djorm-ext-core >= 0.4',
+        'Django >= 1.5',
+        'psycopg2 >= 2.4',
+        'djorm-ext-expressions >= 0.4',
     ],
     packages = ['djorm_pggeom'],
     classifiers = [
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput of the binary codecs (``djorm_pggeom.binary``) against the
+text ones (``objects.CAST_MAPPER`` and ``adapt.TEXT_MAPPER``).
+
+Usage: python binary.py [repeat]
+"""
+
+import os, sys, timeit
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TESTING, os.path.join(TESTING, '..')]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from djorm_pggeom.adapt import TEXT_MAPPER
+from djorm_pggeom.binary import RECV_MAPPER, SEND_MAPPER
+from djorm_pggeom.objects import CAST_MAPPER, Point, Circle, Box, Polygon
+
+
+def polygon(vertices):
+    return Polygon.from_coords([(i % 2 and -1.25 or 0.5) * i for i in range(vertices * 2)])
+
+
+SAMPLES = [
+    ('point', Point(1.5, -2.25)),
+    ('circle', Circle([1.5, -2.25], 3.75)),
+    ('box', Box([0.5, 0.5], [5.5, 5.5])),
+    ('polygon-10', polygon(10)),
+    ('polygon-10000', polygon(10000)),
+]
+
+
+def measure(func, value, number):
+    timer = timeit.Timer(lambda: func(value))
+    return min(timer.repeat(3, number)) / number
+
+
+def main(repeat=None):
+    print("%-16s %-7s %12s %12s %8s" % ("type", "", "text (us)", "binary (us)", "speedup"))
+    for name, value in SAMPLES:
+        type_name = value.__class__.__name__
+        text = TEXT_MAPPER[type_name](value)
+        data = SEND_MAPPER[type_name](value)
+        number = repeat or max(1, 100000 // len(text))
+
+        cases = [
+            ("encode", TEXT_MAPPER[type_name], SEND_MAPPER[type_name], value, value),
+            ("decode", lambda v: CAST_MAPPER[type_name](v, None), RECV_MAPPER[type_name],
+             text, data),
+        ]
+        for operation, text_codec, binary_codec, text_value, binary_value in cases:
+            text_time = measure(text_codec, text_value, number)
+            binary_time = measure(binary_codec, binary_value, number)
+            print("%-16s %-7s %12.2f %12.2f %7.1fx" % (name, operation,
+                text_time * 1e6, binary_time * 1e6, text_time / binary_time))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
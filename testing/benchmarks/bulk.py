@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""
+Load time of ``bulk_create`` against ``djorm_pggeom.bulk.copy_insert``
+(text and binary format).
+
+Requires the database configured in testing/settings.py; a temporary
+test database is created and destroyed.
+
+Usage: python bulk.py [rows]
+"""
+
+import os, sys, time
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TESTING, os.path.join(TESTING, '..')]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from django.db import connection, transaction
+
+
+def measure(func, model):
+    """
+    Time one call of ``func`` on the empty table of ``model``.
+    """
+    cursor = connection.cursor()
+    cursor.execute("TRUNCATE %s" % connection.ops.quote_name(model._meta.db_table))
+    transaction.commit_unless_managed()
+
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main(rows=100000):
+    from djorm_pggeom.bulk import copy_insert
+    from djorm_pggeom.objects import Point, Box
+    from pg_geometric.models import SomeObject, BoxObjectModel
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        cases = [
+            (SomeObject, lambda i: SomeObject(pos=Point(i * 0.5, -i))),
+            (BoxObjectModel, lambda i: BoxObjectModel(
+                barea=Box([i, i], [i + 1.5, i + 2.5]))),
+        ]
+
+        print("%-16s %8s %14s %14s %14s %8s" % ("model", "rows",
+            "bulk_create (s)", "copy (s)", "binary (s)", "speedup"))
+        for model, factory in cases:
+            objs = [factory(i) for i in range(rows)]
+
+            bulk_time = measure(lambda: model.objects.bulk_create(objs), model)
+            copy_time = measure(lambda: copy_insert(model, objs), model)
+            binary_time = measure(lambda: copy_insert(model, objs, binary=True), model)
+
+            print("%-16s %8d %14.3f %14.3f %14.3f %7.1fx" % (model.__name__,
+                rows, bulk_time, copy_time, binary_time, bulk_time / binary_time))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
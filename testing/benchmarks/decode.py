@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput comparison between the single pass decoders and the
+regular expression based casting used up to 0.4.1.
+
+Usage: python decode.py [repeat]
+"""
+
+import os, sys, re, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from djorm_pggeom import decoder
+
+rx_circle_float = re.compile(r'<\(([\d\.\-]*),([\d\.\-]*)\),([\d\.\-]*)>')
+rx_point = re.compile(r'\(([\d\.\-]*),\s*([\d\.\-]*)\)')
+rx_box = re.compile(r'\(([\d\.\-]*),\s*([\d\.\-]*)\),\s*\(([\d\.\-]*),\s*([\d\.\-]*)\)')
+rx_path_identify = re.compile(r'^((?:\(|\[))(.*)(?:\)|\])$')
+
+
+def regex_point(value):
+    return [int(x) if "." not in x else float(x) \
+        for x in rx_point.search(value).groups()]
+
+def regex_circle(value):
+    return [int(x) if "." not in x else float(x) \
+        for x in rx_circle_float.search(value).groups()]
+
+def regex_box(value):
+    return [int(x) if "." not in x else float(x) \
+        for x in rx_box.search(value).groups()]
+
+def regex_path(value):
+    ident = rx_path_identify.search(value)
+    return [(
+        int(x) if "." not in x else float(x), \
+        int(y) if "." not in y else float(y) \
+    ) for x, y in rx_point.findall(ident.group(2))]
+
+
+def polygon_text(vertices):
+    return "(%s)" % ",".join("(%r,%r)" % (i * 0.5, i * -1.25) \
+        for i in range(vertices))
+
+
+SAMPLES = [
+    ('point', '(1.5,-2.25)', regex_point, decoder.decode_point),
+    ('circle', '<(1.5,-2.25),3.75>', regex_circle, decoder.decode_circle),
+    ('box', '(5.5,5.5),(0.5,0.5)', regex_box, decoder.decode_box),
+    ('polygon-10', polygon_text(10), regex_path, decoder.decode_polygon),
+    ('polygon-10000', polygon_text(10000), regex_path, decoder.decode_polygon),
+]
+
+
+def measure(func, value, number):
+    timer = timeit.Timer(lambda: func(value))
+    return min(timer.repeat(3, number)) / number
+
+
+def main(repeat=None):
+    print("%-16s %14s %14s %8s" % ("type", "regex (us)", "decoder (us)", "speedup"))
+    for name, value, old, new in SAMPLES:
+        number = repeat or max(1, 200000 // len(value))
+        old_time = measure(old, value, number)
+        new_time = measure(new, value, number)
+        print("%-16s %14.2f %14.2f %7.1fx" % (
+            name, old_time * 1e6, new_time * 1e6, old_time / new_time))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Decoding time of chunks of polygon text values in this process against
+a process pool (``djorm_pggeom.parallel``), including the transfer of
+the text to the workers and of the decoded buffers back.
+
+Usage: python parallel.py [processes] [rows] [vertices]
+"""
+
+import os, sys, time, multiprocessing
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TESTING, os.path.join(TESTING, '..')]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from djorm_pggeom import parallel
+from djorm_pggeom.objects import CAST_MAPPER
+
+
+def polygon_text(vertices, seed):
+    return "(%s)" % ",".join("(%r,%r)" % (i * 0.5 + seed, i * -1.25) \
+        for i in range(vertices))
+
+
+def chunks(rows, vertices, chunk_size=2000):
+    values = [polygon_text(vertices, i) for i in range(rows)]
+    return [values[i:i + chunk_size] for i in range(0, rows, chunk_size)]
+
+
+def sequential(data):
+    cast = CAST_MAPPER['Polygon']
+    return sum(len([cast(value, None) for value in chunk]) for chunk in data)
+
+
+def pooled(data, pool):
+    return sum(len(parallel.build_chunk('Polygon', *buffers)) \
+        for buffers in parallel.parallel_decode(pool, 'Polygon', data))
+
+
+def main(processes=None, rows=200000, vertices=20):
+    processes = processes or multiprocessing.cpu_count()
+    data = chunks(rows, vertices)
+
+    start = time.time()
+    sequential(data)
+    elapsed = time.time() - start
+    print("%-24s %8.2f s" % ("sequential", elapsed))
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        start = time.time()
+        pooled(data, pool)
+        pooled_elapsed = time.time() - start
+    finally:
+        pool.terminate()
+    print("%-24s %8.2f s %7.1fx" % ("pool (%d processes)" % processes,
+        pooled_elapsed, elapsed / pooled_elapsed))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""
+Query latency of ``djorm_pggeom.spatialindex.SpatialIndex`` against a
+linear scan over the same cached boxes and circles.
+
+Usage: python spatialindex.py [values] [queries]
+"""
+
+import os, sys, time, random
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TESTING, os.path.join(TESTING, '..')]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+from djorm_pggeom.objects import Point, Box, Circle
+from djorm_pggeom.spatialindex import SpatialIndex, _extent, _overlaps, _distance
+
+
+def random_values(count, rnd):
+    values = {}
+    for i in range(count):
+        x, y = rnd.uniform(0, 10000), rnd.uniform(0, 10000)
+        if i % 2:
+            values[i] = Box([x, y], [x + rnd.uniform(0, 20), y + rnd.uniform(0, 20)])
+        else:
+            values[i] = Circle([x, y], rnd.uniform(0, 10))
+    return values
+
+
+def linear_overlaps(values, viewport):
+    extent = _extent(viewport)
+    return [key for key, (value, value_extent) in values.items()
+            if _overlaps(value, viewport, value_extent, extent)]
+
+def linear_nearest(values, point, k):
+    return sorted(values, key=lambda key: _distance(
+        point.x, point.y, values[key][0], values[key][1]))[:k]
+
+
+def measure(func, queries):
+    start = time.time()
+    for query in queries:
+        func(query)
+    return (time.time() - start) / len(queries)
+
+
+def main(count=200000, queries=20):
+    rnd = random.Random(0)
+    values = random_values(count, rnd)
+
+    start = time.time()
+    index = SpatialIndex.bulk_load(values.items())
+    print("bulk load of %d values: %.2f s" % (count, time.time() - start))
+
+    # the linear scan gets precomputed bounding boxes too
+    scan = dict((key, (value, _extent(value))) for key, value in values.items())
+
+    viewports = []
+    for i in range(queries):
+        x, y = rnd.uniform(0, 9500), rnd.uniform(0, 9500)
+        viewports.append(Box([x, y], [x + 500, y + 500]))
+    points = [Point(rnd.uniform(0, 10000), rnd.uniform(0, 10000)) for i in range(queries)]
+
+    cases = [
+        ("overlaps", viewports,
+         lambda q: linear_overlaps(scan, q), index.overlaps),
+        ("nearest k=10", points,
+         lambda q: linear_nearest(scan, q, 10), lambda q: index.nearest(q, k=10)),
+    ]
+
+    print("%-14s %14s %14s %8s" % ("query", "linear (ms)", "rtree (ms)", "speedup"))
+    for name, args, linear, indexed in cases:
+        linear_time = measure(linear, args)
+        index_time = measure(indexed, args)
+        print("%-14s %14.2f %14.3f %7.0fx" % (
+            name, linear_time * 1e3, index_time * 1e3, linear_time / index_time))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
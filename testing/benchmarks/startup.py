@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+Startup cost of the package, every measure taken in a new interpreter:
+
+* import time of the geometry types (``djorm_pggeom.objects``) and of
+  the django integration (``djorm_pggeom.models``, after ``django.db``
+  as when the apps are loaded), and the top level packages each one
+  loads;
+* time and queries of the first database connection and of the first
+  geometric query (the registration of the types).
+
+The connection measures require the database configured in
+testing/settings.py.
+
+Usage: python startup.py [repeat] [--no-db]
+"""
+
+import os, sys, json, subprocess
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PYTHONPATH = os.pathsep.join([TESTING, os.path.join(TESTING, '..')] + sys.path)
+
+IMPORT_SCRIPT = """
+import sys, json
+from timeit import default_timer as timer
+%(setup)s
+start = timer()
+import %(module)s
+elapsed = timer() - start
+print(json.dumps({"seconds": elapsed, "packages": sorted(set(
+    m.split(".")[0] for m in sys.modules if m.startswith(("django", "djorm", "psycopg"))))}))
+"""
+
+CONNECTION_SCRIPT = """
+import json
+from timeit import default_timer as timer
+from django.db import connection
+from pg_geometric.models import SomeObject
+
+connection.use_debug_cursor = True
+start = timer()
+connection.cursor().close()
+connect = timer() - start
+connect_queries = len(connection.queries)
+
+start = timer()
+SomeObject.objects.all()
+register = timer() - start
+print(json.dumps({"connect": connect, "connect_queries": connect_queries,
+                  "register": register, "queries": len(connection.queries)}))
+"""
+
+
+def run(script, settings=True):
+    env = dict(os.environ, PYTHONPATH=PYTHONPATH)
+    if settings:
+        env["DJANGO_SETTINGS_MODULE"] = "settings"
+    else:
+        env.pop("DJANGO_SETTINGS_MODULE", None)
+
+    output = subprocess.check_output([sys.executable, "-c", script], env=env, cwd=TESTING)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main(repeat=5, database=True):
+    print("%-24s %10s  %s" % ("import", "ms", "packages"))
+    for module, setup, settings in (("djorm_pggeom.objects", "", False),
+                                    ("djorm_pggeom.models", "import django.db", True)):
+        script = IMPORT_SCRIPT % {"module": module, "setup": setup}
+        results = [run(script, settings) for i in range(repeat)]
+        print("%-24s %10.2f  %s" % (module, min(r["seconds"] for r in results) * 1000,
+                                     ", ".join(results[0]["packages"])))
+
+    if not database:
+        return
+
+    results = [run(CONNECTION_SCRIPT) for i in range(repeat)]
+    print("\n%-24s %10s  %s" % ("first use", "ms", "queries"))
+    print("%-24s %10.2f  %d" % ("connection", min(r["connect"] for r in results) * 1000,
+                                results[0]["connect_queries"]))
+    print("%-24s %10.2f  %d" % ("geometric queryset", min(r["register"] for r in results) * 1000,
+                                results[0]["queries"] - results[0]["connect_queries"]))
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--no-db"]
+    main(*[int(x) for x in args], database="--no-db" not in sys.argv)
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite of the cast, adapt, object construction and query
+paths, with machine readable (JSON) output for comparing versions.
+
+The query benchmarks require the database configured in
+testing/settings.py; a temporary test database is created and
+destroyed (skip them with --no-db).
+
+Usage:
+    python suite.py [--filter cast] [--no-db] [--json results.json]
+    python suite.py --compare baseline.json [--threshold 1.2]
+
+With --compare, the exit status is 1 if any benchmark is slower than
+``threshold`` times its baseline.
+"""
+
+import os, sys, json, time, timeit, platform, subprocess, argparse
+
+TESTING = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [TESTING, os.path.join(TESTING, '..')]
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+import django
+from django.db import connection, transaction
+
+from djorm_pggeom.adapt import ADAPT_MAPPER, TEXT_MAPPER
+from djorm_pggeom.objects import CAST_MAPPER, Point, Circle, Lseg, Box, Path, Polygon
+
+# (group.name, setup function, requires database)
+BENCHMARKS = []
+
+
+def benchmark(group, database=False):
+    """
+    Register a benchmark. The decorated function does the setup and
+    returns the callable to measure, or a ``(callable, reset)`` pair
+    for the benchmarks writing rows: ``reset`` restores the initial
+    state before every call, and is not measured.
+    """
+    def _decorator(func):
+        BENCHMARKS.append(("%s.%s" % (group, func.__name__), func, database))
+        return func
+    return _decorator
+
+
+def polygon(vertices):
+    return Polygon.from_coords([i * 0.5 if i % 2 else i * -1.25 \
+        for i in range(vertices * 2)])
+
+
+SAMPLES = {
+    'point': Point(1.5, -2.25),
+    'circle': Circle([1.5, -2.25], 3.75),
+    'lseg': Lseg([0.5, 1.5], [-3.25, 7]),
+    'box': Box([0.5, 0.5], [5.5, 5.5]),
+    'path_10': Path.from_coords(polygon(10).coords, closed=False),
+    'polygon_10': polygon(10),
+    'polygon_10k': polygon(10000),
+}
+
+
+""" CAST AND ADAPT """
+
+def _register_codec_benchmarks():
+    for sample, value in sorted(SAMPLES.items()):
+        type_name = value.__class__.__name__
+        text = TEXT_MAPPER[type_name](value)
+
+        def cast(cast=CAST_MAPPER[type_name], text=text):
+            return lambda: cast(text, None)
+        cast.__name__ = sample
+        benchmark("cast")(cast)
+
+        def adapt(adapt=ADAPT_MAPPER[type_name], value=value):
+            return lambda: adapt(value).getquoted()
+        adapt.__name__ = sample
+        benchmark("adapt")(adapt)
+
+_register_codec_benchmarks()
+
+
+""" OBJECT CONSTRUCTION """
+
+@benchmark("objects")
+def point():
+    return lambda: Point(1.5, -2.25)
+
+@benchmark("objects")
+def circle():
+    return lambda: Circle([1.5, -2.25], 3.75)
+
+@benchmark("objects")
+def box():
+    return lambda: Box([0.5, 0.5], [5.5, 5.5])
+
+@benchmark("objects")
+def polygon_10k_points():
+    points = list(polygon(10000))
+    return lambda: Polygon(*points)
+
+@benchmark("objects")
+def polygon_10k_coords():
+    coords = list(polygon(10000).coords)
+    return lambda: Polygon.from_coords(coords)
+
+@benchmark("objects")
+def polygon_10k_iterate():
+    value = polygon(10000)
+    return lambda: list(value)
+
+
+""" PICKLING """
+
+@benchmark("pickle")
+def dumps_polygon_10k():
+    import pickle
+    value = SAMPLES['polygon_10k']
+    return lambda: pickle.dumps(value, 2)
+
+@benchmark("pickle")
+def loads_polygon_10k():
+    import pickle
+    data = pickle.dumps(SAMPLES['polygon_10k'], 2)
+    return lambda: pickle.loads(data)
+
+@benchmark("pickle")
+def loads_polygon_10k_points():
+    # the object per point pickling of the point list based objects
+    import pickle
+    data = pickle.dumps(list(SAMPLES['polygon_10k']), 2)
+    return lambda: pickle.loads(data)
+
+@benchmark("pickle")
+def serializers_loads_polygon_10k():
+    from djorm_pggeom.serializers import dumps, loads
+    data = dumps(SAMPLES['polygon_10k'])
+    return lambda: loads(data)
+
+
+""" QUERIES """
+
+def truncate(model):
+    """
+    Return a function emptying the table of ``model``.
+    """
+    def _truncate():
+        cursor = connection.cursor()
+        cursor.execute("TRUNCATE %s" % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+    return _truncate
+
+@benchmark("query", database=True)
+def bulk_create_1k_points():
+    from pg_geometric.models import SomeObject
+    objs = [SomeObject(pos=Point(i, -i)) for i in range(1000)]
+    return lambda: SomeObject.objects.bulk_create(objs), truncate(SomeObject)
+
+@benchmark("query", database=True)
+def bulk_create_polygon_10k():
+    from pg_geometric.models import PolygonObjectModel
+    objs = [PolygonObjectModel(parea=polygon(10000))]
+    return lambda: PolygonObjectModel.objects.bulk_create(objs), truncate(PolygonObjectModel)
+
+@benchmark("query", database=True)
+def fetch_10k_circles():
+    from djorm_pggeom.bulk import copy_insert
+    from pg_geometric.models import CircleObjectModel
+    copy_insert(CircleObjectModel, [(Circle([i, -i], 1),) for i in range(10000)])
+    return lambda: list(CircleObjectModel.objects.values_list('carea', flat=True))
+
+@benchmark("query", database=True)
+def fetch_polygon_10k():
+    from pg_geometric.models import PathObjectModel
+    PathObjectModel.objects.create(parea=polygon(10000))
+    return lambda: list(PathObjectModel.objects.values_list('parea', flat=True))
+
+@benchmark("query", database=True)
+def geoexpression_contained_on():
+    from djorm_pggeom.bulk import copy_insert
+    from djorm_pggeom.expressions import GeoExpression
+    from pg_geometric.models import BoxObjectModel
+
+    copy_insert(BoxObjectModel, [(Box([i % 100, i // 100], [i % 100 + 1, i // 100 + 1]), None) \
+        for i in range(10000)])
+    viewport = Box([10, 10], [30, 30])
+    return lambda: list(BoxObjectModel.objects.where(
+        GeoExpression("barea").contained_on(viewport)).values_list('pk', 'barea'))
+
+
+""" RUNNER """
+
+def timed(func, reset, number):
+    """
+    Return the time of ``number`` calls of ``func``, each one after a
+    call of ``reset``, which is not measured.
+    """
+    elapsed = 0.0
+    for i in range(number):
+        reset()
+        start = timeit.default_timer()
+        func()
+        elapsed += timeit.default_timer() - start
+    return elapsed
+
+
+def measure(func, repeat=5, min_time=0.2, reset=None):
+    """
+    Return the best time per call of ``repeat`` rounds, each one of at
+    least ``min_time`` seconds.
+    """
+    if reset is None:
+        rounds = timeit.Timer(func).timeit
+    else:
+        rounds = lambda number: timed(func, reset, number)
+
+    number = 1
+    while True:
+        elapsed = rounds(number)
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    times = [rounds(number) for i in range(repeat - 1)] + [elapsed]
+    return min(times) / number, number
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+            cwd=TESTING, stderr=open(os.devnull, "w")).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(pattern=None, database=True, repeat=5):
+    selected = [b for b in BENCHMARKS if (pattern is None or pattern in b[0]) \
+        and (database or not b[2])]
+
+    results = []
+    old_name = connection.settings_dict['NAME']
+    if any(b[2] for b in selected):
+        connection.creation.create_test_db(verbosity=0)
+
+    try:
+        for name, setup, requires_db in selected:
+            func = setup()
+            func, reset = func if isinstance(func, tuple) else (func, None)
+            seconds, number = measure(func, repeat, reset=reset)
+            results.append({"name": name, "seconds": seconds,
+                            "number": number, "repeat": repeat})
+            print("%-40s %14.3f us" % (name, seconds * 1e6))
+    finally:
+        if any(b[2] for b in selected):
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    return {
+        "revision": revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Print the ratio of every result against a previous report and
+    return the names of the regressions.
+    """
+    previous = dict((r["name"], r["seconds"]) for r in baseline["results"])
+    regressions = []
+
+    print("\n%-40s %10s  (baseline %s)" % ("benchmark", "ratio", baseline.get("revision")))
+    for result in report["results"]:
+        if result["name"] not in previous:
+            continue
+        ratio = result["seconds"] / previous[result["name"]]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(result["name"])
+            flag = "  REGRESSION"
+        print("%-40s %9.2fx%s" % (result["name"], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--filter", help="only run benchmarks containing this text")
+    parser.add_argument("--no-db", action="store_true", help="skip query benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline results file")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown ratio reported as regression")
+    args = parser.parse_args(argv)
+
+    report = run(args.filter, not args.no_db, args.repeat)
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(report, json.load(baseline), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
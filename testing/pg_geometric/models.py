@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 
 from django.db import models
-from djorm_expressions.models import ExpressionManager as Manager
+from djorm_pggeom.managers import GeoManager as Manager
 from djorm_pggeom.fields import GeometricField
-from djorm_pggeom.objects import Point, Circle, Box
+from djorm_pggeom.objects import Point, Circle, Box, Path, Polygon
 
 
 class SomeObject(models.Model):
-    pos = GeometricField(dbtype=Point)
+    pos = GeometricField(dbtype=Point, spatial_index=True)
     objects = Manager()
 
 
@@ -17,8 +17,24 @@ class CircleObjectModel(models.Model):
 
 
 class BoxObjectModel(models.Model):
-    barea = GeometricField(dbtype=Box)
+    barea = GeometricField(dbtype=Box, spatial_index=True, index_method='spgist')
     other = models.ForeignKey("CircleObjectModel", related_name="boxes",
         null=True, default=None)
 
     objects = Manager()
+
+
+class PathObjectModel(models.Model):
+    parea = GeometricField(dbtype=Path)
+    objects = Manager()
+
+
+class PolygonObjectModel(models.Model):
+    parea = GeometricField(dbtype='Polygon', spatial_index=True)
+    objects = Manager()
+
+
+class ShapeObjectModel(models.Model):
+    path = GeometricField(dbtype=Path, bbox_field=True)
+    polygon = GeometricField(dbtype=Polygon, bbox_field='polygon_extent')
+    objects = Manager()
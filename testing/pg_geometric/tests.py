@@ -1,12 +1,51 @@
 # -*- coding: utf-8 -*-
 
-from django.test import TestCase
+import os
+import sys
+import json
+import math
+import pickle
+import random
+import struct
+import multiprocessing
+import subprocess
+from array import array
+from multiprocessing.pool import ThreadPool
+from unittest import skipIf
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models.query import QuerySet
+from django.db import models
+from django.db.models import Q, F
+from django.test import TestCase, SimpleTestCase
+
+from psycopg2.extensions import new_type, register_type
 
 from djorm_expressions.base import SqlExpression, RawExpression, SqlFunction, AND, OR
 from djorm_pggeom.expressions import GeoExpression
-from djorm_pggeom.objects import Point, Circle, Box
+from djorm_pggeom.fields import GeometricField
+from djorm_pggeom.columnar import GeometryArray, np
+from djorm_pggeom.spatialindex import SpatialIndex
+from djorm_pggeom.objects import Point, Circle, Box, Lseg, Path, Polygon
+from djorm_pggeom.objects import CAST_MAPPER
+from djorm_pggeom import decoder
+from djorm_pggeom.lazy import LazyGeometry
+from djorm_pggeom import registry
+from djorm_pggeom.bulk import copy_insert, copy_values_list, CopyReader, get_binary_codec
+from djorm_pggeom import binary
+from djorm_pggeom import drivers
+from djorm_pggeom import instrumentation, signals
+from djorm_pggeom import parallel, serializers
+from djorm_pggeom.adapt import ADAPT_MAPPER, TEXT_MAPPER, GeometricArray, text_polygon
 
 from .models import SomeObject, CircleObjectModel, BoxObjectModel
+from .models import PathObjectModel, PolygonObjectModel, ShapeObjectModel
 
 class GeometricSearches(TestCase):
     def setUp(self):
@@ -54,6 +93,26 @@ class GeometricSearches(TestCase):
         )
         self.assertEqual(qs.count(), 2)
 
+    def test_not_intersects_with(self):
+        BoxObjectModel.objects.bulk_create([
+            BoxObjectModel(barea=Box([1,1],[3,2])),
+            BoxObjectModel(barea=Box([10,10],[20,20])),
+        ])
+
+        qs = BoxObjectModel.objects.where(
+            GeoExpression("barea").not_intersects_with(Box([2,0],[5,3]))
+        )
+        self.assertEqual([x.barea for x in qs], [Box([10,10],[20,20])])
+
+    def test_typed_parameters(self):
+        qs = BoxObjectModel.objects.where(
+            GeoExpression("barea").overlaps(Box([2,0],[5,3]))
+        )
+
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"barea" && %s::box', sql)
+        self.assertIn('(2.0,0.0),(5.0,3.0)', params)
+
     def test_join_overlap_circle(self):
         c_instance_0 = CircleObjectModel.objects.create(carea=Circle([1,1],5))
         c_instance_1 = CircleObjectModel.objects.create(carea=Circle([-2, -2], 1))
@@ -183,3 +242,1369 @@ class BoxTest(TestCase):
 
     def test_custom_instance(self):
         self.assertEqual(Box([1,1],[1,1]), Box([1,1],[1,1]))
+
+
+class DecoderTests(SimpleTestCase):
+    def test_point(self):
+        self.assertEqual(decoder.decode_point("(1,-2.5)"), [1.0, -2.5])
+        self.assertEqual(decoder.decode_point(u"(1,-2.5)"), [1.0, -2.5])
+
+    def test_exponent_and_special_values(self):
+        x, y = decoder.decode_point("(1e+20,-Infinity)")
+        self.assertEqual(x, 1e20)
+        self.assertEqual(y, float("-inf"))
+
+        x, y = decoder.decode_point("(NaN,2.5e-07)")
+        self.assertNotEqual(x, x)
+        self.assertEqual(y, 2.5e-07)
+
+    def test_path(self):
+        self.assertEqual(decoder.decode_path("[(1,2),(3,4)]"),
+                         (False, [1.0, 2.0, 3.0, 4.0]))
+        self.assertEqual(decoder.decode_path("((1,2),(3,4))"),
+                         (True, [1.0, 2.0, 3.0, 4.0]))
+
+    def test_bad_representation(self):
+        for value in ["(1,2,3)", "", "(a,b)", None]:
+            with self.assertRaises(ValueError):
+                decoder.decode_point(value)
+
+        with self.assertRaises(ValueError):
+            decoder.decode_path("((1,2),(3))")
+
+    def test_bad_brackets(self):
+        for decode, value in [(decoder.decode_point, "1,2"),
+                              (decoder.decode_point, "((1,2"),
+                              (decoder.decode_point, u"[1,2]"),
+                              (decoder.decode_circle, "<(1,2),3"),
+                              (decoder.decode_circle, "(1,2,3)"),
+                              (decoder.decode_lseg, "(1,2),(3,4)"),
+                              (decoder.decode_box, "[(1,2),(3,4)]"),
+                              (decoder.decode_path, "[(1,2),(3,4))"),
+                              (decoder.decode_path, "(1,2,3,4)"),
+                              (decoder.decode_polygon, "[(1,2),(3,4)]"),
+                              (decoder.decode_polygon, "((1,2,3,4))")]:
+            with self.assertRaises(ValueError):
+                decode(value)
+
+        self.assertEqual(decoder.decode_box("((1,2),(3,4))"), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(decoder.decode_point(" ( 1 , inf ) "), [1.0, float("inf")])
+
+    def test_bad_commas(self):
+        for decode, value in [(decoder.decode_point, "(1),(2)"),
+                              (decoder.decode_circle, "<(1),2,3>"),
+                              (decoder.decode_circle, "<(1,2,3)>"),
+                              (decoder.decode_lseg, "[(1,2,3),(4)]"),
+                              (decoder.decode_lseg, "[(1,2)(3,4)]"),
+                              (decoder.decode_box, "(1),(2,3,4)"),
+                              (decoder.decode_path, "[(1,2),(3,4,5,6)]"),
+                              (decoder.decode_path, "((1,2)(3,4))"),
+                              (decoder.decode_path, "[(1,2),,(3,4)]"),
+                              (decoder.decode_polygon, "((1),(2,3,4))"),
+                              (decoder.decode_polygon, "((1,2,3),(4,5,6))"),
+                              (decoder.decode_polygon, "((1,2),(3,4),)"),
+                              (decoder.decode_polygon, "((1,2),(3,))")]:
+            with self.assertRaises(ValueError):
+                decode(value)
+
+    def test_array(self):
+        self.assertEqual(decoder.decode_array('{"(1,2)",NULL,"(3,4)"}'),
+                         ["(1,2)", None, "(3,4)"])
+        self.assertEqual(decoder.decode_array("{(1,1),(0,0);(2,2),(1,1)}", ";"),
+                         ["(1,1),(0,0)", "(2,2),(1,1)"])
+        self.assertEqual(decoder.decode_array('[0:0]={"(1,2)"}'), ["(1,2)"])
+        self.assertEqual(decoder.decode_array("{}"), [])
+
+        for value in ['{{"(1,2)"}}', "(1,2)", ""]:
+            with self.assertRaises(ValueError):
+                decoder.decode_array(value)
+
+    def test_cast_functions(self):
+        self.assertEqual(CAST_MAPPER['Point']("(1,2)", None), Point(1,2))
+        self.assertEqual(CAST_MAPPER['Circle']("<(1,2),3>", None), Circle([1,2],3))
+        self.assertEqual(CAST_MAPPER['Box']("(5,5),(0,0)", None), Box([0,0],[5,5]))
+        self.assertEqual(CAST_MAPPER['Lseg']("[(1,2),(3,4)]", None), Lseg([1,2],[3,4]))
+        self.assertEqual(CAST_MAPPER['Path']("[(1,2),(3,4)]", None),
+                         Path((1,2), (3,4), closed=False))
+        self.assertEqual(CAST_MAPPER['Polygon']("((1,2),(3,4),(5,0))", None),
+                         Polygon((1,2), (3,4), (5,0)))
+
+
+class PathTest(TestCase):
+    def setUp(self):
+        self.obj0 = PathObjectModel.objects\
+            .create(parea=Path((0,0), (1,1), (2,0), closed=False))
+        self.obj1 = PolygonObjectModel.objects\
+            .create(parea=Polygon((0,0), (1,1), (2,0)))
+
+    def tearDown(self):
+        PathObjectModel.objects.all().delete()
+        PolygonObjectModel.objects.all().delete()
+
+    def test_casting(self):
+        obj0 = PathObjectModel.objects.get(pk=self.obj0.pk)
+        self.assertIsInstance(obj0.parea, Path)
+        self.assertEqual(obj0.parea, Path((0,0), (1,1), (2,0), closed=False))
+
+        obj1 = PolygonObjectModel.objects.get(pk=self.obj1.pk)
+        self.assertIsInstance(obj1.parea, Polygon)
+        self.assertEqual(obj1.parea, Polygon((0,0), (1,1), (2,0)))
+
+    def test_compact_storage(self):
+        path = Path((0,0), Point(1,1), [2,0])
+        self.assertFalse(hasattr(path, '__dict__'))
+        self.assertFalse(hasattr(Point(1,1), '__dict__'))
+        self.assertEqual(list(path.coords), [0, 0, 1, 1, 2, 0])
+        self.assertEqual(len(path), 3)
+        self.assertEqual(path[-1], Point(2,0))
+        self.assertEqual(path.points, (Point(0,0), Point(1,1), Point(2,0)))
+        self.assertEqual([tuple(x) for x in path], [(0,0), (1,1), (2,0)])
+
+    def test_points_and_slices(self):
+        path = Path((0,0), (1,1), (2,0), (3,3))
+        self.assertEqual(path[1:3], (Point(1,1), Point(2,0)))
+        self.assertEqual(path[::-2], (Point(3,3), Point(1,1)))
+        self.assertEqual(path[10:], ())
+
+        with self.assertRaises(AttributeError):
+            path.points.append(Point(4,4))
+
+        path.points = path.points + (Point(4,4), (5,5))
+        self.assertEqual(list(path.coords), [0, 0, 1, 1, 2, 0, 3, 3, 4, 4, 5, 5])
+        self.assertEqual(path[-1], Point(5,5))
+
+    def test_from_coords(self):
+        self.assertEqual(Path.from_coords([0,0,1,1], closed=False),
+                         Path((0,0), (1,1), closed=False))
+        self.assertNotEqual(Path.from_coords([0,0,1,1]),
+                            Path((0,0), (1,1), closed=False))
+
+        with self.assertRaises(ValueError):
+            Path.from_coords([0,0,1])
+
+
+class LazyCastTest(TestCase):
+    def setUp(self):
+        Polygon.register_cast(connection, lazy=True)
+        self.obj0 = PolygonObjectModel.objects\
+            .create(parea=Polygon((0,0), (1,1), (2,0)))
+
+    def tearDown(self):
+        Polygon.register_cast(connection)
+        PolygonObjectModel.objects.all().delete()
+
+    def test_deferred_parsing(self):
+        value = PolygonObjectModel.objects.get(pk=self.obj0.pk).parea
+        self.assertIs(type(value), LazyGeometry)
+        self.assertIsInstance(value, Polygon)
+        self.assertFalse(value.is_resolved)
+
+        self.assertEqual(len(value.points), 3)
+        self.assertTrue(value.is_resolved)
+        self.assertEqual(value, Polygon((0,0), (1,1), (2,0)))
+
+    def test_save_unparsed(self):
+        obj = PolygonObjectModel.objects.get(pk=self.obj0.pk)
+        obj.save()
+        self.assertFalse(obj.parea.is_resolved)
+
+        obj = PolygonObjectModel.objects.get(pk=self.obj0.pk)
+        self.assertEqual(list(obj.parea), [Point(0,0), Point(1,1), Point(2,0)])
+
+
+class RegistryTest(TestCase):
+    def unregister(self):
+        # psycopg2 can not remove typecasters, text ones replace them
+        for name, (oid, array_oid) in registry.BUILTIN_TYPE_OIDS.items():
+            register_type(new_type((oid,), str("%s_TEXT" % name.upper()), lambda value, cur: value))
+        registry._installed = False
+
+    def tearDown(self):
+        registry.ensure_registered(connection)
+
+    def test_type_oids(self):
+        oids = registry.get_type_oids()
+        self.assertEqual(sorted(oids), sorted(registry.GEOMETRIC_TYPES))
+        self.assertEqual(oids['point'], (600, 1017))
+
+        with self.assertNumQueries(0):
+            registry.get_type_oids()
+
+    def test_stream_before_registration(self):
+        BoxObjectModel.objects.create(barea=Box([0,0],[1,1]))
+        self.unregister()
+
+        # a queryset of a plain manager gets text until registration
+        qs = QuerySet(BoxObjectModel)
+        self.assertEqual(list(qs.values_list('barea', flat=True)), ["(1,1),(0,0)"])
+
+        document = json.loads("".join(serializers.stream_geojson(qs, 'barea')))
+        self.assertEqual(document["features"][0]["geometry"],
+                         serializers.to_geojson(Box([0,0],[1,1])))
+        self.assertTrue(registry._installed)
+
+    def test_connection_created(self):
+        self.unregister()
+        connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertTrue(registry._installed)
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT '(1,2)'::point")
+        self.assertEqual(cursor.fetchone()[0], Point(1,2))
+
+    def test_register_once(self):
+        with self.assertNumQueries(0):
+            registry.register_geometric_types(connection)
+            registry.ensure_registered(connection)
+
+    def test_import_without_django_and_psycopg2(self):
+        script = ("import sys\n"
+                  "from djorm_pggeom import objects, decoder, serializers\n"
+                  "assert objects.Point(1,2) == serializers.loads(serializers.dumps(objects.Point(1,2)))\n"
+                  "print(sorted(m for m in sys.modules if m.split('.')[0] in ('django', 'psycopg2')))")
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop("DJANGO_SETTINGS_MODULE", None)
+
+        output = subprocess.check_output([sys.executable, "-c", script], env=env)
+        self.assertEqual(output.decode("utf-8").strip(), "[]")
+
+    def test_to_python_text(self):
+        field = GeometricField(dbtype=Box)
+        self.assertEqual(field.to_python("(2,2),(0,0)"), Box([0,0],[2,2]))
+        self.assertEqual(GeometricField(dbtype=Point).to_python("(1,2)"), Point(1,2))
+
+
+class CopyInsertTest(TestCase):
+    def tearDown(self):
+        SomeObject.objects.all().delete()
+        BoxObjectModel.objects.all().delete()
+        PolygonObjectModel.objects.all().delete()
+
+    def test_copy_instances(self):
+        count = copy_insert(SomeObject, [
+            SomeObject(pos=Point(1,1)),
+            SomeObject(pos=Point(-2.5,1e20)),
+            SomeObject(pos=None),
+        ])
+        self.assertEqual(count, 3)
+
+        values = list(SomeObject.objects.order_by('pk')\
+            .values_list('pos', flat=True))
+        self.assertEqual(values, [Point(1,1), Point(-2.5,1e20), None])
+
+    def test_copy_tuples(self):
+        circle = CircleObjectModel.objects.create(carea=Circle([0,0],1))
+        polygon = Polygon((0,0), (1,1), (2,0))
+
+        copy_insert(BoxObjectModel, ((Box([0,0],[1,1]), circle.pk) \
+            for x in range(5)), fields=['barea', 'other'], chunk_size=2)
+        copy_insert(PolygonObjectModel, [(polygon,)])
+
+        self.assertEqual(BoxObjectModel.objects.filter(other=circle).count(), 5)
+        self.assertEqual(PolygonObjectModel.objects.get().parea, polygon)
+
+    def test_reader_chunks(self):
+        reader = CopyReader(([x, u"a\tb"] for x in range(3)), chunk_size=1)
+        self.assertEqual(reader.read(4), "0\ta\\")
+        self.assertEqual(reader.read(), "tb\n1\ta\\tb\n2\ta\\tb\n")
+        self.assertEqual(reader.read(), "")
+        self.assertEqual(reader.count, 3)
+
+
+class NearestTest(TestCase):
+    def setUp(self):
+        copy_insert(SomeObject, [(Point(x, y),) \
+            for x in range(10) for y in range(10)])
+
+    def tearDown(self):
+        SomeObject.objects.all().delete()
+
+    def test_nearest(self):
+        qs = SomeObject.objects.nearest("pos", Point(2.1, 3.2), k=3)
+        self.assertEqual([x.pos for x in qs],
+            [Point(2,3), Point(2,4), Point(3,3)])
+
+        self.assertAlmostEqual(qs[0].pos_distance, 0.2236, places=4)
+
+    def test_nearest_sql(self):
+        qs = SomeObject.objects.nearest("pos", Point(0,0), k=5,
+                                        distance_alias="dist")
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"pg_geometric_someobject"."pos" <-> %s::point)) AS "dist"', sql)
+        self.assertIn('(0.0,0.0)', params)
+
+        other_sql, other_params = SomeObject.objects.nearest("pos", Point(3,-1), k=5,
+            distance_alias="dist").query.sql_with_params()
+        self.assertEqual(other_sql, sql)
+        self.assertIn('ORDER BY "dist" ASC LIMIT 5', sql)
+
+
+class SpatialIndexTest(TestCase):
+    def get_index_definitions(self, model):
+        cursor = connection.cursor()
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s",
+                       [model._meta.db_table])
+        return [x[0] for x in cursor.fetchall()]
+
+    def test_created_indexes(self):
+        self.assertIn("CREATE INDEX pg_geometric_someobject_pos_gist ON "
+                      "public.pg_geometric_someobject USING gist (pos)",
+                      self.get_index_definitions(SomeObject))
+        self.assertIn("CREATE INDEX pg_geometric_boxobjectmodel_barea_spgist ON "
+                      "public.pg_geometric_boxobjectmodel USING spgist (barea)",
+                      self.get_index_definitions(BoxObjectModel))
+
+    def test_invalid_index_method(self):
+        with self.assertRaises(ValueError):
+            GeometricField(dbtype=Path, spatial_index=True)
+
+        with self.assertRaises(ValueError):
+            GeometricField(dbtype=Circle, spatial_index=True, index_method='spgist')
+
+        # index_method without spatial_index
+        for method in ('spgist', 'hash'):
+            with self.assertRaises(ValueError):
+                GeometricField(dbtype=Box, index_method=method)
+
+    def test_post_create_sql(self):
+        class OtherOps(object):
+            max_name_length = lambda self: 10
+            quote_name = lambda self, name: '`%s`' % name
+
+        class OtherConnection(object):
+            ops = OtherOps()
+
+        from django.core.management.color import no_style
+        field = BoxObjectModel._meta.get_field('barea')
+        self.assertEqual(field.post_create_sql(no_style(), 'boxes', OtherConnection()),
+                         ['CREATE INDEX `boxes_e740` ON `boxes` USING spgist (`barea`);'])
+        self.assertEqual(field.post_create_sql(no_style(), 'boxes'),
+                         ['CREATE INDEX "boxes_barea_spgist" ON "boxes" USING spgist ("barea");'])
+
+    def test_south_introspection(self):
+        try:
+            from south.modelsinspector import introspector
+        except ImportError:
+            return
+
+        field = PolygonObjectModel._meta.get_field('parea')
+        args, kwargs = introspector(field)
+        self.assertEqual(kwargs['dbtype'], "'Polygon'")
+        self.assertEqual(kwargs['spatial_index'], "True")
+
+
+class GeometricLookupsTest(TestCase):
+    def setUp(self):
+        c_instance_0 = CircleObjectModel.objects.create(carea=Circle([1,1],5))
+        c_instance_1 = CircleObjectModel.objects.create(carea=Circle([-2,-2],1))
+
+        BoxObjectModel.objects.bulk_create([
+            BoxObjectModel(barea=Box([1,1],[3,2]), other=c_instance_0),
+            BoxObjectModel(barea=Box([2,2],[4,7]), other=c_instance_0),
+            BoxObjectModel(barea=Box([10,10],[20,20]), other=c_instance_1),
+        ])
+
+        SomeObject.objects.bulk_create([
+            SomeObject(pos=Point(1,1)),
+            SomeObject(pos=Point(2,2)),
+            SomeObject(pos=Point(1,5)),
+        ])
+
+    def test_lookups(self):
+        qs = SomeObject.objects.filter(pos__contained_on=Box([1,1],[4,4]))
+        self.assertEqual(qs.count(), 2)
+
+        qs = BoxObjectModel.objects.filter(barea__overlaps=Box([2,0],[5,3]))
+        self.assertEqual(qs.count(), 2)
+
+        qs = BoxObjectModel.objects.filter(barea__not_intersects_with=Box([2,0],[5,3]))
+        self.assertEqual(qs.count(), 1)
+
+    def test_combined_lookups(self):
+        qs = BoxObjectModel.objects.filter(
+            Q(barea__contained_on=Box([0,0],[3,3])) |
+            Q(barea__is_strictly_right_of=Box([0,0],[5,5])))
+        self.assertEqual(qs.count(), 2)
+
+        qs = BoxObjectModel.objects.filter(other__carea__overlaps=Circle([2,2],2))
+        self.assertEqual(qs.count(), 2)
+
+        qs = BoxObjectModel.objects.exclude(barea__overlaps=Box([2,0],[5,3]))\
+            .filter(other__isnull=False)
+        self.assertEqual(qs.count(), 1)
+
+    def test_lookup_sql(self):
+        qs = SomeObject.objects.filter(pos__contained_on=Box([1,1],[4,4]))
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"pg_geometric_someobject"."pos" <@ %s::box', sql)
+
+    def test_array_lookups(self):
+        qs = SomeObject.objects.filter(pos__contained_on=[Box([0,0],[1,1]), Box([0,4],[2,6])])
+        self.assertEqual(qs.count(), 2)
+
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"pg_geometric_someobject"."pos" <@ ANY(%s::box[])', sql)
+
+    def test_negated_and_mixed_lookups(self):
+        SomeObject.objects.create(pos=None)
+        qs = SomeObject.objects.exclude(pos__contained_on=Box([0,0],[1,1]))
+        self.assertEqual(qs.count(), 3)
+        self.assertEqual(SomeObject.objects.filter(~Q(pos__contained_on=Box([0,0],[1,1]))).count(), 3)
+
+        obj = SomeObject.objects.get(pos__same_as=Point(1,5), pk__isnull=False)
+        self.assertEqual(obj.pos, Point(1,5))
+
+        qs = SomeObject.objects.filter(Q(pos__same_as=Point(1,5)) | Q(pk=obj.pk - 1))
+        self.assertEqual(list(qs.order_by('pk').values_list('pos', flat=True)), [Point(2,2), Point(1,5)])
+        qs = SomeObject.objects.filter(Q(pos__same_as=Point(1,5)) | Q(pos__isnull=True))
+        self.assertEqual(qs.count(), 2)
+        qs = SomeObject.objects.exclude(pos__same_as=Point(1,5), pk=obj.pk)
+        self.assertEqual(qs.count(), 3)
+        qs = SomeObject.objects.exclude(Q(pos__same_as=Point(1,5)) | Q(pos__isnull=True))
+        self.assertEqual(qs.count(), 2)
+
+    def test_lookups_through_joins(self):
+        big = CircleObjectModel.objects.get(carea=Circle([1,1],5))
+        small = CircleObjectModel.objects.get(carea=Circle([-2,-2],1))
+        CircleObjectModel.objects.create(carea=Circle([30,30],1))
+
+        qs = BoxObjectModel.objects.filter(
+            Q(other__carea__overlaps=Circle([-2,-2],1)) | Q(barea__overlaps=Box([2,2],[3,3])))
+        self.assertEqual(qs.count(), 3)
+        qs = BoxObjectModel.objects.filter(
+            Q(other__carea__overlaps=Circle([30,30],1)) | Q(other=big), ~Q(barea__contains=Point(2,2)))
+        self.assertEqual(qs.count(), 0)
+
+        # reverse relation, multi-valued in exclude()
+        qs = CircleObjectModel.objects.filter(
+            Q(boxes__barea__overlaps=Box([15,15],[16,16])) | Q(pk=big.pk)).order_by('pk')
+        self.assertEqual(list(qs.values_list('pk', flat=True).distinct()), [big.pk, small.pk])
+        qs = CircleObjectModel.objects.exclude(boxes__barea__overlaps=Box([2,2],[3,3]))
+        self.assertEqual(qs.count(), 2)
+        qs = big.boxes.filter(barea__is_strictly_right_of=Box([0,0],[1.5,1.5]))
+        self.assertEqual(qs.count(), 1)
+
+    def test_unary_lookup_sql(self):
+        # there are no lseg columns, only the statement is checked
+        sql, params = SomeObject.objects.filter(pos__is_horizontal=True).query.sql_with_params()
+        self.assertIn('WHERE ?- "pg_geometric_someobject"."pos"', sql)
+
+        sql, params = SomeObject.objects.filter(pos__is_vertical=False).query.sql_with_params()
+        self.assertIn('WHERE NOT ?| "pg_geometric_someobject"."pos"', sql)
+
+
+class IterGeometriesTest(TestCase):
+    def setUp(self):
+        copy_insert(PolygonObjectModel, [(Polygon((x,0), (x,1), (x+1,0)),) \
+            for x in range(25)] + [(None,)])
+
+    def tearDown(self):
+        PolygonObjectModel.objects.all().delete()
+
+    def test_iter_geometries(self):
+        qs = PolygonObjectModel.objects.filter(parea__isnull=False).order_by('-pk')
+        result = list(qs.iter_geometries('parea', chunk_size=10))
+
+        self.assertEqual(len(result), 25)
+        self.assertEqual([pk for pk, value in result],
+                         list(qs.values_list('pk', flat=True)))
+        self.assertEqual(result[0][1], Polygon((24,0), (24,1), (25,0)))
+
+    def test_null_values(self):
+        values = [x for pk, x in PolygonObjectModel.objects.iter_geometries('parea')]
+        self.assertEqual(values.count(None), 1)
+
+    def test_process_pool(self):
+        qs = PolygonObjectModel.objects.order_by('-pk')
+        expected = list(qs.iter_geometries('parea'))
+
+        pool = multiprocessing.Pool(2)
+        try:
+            result = list(qs.iter_geometries('parea', chunk_size=4, pool=pool))
+        finally:
+            pool.terminate()
+        self.assertEqual(result, expected)
+
+    def test_coords(self):
+        pool = ThreadPool(2)
+        try:
+            result = list(PolygonObjectModel.objects.order_by('pk').iter_geometries(
+                'parea', chunk_size=3, pool=pool, coords=True, prefetch=1))
+        finally:
+            pool.terminate()
+
+        self.assertEqual(result[0][1], array('d', [0, 0, 0, 1, 1, 0]))
+        self.assertEqual(result[-1][1], None)
+        self.assertEqual([v for pk, v in result],
+            [v for pk, v in PolygonObjectModel.objects.order_by('pk')\
+                .iter_geometries('parea', coords=True)])
+
+    def test_decode_chunk(self):
+        values = [TEXT_MAPPER['Path'](Path((1,2), (3,4), closed=False)), None,
+                  TEXT_MAPPER['Path'](Path((5,6), (7,8.5)))]
+        buffers = parallel.decode_chunk('Path', values)
+        self.assertEqual(buffers[1], array('l', [4, -1, 4]))
+        self.assertEqual(parallel.build_chunk('Path', *buffers),
+            [Path((1,2), (3,4), closed=False), None, Path((5,6), (7,8.5))])
+
+        for value in (Point(1, 2), Circle([1, 2], 3), Lseg([1, 2], [3, 4]), Box([3, 4], [1, 2])):
+            type_name = value.__class__.__name__
+            text = TEXT_MAPPER[type_name](value)
+            buffers = parallel.decode_chunk(type_name, [text])
+            self.assertEqual(parallel.build_chunk(type_name, *buffers),
+                             [CAST_MAPPER[type_name](text, None)])
+
+
+@skipIf(np is None, "GeometryArray requires numpy")
+class GeometryArrayTest(TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        coord = lambda: rnd.choice([rnd.uniform(-10, 10), rnd.randint(-10, 10)])
+
+        copy_insert(SomeObject, [(Point(coord(), coord()),) for x in range(300)])
+        copy_insert(BoxObjectModel, [(Box([coord(), coord()], [coord(), coord()]), None) \
+            for x in range(300)])
+        copy_insert(CircleObjectModel, [(Circle([coord(), coord()], abs(coord())),) \
+            for x in range(300)])
+
+    def tearDown(self):
+        SomeObject.objects.all().delete()
+        BoxObjectModel.objects.all().delete()
+        CircleObjectModel.objects.all().delete()
+
+    def assertMatchesServer(self, model, field, operator, other, result):
+        qs = model.objects.order_by('pk').extra(
+            select={'result': '%s %s %%s' % (field, operator)}, select_params=[other])
+        expected = [x for x in qs.values_list('result', flat=True)]
+        self.assertEqual(len(expected), len(result))
+        for value, (index, expected_value) in zip(list(result), enumerate(expected)):
+            if isinstance(expected_value, float):
+                self.assertAlmostEqual(value, expected_value, places=9)
+            else:
+                self.assertEqual(bool(value), expected_value, index)
+
+    def test_points(self):
+        points = GeometryArray.from_queryset(SomeObject.objects.order_by('pk'), 'pos')
+        self.assertEqual(len(points), 300)
+        self.assertEqual(points[0], SomeObject.objects.order_by('pk')[0].pos)
+
+        box, circle = Box([-5,-5], [5,5]), Circle([1,1], 5)
+        self.assertMatchesServer(SomeObject, 'pos', '<@', box, points.contained_on(box))
+        self.assertMatchesServer(SomeObject, 'pos', '<@', circle, points.contained_on(circle))
+        self.assertMatchesServer(SomeObject, 'pos', '<->', Point(1,2), points.distance(Point(1,2)))
+        self.assertMatchesServer(SomeObject, 'pos', '<->', box, points.distance(box))
+
+    def test_boxes(self):
+        boxes = GeometryArray.from_queryset(BoxObjectModel.objects.order_by('pk'), 'barea')
+        box = Box([-5,-5], [5,5])
+
+        self.assertMatchesServer(BoxObjectModel, 'barea', '&&', box, boxes.overlaps(box))
+        self.assertMatchesServer(BoxObjectModel, 'barea', '<@', box, boxes.contained_on(box))
+        self.assertMatchesServer(BoxObjectModel, 'barea', '@>', Box([0,0], [1,1]),
+                                 boxes.contains(Box([0,0], [1,1])))
+        self.assertMatchesServer(BoxObjectModel, 'barea', '@>', Point(1,1),
+                                 boxes.contains(Point(1,1)))
+        self.assertMatchesServer(BoxObjectModel, 'barea', '<->', box, boxes.distance(box))
+
+        areas = BoxObjectModel.objects.order_by('pk')\
+            .extra(select={'a': 'area(barea)'}).values_list('a', flat=True)
+        for value, expected in zip(boxes.area(), areas):
+            self.assertAlmostEqual(value, expected, places=9)
+
+    def test_circles(self):
+        circles = GeometryArray.from_queryset(CircleObjectModel.objects.order_by('pk'), 'carea')
+        circle = Circle([1,1], 5)
+
+        self.assertMatchesServer(CircleObjectModel, 'carea', '&&', circle, circles.overlaps(circle))
+        self.assertMatchesServer(CircleObjectModel, 'carea', '<@', circle, circles.contained_on(circle))
+        self.assertMatchesServer(CircleObjectModel, 'carea', '@>', Point(1,1),
+                                 circles.contains(Point(1,1)))
+        self.assertMatchesServer(CircleObjectModel, 'carea', '<->', circle, circles.distance(circle))
+
+    def test_objects_and_nulls(self):
+        array = GeometryArray.from_objects([Box([0,0],[2,2]), None, Box([4,4],[3,3])])
+        self.assertEqual(list(array.overlaps(Box([1,1],[5,5]))), [True, False, True])
+        self.assertEqual(array[1], None)
+        self.assertEqual(array.center()[2], Point(3.5,3.5))
+        self.assertEqual(array.take([0, 2]).to_objects(), [Box([0,0],[2,2]), Box([3,3],[4,4])])
+
+        with self.assertRaises(TypeError):
+            array.overlaps(Point(1,1))
+
+
+class RTreeIndexTest(TestCase):
+    def setUp(self):
+        rnd = random.Random(2)
+        coord = lambda: rnd.uniform(-50, 50)
+
+        copy_insert(SomeObject, [(Point(coord(), coord()),) for x in range(500)])
+        copy_insert(BoxObjectModel, [(Box([coord(), coord()], [coord(), coord()]), None) \
+            for x in range(500)])
+        copy_insert(CircleObjectModel, [(Circle([coord(), coord()], abs(coord()) / 5),) \
+            for x in range(500)])
+
+    def tearDown(self):
+        SomeObject.objects.all().delete()
+        BoxObjectModel.objects.all().delete()
+        CircleObjectModel.objects.all().delete()
+
+    def server_keys(self, model, field, operator, other):
+        qs = model.objects.extra(where=['%s %s %%s' % (field, operator)], params=[other])
+        return set(qs.values_list('pk', flat=True))
+
+    def test_matches_server(self):
+        cases = [
+            (SomeObject, 'pos', [Box([-10,-10], [20,5]), Circle([0,0], 15)]),
+            (BoxObjectModel, 'barea', [Box([-10,-10], [20,5])]),
+            (CircleObjectModel, 'carea', [Circle([3,-3], 12)]),
+        ]
+        for model, field, queries in cases:
+            index = SpatialIndex.from_queryset(model.objects.all(), field, max_entries=8)
+            self.assertEqual(len(index), 500)
+
+            for query in queries:
+                self.assertEqual(set(index.contained_on(query)),
+                                 self.server_keys(model, field, '<@', query))
+                if model is not SomeObject:
+                    self.assertEqual(set(index.overlaps(query)),
+                                     self.server_keys(model, field, '&&', query))
+                    self.assertEqual(set(index.contains(Point(1, 2))),
+                                     self.server_keys(model, field, '@>', Point(1, 2)))
+
+    def test_nearest(self):
+        for model, field in [(SomeObject, 'pos'), (BoxObjectModel, 'barea'),
+                             (CircleObjectModel, 'carea')]:
+            index = SpatialIndex.from_queryset(model.objects.all(), field)
+            expected = model.objects.extra(
+                select={'d': '%s <-> %%s' % field}, select_params=[Point(3, 4)],
+                order_by=['d']).values_list('d', flat=True)[:10]
+
+            result = index.nearest(Point(3, 4), k=10, with_distance=True)
+            for (key, distance), expected_distance in zip(result, expected):
+                self.assertAlmostEqual(distance, expected_distance, places=9)
+            self.assertEqual(len(result), 10)
+
+    def test_insert_delete(self):
+        boxes = dict(BoxObjectModel.objects.values_list('pk', 'barea'))
+        index = SpatialIndex(max_entries=4)
+        for key, box in boxes.items():
+            index.insert(key, box)
+
+        deleted = sorted(boxes)[::2]
+        for key in deleted:
+            index.delete(key)
+            del boxes[key]
+
+        viewport = Box([-20,-20], [20,20])
+        self.assertEqual(set(index.overlaps(viewport)),
+                         set(k for k, v in boxes.items() if self.overlaps(v, viewport)))
+        self.assertNotIn(deleted[0], index)
+        with self.assertRaises(KeyError):
+            index.delete(deleted[0])
+
+        key = sorted(boxes)[0]
+        index.insert(key, Box([1000,1000], [1001,1001]))
+        self.assertEqual(len(index), len(boxes))
+        self.assertEqual(index.overlaps(Box([999,999], [1000.5,1000.5])), [key])
+        self.assertEqual(index.nearest(Point(2000,2000)), [key])
+
+    def overlaps(self, a, b):
+        (ax1, ay1), (ax2, ay2) = a
+        (bx1, by1), (bx2, by2) = b
+        return min(ax1, ax2) <= max(bx1, bx2) and min(bx1, bx2) <= max(ax1, ax2) and \
+            min(ay1, ay2) <= max(by1, by2) and min(by1, by2) <= max(ay1, ay2)
+
+
+class GeometricArrayTest(TestCase):
+    def setUp(self):
+        PolygonObjectModel.objects.create(parea=Polygon((0,0), (0,10), (10,10), (10,0)))
+        PolygonObjectModel.objects.create(parea=Polygon((5,5), (5,20), (20,20)))
+        PolygonObjectModel.objects.create(parea=Polygon((-5,-5), (-5,-1), (-1,-1)))
+
+        SomeObject.objects.bulk_create([
+            SomeObject(pos=Point(1,1)),
+            SomeObject(pos=Point(6,8)),
+            SomeObject(pos=Point(30,30)),
+        ])
+
+    def select(self, value):
+        cursor = connection.cursor()
+        cursor.execute("SELECT %s", [value])
+        return cursor.fetchone()[0]
+
+    def test_round_trip(self):
+        values = [
+            [Point(1,2), None, Point(-3.5,4)],
+            [Box([0,0],[1,1]), Box([2,2],[5,3])],
+            (Circle([1,1],2),),
+            [Lseg([1,2],[3,4])],
+            [Path((1,2), (3,4), closed=False), Path((0,0), (1,1), (2,0))],
+            [Polygon((0,0), (0,1), (1,0)), None],
+        ]
+        for value in values:
+            self.assertEqual(self.select(GeometricArray(value)), list(value))
+
+        self.assertEqual(self.select(GeometricArray([], 'Point')), [])
+        with self.assertRaises(TypeError):
+            GeometricArray([Point(1,2), Box([0,0],[1,1])])
+
+    def test_other_sequences(self):
+        self.assertEqual(self.select([1, 2]), [1, 2])
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1 IN %s", [(1, 2)])
+        self.assertTrue(cursor.fetchone()[0])
+
+        # sequences of geometric values are left to psycopg2 too
+        cursor.execute("SELECT %s IN %s", [Box([0,0],[1,1]), (Box([1,1],[0,0]), Box([2,2],[0,0]))])
+        self.assertTrue(cursor.fetchone()[0])
+
+    def test_any_expression(self):
+        zones = list(PolygonObjectModel.objects.values_list('parea', flat=True))
+        qs = SomeObject.objects.where(GeoExpression("pos").contained_on(zones))
+        self.assertEqual(qs.count(), 2)
+
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"pos" <@ ANY(%s::polygon[])', sql)
+
+    def test_unnest_join(self):
+        zones = list(PolygonObjectModel.objects.order_by('pk').values_list('pk', flat=True))
+        points = [Point(1,1), Point(6,8), Point(30,30), Point(-2,-2)]
+
+        result = PolygonObjectModel.objects.unnest_join("parea", points, "contains")
+        self.assertEqual(result, [(zones[0], 0), (zones[0], 1), (zones[1], 1), (zones[2], 3)])
+
+        result = PolygonObjectModel.objects.filter(pk=zones[1])\
+            .unnest_join("parea", points, "contains")
+        self.assertEqual(result, [(zones[1], 1)])
+
+        with self.assertRaises(TypeError):
+            PolygonObjectModel.objects.unnest_join("parea", [1, 2])
+
+
+class BinaryCodecTest(TestCase):
+    values = [
+        Point(1.5, -2), Point(float("inf"), -0.0),
+        Circle([1, 2], 0.1 + 0.2),
+        Box([0, 0], [1e-300, 1e300]), Box([-1, 3], [3, 7]),
+        Lseg([1, 2], [3, 4.25]),
+        Path((1, 2), (3, 4), closed=False), Path((0, 0), (1, 1), (2, 0)),
+        Polygon(*[(x / 7.0, -x) for x in range(1000)]),
+    ]
+
+    def tearDown(self):
+        SomeObject.objects.all().delete()
+        BoxObjectModel.objects.all().delete()
+        PolygonObjectModel.objects.all().delete()
+
+    def test_matches_server(self):
+        cursor = connection.cursor()
+        for value in self.values:
+            type_name = value.__class__.__name__
+            function = "poly_send" if type_name == "Polygon" else "%s_send" % type_name.lower()
+            cursor.execute("SELECT %s(%%s), %%s" % function, [value, value])
+            data, expected = cursor.fetchone()
+
+            self.assertEqual(binary.SEND_MAPPER[type_name](value), bytes(data))
+            self.assertEqual(binary.RECV_MAPPER[type_name](data), expected)
+
+    def test_round_trip(self):
+        for value in self.values:
+            type_name = value.__class__.__name__
+            data = binary.to_binary(value)
+            self.assertEqual(binary.RECV_MAPPER[type_name](data), value)
+
+        self.assertEqual(binary.to_binary(1), None)
+
+    def test_bad_representation(self):
+        for data in [b"", b"\x00" * 15]:
+            with self.assertRaises(ValueError):
+                binary.recv_point(data)
+
+        data = binary.send_polygon(Polygon((0, 0), (1, 1), (2, 0)))
+        with self.assertRaises(ValueError):
+            binary.recv_polygon(data[:-8])
+
+    def test_binary_copy(self):
+        circle = CircleObjectModel.objects.create(carea=Circle([0,0],1))
+        boxes = [Box([x, 0], [x + 1, 1]) for x in range(2500)]
+
+        count = copy_insert(BoxObjectModel, [(box, circle.pk if x % 2 else None) \
+            for x, box in enumerate(boxes)], binary=True, chunk_size=1000)
+        self.assertEqual(count, 2500)
+
+        qs = BoxObjectModel.objects.order_by('pk')
+        self.assertEqual(copy_values_list(qs, 'pk', 'barea', 'other'),
+                         list(qs.values_list('pk', 'barea', 'other')))
+
+        copy_insert(PolygonObjectModel, [(self.values[-1],), (None,)], binary=True)
+        self.assertEqual(copy_values_list(PolygonObjectModel.objects.order_by('pk'), 'parea'),
+                         [(self.values[-1],), (None,)])
+
+        copy_insert(SomeObject, [SomeObject(pos=Point(1, 2))], binary=True)
+        self.assertEqual(copy_values_list(SomeObject.objects.filter(pos__isnull=False), 'pos'),
+                         [(Point(1, 2),)])
+
+    def test_unsupported_column(self):
+        with self.assertRaises(ValueError):
+            get_binary_codec(models.DateField(name='date'), connection)
+
+
+class DriversTest(SimpleTestCase):
+    def test_predicate_sql(self):
+        self.assertEqual(drivers.predicate_sql("pos", "contained_on", "$1"), "pos <@ $1")
+        self.assertEqual(drivers.predicate_sql("barea", "overlaps"), "barea && %s")
+
+    def test_psycopg_codecs(self):
+        for value in BinaryCodecTest.values:
+            text_load, binary_load, text_dump, binary_dump = \
+                drivers.psycopg_codecs(value.__class__)
+            name = value.__class__.__name__
+            self.assertEqual(text_load(None, text_dump(None, value)),
+                             CAST_MAPPER[name](TEXT_MAPPER[name](value), None))
+            self.assertEqual(binary_load(None, binary_dump(None, value)), value)
+
+    def test_asyncpg_codecs(self):
+        codecs = drivers.asyncpg_codecs()
+        self.assertEqual([name for name, kwargs in codecs],
+                         ['point', 'circle', 'lseg', 'box', 'path', 'polygon'])
+
+        for value in BinaryCodecTest.values:
+            kwargs = dict(codecs)[value.__class__.db_type(None)]
+            self.assertEqual(kwargs['format'], 'binary')
+            self.assertEqual(kwargs['decoder'](kwargs['encoder'](value)), value)
+
+    @skipIf(not hasattr(drivers, "register_asyncpg"), "async drivers require python 3")
+    def test_register_asyncpg(self):
+        class StubConnection(object):
+            def __init__(self, fail=None):
+                self.fail = fail
+                self.calls = []
+
+            def set_type_codec(self, typename, **kwargs):
+                self.calls.append((typename, kwargs['schema'], kwargs['format']))
+                future = asyncio.get_running_loop().create_future()
+                if typename == self.fail:
+                    future.set_exception(ValueError(typename))
+                else:
+                    future.set_result(None)
+                return future
+
+        def register(conn):
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(drivers.register_asyncpg(conn))
+            finally:
+                loop.close()
+
+        conn = StubConnection()
+        register(conn)
+        self.assertEqual(conn.calls, [(name, 'pg_catalog', 'binary') \
+            for name, kwargs in drivers.asyncpg_codecs()])
+
+        conn = StubConnection(fail='box')
+        with self.assertRaises(ValueError):
+            register(conn)
+        self.assertEqual(conn.calls[-1][0], 'box')
+
+    @skipIf(drivers.postgres is None, "psycopg 3 is not installed")
+    def test_psycopg(self):
+        import psycopg
+
+        settings = connection.settings_dict
+        conn = psycopg.connect(dbname=settings['NAME'], user=settings['USER'] or None,
+                               host=settings['HOST'] or None, port=settings['PORT'] or None,
+                               password=settings['PASSWORD'] or None)
+        try:
+            drivers.register_psycopg(conn)
+            for binary_format in (False, True):
+                cursor = conn.cursor(binary=binary_format)
+                for value in BinaryCodecTest.values:
+                    cursor.execute("SELECT %s", [value])
+                    self.assertEqual(cursor.fetchone()[0], value)
+        finally:
+            conn.close()
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        instrumentation.reset_stats()
+        Polygon.register_cast(connection, instrument=True)
+        Polygon.register_adapter(instrument=True)
+
+        self.events = []
+        signals.geometry_cast.connect(self.receiver)
+        signals.geometry_adapted.connect(self.receiver)
+        signals.geometric_types_registered.connect(self.receiver)
+
+    def tearDown(self):
+        signals.geometry_cast.disconnect(self.receiver)
+        signals.geometry_adapted.disconnect(self.receiver)
+        signals.geometric_types_registered.disconnect(self.receiver)
+
+        Polygon.register_cast(connection)
+        Polygon.register_adapter()
+        PolygonObjectModel.objects.all().delete()
+
+    def receiver(self, signal, **kwargs):
+        self.events.append((signal, kwargs))
+
+    def test_counters(self):
+        polygon = Polygon((0,0), (1,1), (2,0))
+        obj = PolygonObjectModel.objects.create(parea=polygon)
+        self.assertEqual(PolygonObjectModel.objects.get(pk=obj.pk).parea, polygon)
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT %s", [polygon])
+        self.assertEqual(cursor.fetchone()[0], polygon)
+        SomeObject.objects.create(pos=Point(1,1))
+
+        stats = instrumentation.get_stats()
+        self.assertEqual(stats["cast"]["Polygon"]["count"], 2)
+        self.assertEqual(stats["cast"]["Polygon"]["bytes"], 2 * len("((0,0),(1,1),(2,0))"))
+        self.assertEqual(stats["adapt"]["Polygon"]["count"], 2)
+        self.assertTrue(stats["adapt"]["Polygon"]["seconds"] > 0)
+        self.assertNotIn("Point", stats["adapt"])
+
+        self.assertEqual([e[0] for e in self.events], [signals.geometry_adapted,
+            signals.geometry_cast, signals.geometry_adapted, signals.geometry_cast])
+        self.assertEqual(self.events[1][1]["type_name"], "Polygon")
+
+    def test_payload_size(self):
+        self.assertEqual(instrumentation.payload_size(b"(1,2)"), 5)
+        self.assertEqual(instrumentation.payload_size(u"(1,\xe9)"), 6)
+
+    def test_disabled(self):
+        import psycopg2.extensions
+
+        Polygon.register_adapter()
+        self.assertIs(TEXT_MAPPER["Polygon"], text_polygon)
+        self.assertIs(psycopg2.extensions.adapters[(Polygon, psycopg2.extensions.ISQLQuote)],
+                      ADAPT_MAPPER["Polygon"])
+
+    def test_registration(self):
+        registry._installed = False
+        registry.register_geometric_types(connection)
+
+        signal, kwargs = self.events[-1]
+        self.assertIs(signal, signals.geometric_types_registered)
+        self.assertFalse(kwargs["instrumented"])
+        self.assertEqual(instrumentation.get_stats()["registration"],
+                         {"all": {"count": 1, "bytes": 0, "seconds": kwargs["duration"]}})
+
+
+class GeometrySummaryTest(TestCase):
+    def setUp(self):
+        self.polygon = Polygon.from_coords([0, 0, 4, 0, 4, 2, 0, 2])
+        PolygonObjectModel.objects.create(parea=self.polygon)
+        CircleObjectModel.objects.create(carea=Circle([1, 1], 2))
+        PathObjectModel.objects.create(parea=Path.from_coords([0, 0, 2, 2, 4, 0], closed=False))
+        SomeObject.objects.create(pos=Point(3, -1))
+
+    def test_only_bbox(self):
+        obj = PolygonObjectModel.objects.only_bbox('parea').get()
+        self.assertEqual(obj.parea_bbox, Box([0, 0], [4, 2]))
+        self.assertNotIn('parea', obj.__dict__)
+
+        # the deferred field is still loaded on access
+        self.assertEqual(obj.parea, self.polygon)
+
+        obj = CircleObjectModel.objects.only_bbox('carea', alias='extent').get()
+        self.assertEqual(obj.extent, Box([-1, -1], [3, 3]))
+
+        obj = SomeObject.objects.only_bbox('pos').get()
+        self.assertEqual(obj.pos_bbox, Point(3, -1).bounding_box())
+
+    def test_bbox_matches_objects(self):
+        for model, field in ((PolygonObjectModel, 'parea'), (CircleObjectModel, 'carea'),
+                             (PathObjectModel, 'parea'), (SomeObject, 'pos')):
+            obj = model.objects.only_bbox(field).get()
+            self.assertEqual(getattr(obj, field + '_bbox'),
+                             getattr(obj, field).bounding_box())
+
+    def test_geometry_summary(self):
+        obj = PolygonObjectModel.objects.geometry_summary('parea').get()
+        self.assertEqual(obj.parea_center, Point(2, 1))
+        self.assertEqual(obj.parea_npoints, 4)
+        self.assertEqual(obj.parea_area, 8)
+
+        obj = PathObjectModel.objects.geometry_summary('parea').get()
+        self.assertEqual(obj.parea_bbox, Box([0, 0], [4, 2]))
+        self.assertEqual(obj.parea_npoints, 3)
+
+        obj = SomeObject.objects.geometry_summary('pos').get()
+        self.assertEqual(obj.pos_center, Point(3, -1))
+        self.assertFalse(hasattr(obj, 'pos_area'))
+
+
+class CompanionBoundingBoxTest(TestCase):
+    def setUp(self):
+        self.square = Polygon.from_coords([0, 0, 2, 0, 2, 2, 0, 2])
+        self.path = Path.from_coords([0, 0, 3, 1, 1, 4], closed=False)
+
+    def extents(self):
+        return list(ShapeObjectModel.objects.order_by('pk')\
+            .values_list('path_bbox', 'polygon_extent'))
+
+    def test_fields(self):
+        fields = [f.name for f in ShapeObjectModel._meta.local_fields]
+        self.assertEqual(fields, ['id', 'path', 'polygon', 'path_bbox', 'polygon_extent'])
+
+        field = ShapeObjectModel._meta.get_field('polygon_extent')
+        self.assertEqual(field.source, 'polygon')
+        self.assertTrue(field.spatial_index)
+        self.assertFalse(field.editable)
+
+    def test_save(self):
+        obj = ShapeObjectModel.objects.create(path=self.path, polygon=self.square)
+        self.assertEqual(obj.path_bbox, self.path.bounding_box())
+
+        obj.polygon = None
+        obj.save()
+        self.assertEqual(self.extents(), [(Box([0, 0], [3, 4]), None)])
+
+    def test_bulk_insert(self):
+        ShapeObjectModel.objects.bulk_create([ShapeObjectModel(polygon=self.square)])
+        copy_insert(ShapeObjectModel, [(self.path, None)])
+        copy_insert(ShapeObjectModel, [ShapeObjectModel(path=self.path)], binary=True)
+        self.assertEqual(self.extents(), [
+            (None, Box([0, 0], [2, 2])),
+            (Box([0, 0], [3, 4]), None),
+            (Box([0, 0], [3, 4]), None),
+        ])
+
+    def test_update(self):
+        ShapeObjectModel.objects.create(path=self.path)
+        ShapeObjectModel.objects.update(polygon=self.square, path=None)
+        self.assertEqual(self.extents(), [(None, Box([0, 0], [2, 2]))])
+
+    def test_update_expression(self):
+        ShapeObjectModel.objects.create(path=self.path, polygon=self.square)
+        ShapeObjectModel.objects.update(path_bbox=None, polygon_extent=None)
+
+        ShapeObjectModel.objects.update(path=F('path'), polygon=F('polygon'))
+        self.assertEqual(self.extents(), [(Box([0, 0], [3, 4]), Box([0, 0], [2, 2]))])
+
+    def test_save_update_fields(self):
+        obj = ShapeObjectModel.objects.create(path=self.path, polygon=self.square)
+        obj.path = Path.from_coords([-1, -1, 5, 5], closed=False)
+        obj.polygon = None
+        obj.save(update_fields=["path", "path_bbox"])
+        self.assertEqual(self.extents(), [(Box([-1, -1], [5, 5]), Box([0, 0], [2, 2]))])
+
+        with self.assertRaises(ValueError):
+            obj.save(update_fields=["path"])
+
+        obj = ShapeObjectModel.objects.only('polygon', 'polygon_extent').get()
+        obj.polygon = Polygon.from_coords([0, 0, 1, 0, 0, 1])
+        obj.save()
+        self.assertEqual(self.extents(), [(Box([-1, -1], [5, 5]), Box([0, 0], [1, 1]))])
+
+        obj = ShapeObjectModel.objects.only('polygon').get()
+        with self.assertRaises(ValueError):
+            obj.save()
+
+    def test_prefilter(self):
+        ShapeObjectModel.objects.create(polygon=self.square)
+        ShapeObjectModel.objects.create(polygon=Polygon.from_coords([5, 5, 6, 5, 5, 6]))
+
+        qs = ShapeObjectModel.objects.where(
+            GeoExpression("polygon").contained_on(Polygon.from_coords([-1, -1, 3, -1, 3, 3, -1, 3])))
+        self.assertEqual(qs.count(), 1)
+
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('("pg_geometric_shapeobjectmodel"."polygon_extent" && %s::box AND '
+                      '"pg_geometric_shapeobjectmodel"."polygon" <@ %s::polygon)', sql)
+
+        qs = ShapeObjectModel.objects.where(
+            GeoExpression("polygon").overlaps([self.square, Polygon.from_coords([5, 5, 5, 6, 6, 6])]))
+        self.assertEqual(qs.count(), 2)
+
+        # operators not implying overlapping boxes are not prefiltered
+        qs = ShapeObjectModel.objects.where(
+            GeoExpression("polygon").is_strictly_left_of(Polygon.from_coords([4, 0, 4, 1, 5, 0])))
+        self.assertEqual(qs.count(), 1)
+        self.assertNotIn('polygon_extent', str(qs.query).split('WHERE')[1])
+
+    def test_lookup_prefilter(self):
+        ShapeObjectModel.objects.create(polygon=self.square)
+        qs = ShapeObjectModel.objects.filter(
+            polygon__overlaps=Polygon.from_coords([1, 1, 4, 1, 4, 4]))
+        self.assertEqual(qs.count(), 1)
+
+        sql, params = qs.query.sql_with_params()
+        self.assertIn('"pg_geometric_shapeobjectmodel"."polygon_extent" && %s::box AND', sql)
+
+    def test_only_bbox(self):
+        ShapeObjectModel.objects.create(polygon=self.square)
+        obj = ShapeObjectModel.objects.only_bbox('polygon').get()
+        self.assertNotIn('polygon', obj.__dict__)
+        self.assertEqual(obj.polygon_extent, Box([0, 0], [2, 2]))
+
+
+class WithinDistanceTest(TestCase):
+    def setUp(self):
+        rnd = random.Random(20)
+        self.point = Point(50, 50)
+        SomeObject.objects.bulk_create([SomeObject(pos=Point(rnd.uniform(0, 100),
+            rnd.uniform(0, 100))) for i in range(200)])
+        CircleObjectModel.objects.bulk_create([CircleObjectModel(carea=Circle(
+            [rnd.uniform(0, 100), rnd.uniform(0, 100)], rnd.uniform(0, 5))) for i in range(200)])
+        BoxObjectModel.objects.bulk_create([BoxObjectModel(barea=Box(
+            [x, y], [x + rnd.uniform(0, 5), y + rnd.uniform(0, 5)])) \
+            for x, y in [(rnd.uniform(0, 100), rnd.uniform(0, 100)) for i in range(200)]])
+        ShapeObjectModel.objects.bulk_create([ShapeObjectModel(
+            path=Path.from_coords([rnd.uniform(0, 100) for j in range(6)], closed=False),
+            polygon=Polygon.from_coords([rnd.uniform(0, 100) for j in range(6)])) \
+            for i in range(200)])
+
+    def exact(self, model, field, radius):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("SELECT id FROM %s WHERE %%s <-> %s <= %%s" % (
+            qn(model._meta.db_table), qn(field)), [self.point, radius])
+        return sorted(row[0] for row in cursor.fetchall())
+
+    def test_within_distance(self):
+        for model, field in ((SomeObject, 'pos'), (CircleObjectModel, 'carea'),
+                             (BoxObjectModel, 'barea'), (ShapeObjectModel, 'path'),
+                             (ShapeObjectModel, 'polygon')):
+            for radius in (0, 5, 20):
+                expected = self.exact(model, field, radius)
+                qs = model.objects.within_distance(field, self.point, radius)
+                self.assertEqual(sorted(qs.values_list('pk', flat=True)), expected)
+
+                qs = model.objects.where(~GeoExpression(field).within_distance(self.point, radius))
+                self.assertEqual(qs.count(), 200 - len(expected))
+
+    def test_sql(self):
+        qs = SomeObject.objects.within_distance('pos', self.point, 10)
+        self.assertIn('"pg_geometric_someobject"."pos" <@ circle(%s::point, %s)',
+                      qs.query.sql_with_params()[0])
+
+        qs = BoxObjectModel.objects.within_distance('barea', self.point, 10)
+        self.assertIn('("pg_geometric_boxobjectmodel"."barea" && %s::box AND '
+                      '%s::point <-> "pg_geometric_boxobjectmodel"."barea" <= %s)',
+                      qs.query.sql_with_params()[0])
+
+        # paths are prefiltered with their companion box column
+        qs = ShapeObjectModel.objects.within_distance('path', self.point, 10)
+        self.assertIn('("pg_geometric_shapeobjectmodel"."path_bbox" && %s::box AND',
+                      qs.query.sql_with_params()[0])
+
+    def test_distance_alias(self):
+        qs = CircleObjectModel.objects.within_distance('carea', self.point, 10,
+            distance_alias='distance')
+        self.assertTrue(qs.exists())
+        for obj in qs:
+            self.assertTrue(obj.distance <= 10)
+
+    def test_lookup(self):
+        qs = BoxObjectModel.objects.filter(barea__within_distance=(self.point, 20))
+        self.assertEqual(sorted(qs.values_list('pk', flat=True)),
+                         self.exact(BoxObjectModel, 'barea', 20))
+
+
+class SerializersTest(TestCase):
+    values = [
+        Point(1, 2),
+        Lseg([0, 0], [1.5, -2]),
+        Box([2, 2], [0, 0]),
+        Circle([0, 0], 1),
+        Path.from_coords([0, 0, 1, 1, 2, 0], closed=False),
+        Path.from_coords([0, 0, 1, 1, 2, 0]),
+        Polygon.from_coords([0, 0, 1, 1, 2, 0]),
+    ]
+
+    def test_geojson(self):
+        self.assertEqual(serializers.to_geojson(Point(1, 2)),
+                         {"type": "Point", "coordinates": [1, 2]})
+        self.assertEqual(serializers.to_geojson(Box([2, 2], [0, 0])), {"type": "Polygon",
+            "coordinates": [[[2, 2], [0, 2], [0, 0], [2, 0], [2, 2]]]})
+        self.assertEqual(serializers.to_geojson(Path.from_coords([0, 0, 1, 1], closed=False)),
+                         {"type": "LineString", "coordinates": [[0, 0], [1, 1]]})
+
+        for value in self.values:
+            self.assertEqual(json.loads(serializers.geojson(value)),
+                             serializers.to_geojson(value))
+        self.assertEqual(serializers.geojson(None), "null")
+
+    def test_circle_vertices(self):
+        ring = serializers.to_geojson(Circle([1, 1], 2), vertices=8)["coordinates"][0]
+        self.assertEqual(len(ring), 9)
+        self.assertEqual(ring[0], ring[-1])
+        self.assertEqual(ring[0], [3, 1])
+        for x, y in ring:
+            self.assertAlmostEqual((x - 1) ** 2 + (y - 1) ** 2, 4)
+
+    def test_wkt(self):
+        self.assertEqual(serializers.wkt(Point(1, 2.5)), "POINT (1.0 2.5)")
+        self.assertEqual(serializers.wkt(Lseg([0, 0], [1.5, -2])),
+                         "LINESTRING (0.0 0.0, 1.5 -2.0)")
+        self.assertEqual(serializers.wkt(Polygon.from_coords([0, 0, 1, 1, 2, 0])),
+                         "POLYGON ((0.0 0.0, 1.0 1.0, 2.0 0.0, 0.0 0.0))")
+        self.assertEqual(serializers.wkt(Path.from_coords([0, 0, 1, 1, 2, 0])),
+                         "LINESTRING (0.0 0.0, 1.0 1.0, 2.0 0.0, 0.0 0.0)")
+
+    def test_wkb(self):
+        for value in self.values:
+            data = serializers.wkb(value)
+            byte_order = "<" if data[:1] == b"\x01" else ">"
+            kind = struct.unpack(byte_order + "I", data[1:5])[0]
+            expected = serializers.to_geojson(value)
+
+            if kind == serializers.WKB_POINT:
+                self.assertEqual(expected["type"], "Point")
+                self.assertEqual(list(struct.unpack(byte_order + "2d", data[5:])),
+                                 expected["coordinates"])
+                continue
+
+            if kind == serializers.WKB_POLYGON:
+                self.assertEqual(expected["type"], "Polygon")
+                self.assertEqual(struct.unpack(byte_order + "I", data[5:9])[0], 1)
+                data, points = data[4:], expected["coordinates"][0]
+            else:
+                self.assertEqual(kind, serializers.WKB_LINESTRING)
+                points = expected["coordinates"]
+
+            count = struct.unpack(byte_order + "I", data[5:9])[0]
+            self.assertEqual(count, len(points))
+            self.assertEqual(list(struct.unpack(byte_order + "%dd" % (count * 2), data[9:])),
+                             [c for point in points for c in point])
+
+    def test_stream_geojson(self):
+        box = BoxObjectModel.objects.create(barea=Box([1, 1], [0, 0]))
+        BoxObjectModel.objects.create(barea=None)
+
+        qs = BoxObjectModel.objects.order_by('pk')
+        pieces = list(serializers.stream_geojson(qs, 'barea', ['other'], chunk_size=1))
+        self.assertTrue(len(pieces) > 3)
+
+        document = json.loads("".join(pieces))
+        self.assertEqual(document["type"], "FeatureCollection")
+        self.assertEqual(len(document["features"]), 2)
+        self.assertEqual(document["features"][0], {"type": "Feature", "id": box.pk,
+            "geometry": serializers.to_geojson(BoxObjectModel.objects.get(pk=box.pk).barea),
+            "properties": {"other": None}})
+        self.assertEqual(document["features"][1]["geometry"], None)
+
+        self.assertEqual(json.loads("".join(serializers.stream_geojson(
+            qs.filter(pk=0), 'barea'))), {"type": "FeatureCollection", "features": []})
+
+    def test_non_finite(self):
+        for value in (Point(float("inf"), 1), Box([0, float("nan")], [1, 1]),
+                      Polygon.from_coords([0, 0, float("-inf"), 1, 2, 0])):
+            with self.assertRaises(ValueError):
+                serializers.geojson(value)
+            with self.assertRaises(ValueError):
+                serializers.to_geojson(value)
+
+        self.assertEqual(json.loads(serializers.geojson(Point(1e300, -1e-300))),
+                         {"type": "Point", "coordinates": [1e300, -1e-300]})
+        self.assertEqual(serializers.wkt(Point(float("inf"), 1)), "POINT (inf 1.0)")
+
+    def test_stream_wkt_wkb(self):
+        box = BoxObjectModel.objects.create(barea=Box([1, 1], [0, 0]))
+        empty = BoxObjectModel.objects.create(barea=None)
+        value = BoxObjectModel.objects.get(pk=box.pk).barea
+
+        qs = BoxObjectModel.objects.order_by('pk')
+        self.assertEqual(list(serializers.stream_wkt(qs, 'barea', chunk_size=1)),
+                         [(box.pk, serializers.wkt(value)), (empty.pk, None)])
+        self.assertEqual(list(serializers.stream_wkb(qs, 'barea')),
+                         [(box.pk, serializers.wkb(value)), (empty.pk, None)])
+
+
+class PicklingTest(SimpleTestCase):
+    values = [
+        Point(1, -2.5),
+        Circle([1.5, 2], 3),
+        Lseg([0, 1], [2.5, 3]),
+        Box([2, 3], [0, 1]),
+        Path.from_coords([0, 0, 1.5, 1, 2, 0], closed=False),
+        Path.from_coords([0, 0, 1.5, 1, 2, 0]),
+        Polygon.from_coords([0, 0, 1.5, 1, 2, 0]),
+    ]
+
+    def polygon(self, vertices):
+        return Polygon.from_coords([i * 0.25 for i in range(vertices * 2)])
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            for value in self.values:
+                result = pickle.loads(pickle.dumps(value, protocol))
+                self.assertEqual(result, value)
+                self.assertEqual(type(result), type(value))
+                if isinstance(value, Path):
+                    self.assertEqual(result.closed, value.closed)
+
+        lazy = LazyGeometry(Polygon, TEXT_MAPPER['Polygon'](self.values[-1]),
+                            CAST_MAPPER['Polygon'])
+        self.assertEqual(type(pickle.loads(pickle.dumps(lazy, 2))), Polygon)
+
+    def test_dumps(self):
+        for value in self.values + [None, self.values, []]:
+            self.assertEqual(serializers.loads(serializers.dumps(value)),
+                             list(value) if isinstance(value, list) else value)
+
+        self.assertEqual(type(serializers.loads(serializers.dumps(self.values[4]))), Path)
+        self.assertEqual(len(serializers.dumps(Point(1, 2))), 17)
+
+        data = serializers.dumps(self.values)
+        for broken in (data[:-1], data[:-8], data + b"N", b"X"):
+            self.assertRaises(ValueError, serializers.loads, broken)
+
+    def test_size(self):
+        polygon = self.polygon(1000)
+        points = list(polygon)
+        packed = len(polygon.coords) * 8
+
+        # a packed buffer against a pickled object per point
+        self.assertTrue(len(serializers.dumps(polygon)) < packed + 8)
+        self.assertTrue(len(pickle.dumps(polygon, 2)) < packed + 200)
+        self.assertTrue(len(pickle.dumps(points, 2)) > 1.5 * packed)
+
+
+class ClusterGridTest(TestCase):
+    def setUp(self):
+        rnd = random.Random(24)
+        self.points = [Point(rnd.uniform(-10, 10), rnd.uniform(-10, 10)) for i in range(500)]
+        copy_insert(SomeObject, [(p,) for p in self.points] + [(None,)])
+
+    def bucket(self, points, width, height, origin=(0, 0)):
+        cells = {}
+        for p in points:
+            cell = (int(math.floor((p.x - origin[0]) / width)),
+                    int(math.floor((p.y - origin[1]) / height)))
+            cells.setdefault(cell, []).append(p)
+        return cells
+
+    def assertClusters(self, clusters, cells):
+        self.assertEqual([c["cell"] for c in clusters], sorted(cells))
+        for cluster in clusters:
+            points = cells[cluster["cell"]]
+            self.assertEqual(cluster["count"], len(points))
+            self.assertAlmostEqual(cluster["center"].x, sum(p.x for p in points) / len(points))
+            self.assertAlmostEqual(cluster["center"].y, sum(p.y for p in points) / len(points))
+            self.assertEqual(cluster["extent"], Box(
+                [min(p.x for p in points), min(p.y for p in points)],
+                [max(p.x for p in points), max(p.y for p in points)]))
+
+    def test_cluster_grid(self):
+        clusters = SomeObject.objects.cluster_grid('pos', 5)
+        self.assertEqual(sum(c["count"] for c in clusters), 500)
+        self.assertClusters(clusters, self.bucket(self.points, 5, 5))
+
+        clusters = SomeObject.objects.filter(pk__gt=0).cluster_grid('pos', (4, 2.5), origin=(1, -1))
+        self.assertClusters(clusters, self.bucket(self.points, 4, 2.5, (1, -1)))
+
+    def test_viewport(self):
+        viewport = Box([0, 0], [8, 6])
+        inside = [p for p in self.points if 0 <= p.x <= 8 and 0 <= p.y <= 6]
+        clusters = SomeObject.objects.cluster_grid('pos', 2, bbox=viewport)
+        self.assertClusters(clusters, self.bucket(inside, 2, 2))
+
+    def test_centers(self):
+        copy_insert(CircleObjectModel, [(Circle(p, 1),) for p in self.points[:100]])
+        clusters = CircleObjectModel.objects.cluster_grid('carea', 5, bbox=Box([-10, -10], [0, 10]))
+        self.assertClusters(clusters, self.bucket([p for p in self.points[:100] if p.x <= 0], 5, 5))